@@ -0,0 +1,35 @@
+"""
+Benchmark: import time of the sc package and its submodules, each measured in a fresh interpreter, and the heavy
+dependencies that each import loads
+
+Usage: python bench_import.py [n_repeats]
+"""
+import json
+import subprocess
+import sys
+
+modules = ['sc', 'sc.utils', 'sc.markerr', 'sc.batch', 'sc.analyze', 'sc.plots']
+heavy = ['numpy', 'pandas', 'openpyxl', 'scipy', 'matplotlib', 'mtl']
+
+code = """
+import sys, time, json
+t0 = time.perf_counter()
+import {module}
+dt = time.perf_counter() - t0
+print(json.dumps(dict(time=dt, loaded=[m for m in {heavy!r} if m in sys.modules])))
+"""
+
+
+#---------------------------------------------------------------------------
+def measure(module):
+    out = subprocess.run([sys.executable, '-c', code.format(module=module, heavy=heavy)], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+
+n_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+print('{:<12} {:>10}   {}'.format('Module', 'Time (ms)', 'Heavy dependencies loaded'))
+for module in modules:
+    results = [measure(module) for _ in range(n_repeats)]
+    best = min(r['time'] for r in results)
+    print('{:<12} {:>10.0f}   {}'.format(module, best * 1000, ', '.join(results[0]['loaded']) or '-'))
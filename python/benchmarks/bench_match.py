@@ -0,0 +1,60 @@
+"""
+Micro-benchmark: target-response matching of many trials - per row (ErrorAnalyzer.target_items_said() and
+_n_missing_classes()) vs. the batched matcher (sc.matcher)
+
+Usage: python bench_match.py [n_trials]
+"""
+import random
+import sys
+import time
+
+import sc.markerr
+import sc.matcher
+
+trials = [('3 t 450 / 27', '3 t 540 / 27'), ('48725', '48 t 725'), ('234', '243'), ('21 / 1000 / 2', '21 / 1000 / 3'),
+          ('560 / 23', '506 / 23'), ('5 t 12', '12 t 5'), ('12 t 345', '12 t 354'), ('222', '22'), ('7000 / 45', '45')]
+
+
+#---------------------------------------------------------------------------
+def per_row(analyzer, targets, responses):
+    for t, r in zip(targets, responses):
+        analyzer.target_items_said(t, r)
+        analyzer._n_missing_classes(t, r)
+
+
+def best_time(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+#---------------------------------------------------------------------------
+n_trials = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+random.seed(1)
+
+analyzer = sc.markerr.ErrorAnalyzer()
+parsed = []
+for raw_target, raw_response in trials:
+    target, target_segments = analyzer.parse_target(raw_target, 0)
+    parsed.append((target, analyzer.collapse_segments(analyzer.parse_response(raw_response, 0, target_segments))))
+
+sample = [random.choice(parsed) for _ in range(n_trials)]
+targets = [t for t, r in sample]
+responses = [r for t, r in sample]
+
+t0 = time.perf_counter()
+enc_target = sc.matcher.word_table.encode(targets)
+enc_response = sc.matcher.word_table.encode(responses)
+encoding_time = time.perf_counter() - t0
+
+t_row = best_time(lambda: per_row(analyzer, targets, responses))
+t_batch = best_time(lambda: sc.matcher.match_words(enc_target, enc_response, n_trials))
+
+print('Matching {} trials:'.format(n_trials))
+print('   Per row:           {:>12,.0f} trials/sec'.format(n_trials / t_row))
+print('   Batched matcher:   {:>12,.0f} trials/sec  (x{:.1f}; encoding the words took another {:.2f} sec)'.format(
+      n_trials / t_batch, t_row / t_batch, encoding_time))
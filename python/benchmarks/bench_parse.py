@@ -0,0 +1,82 @@
+"""
+Micro-benchmark: per-row throughput of target/response tokenizing with SegmentTokenizer, compared with the previous
+code path (re.match with a pattern string per segment, and one str.replace per unknown-response character)
+
+Usage: python bench_parse.py [n_rows]
+"""
+import random
+import re
+import sys
+import time
+
+import sc.markerr
+
+unknown_response_chars = ('-', '?', 'd')
+
+targets = ['3 t 450 / 27', '48725', '234', '21 / 1000 / 2', '2 / 3', '7000 / 45', '560 / 23', '5 t 12', '12 t 345']
+responses = ['+', '3 t 450 / 28', '48 t 725;7', '200 / 34', '21 / 1000 / 3', '-', '1-3', '4,725', '4?5 / 27']
+
+
+#---------------------------------------------------------------------------
+def legacy_tokenize(raw_target, raw_response):
+    for raw_text in (raw_target, raw_response):
+        m = re.match('(.*);(.+)', raw_text)
+        texts = [raw_text] if m is None else [m.group(1), m.group(2)]
+        for text in texts:
+            for seg in [e.strip() for e in text.split('/')]:
+                m = re.match('^([0-9,]*)\\s*t\\s*([0-9,]+)?$', seg)
+                parts = [seg] if m is None else [m.group(1), m.group(2) or '']
+                for part in parts:
+                    part = part.replace(',', '')
+                    for c in unknown_response_chars:
+                        if c not in ('x', 'X'):
+                            part = part.replace(c, 'x')
+
+
+def tokenizer_tokenize(tokenizer, raw_target, raw_response):
+    for raw_text in (raw_target, raw_response):
+        main, optional = tokenizer.split_optional(raw_text)
+        texts = [main] if optional is None else [main, optional]
+        for text in texts:
+            for seg, pre_thousand, post_thousand in tokenizer.segments(text):
+                parts = [seg] if pre_thousand is None else [pre_thousand, post_thousand or '']
+                for part in parts:
+                    tokenizer.clean_digits(part)
+
+
+#---------------------------------------------------------------------------
+def rows_per_sec(func, rows, repeat=5):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for row in rows:
+            func(*row)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return len(rows) / best
+
+
+def parse_row(analyzer, raw_target, raw_response):
+    target, target_segments = analyzer.parse_target(raw_target, 0)
+    analyzer.analyze_response(raw_response, target, target_segments, 0)
+
+
+#---------------------------------------------------------------------------
+n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+random.seed(1)
+rows = [(random.choice(targets), random.choice(responses)) for _ in range(n_rows)]
+
+tokenizer = sc.markerr.SegmentTokenizer(unknown_response_chars)
+legacy = rows_per_sec(legacy_tokenize, rows)
+new = rows_per_sec(lambda t, r: tokenizer_tokenize(tokenizer, t, r), rows)
+
+print('Tokenizing, {} rows:'.format(n_rows))
+print('   Previous code path: {:>10,.0f} rows/sec'.format(legacy))
+print('   SegmentTokenizer:   {:>10,.0f} rows/sec  (x{:.2f})'.format(new, new / legacy))
+
+analyzer_uncached = sc.markerr.ErrorAnalyzer(unknown_response_chars=unknown_response_chars, parse_cache=False)
+analyzer_cached = sc.markerr.ErrorAnalyzer(unknown_response_chars=unknown_response_chars, parse_cache=sc.markerr.ParseCache())
+
+print('Full parsing + matching (parse_target, analyze_response):')
+print('   No parse cache:     {:>10,.0f} rows/sec'.format(rows_per_sec(lambda t, r: parse_row(analyzer_uncached, t, r), rows, 1)))
+print('   With parse cache:   {:>10,.0f} rows/sec'.format(rows_per_sec(lambda t, r: parse_row(analyzer_cached, t, r), rows, 1)))
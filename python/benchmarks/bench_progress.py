@@ -0,0 +1,75 @@
+"""
+Benchmark: the data of plot_performance_progress() - the mean and standard error per condition, block and quartile -
+with the previous implementation (masks per condition, block, quartile and subject) vs. one groupby aggregation
+
+Usage: python bench_progress.py [n_subjects]
+"""
+import math
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import sc.plots
+
+
+#---------------------------------------------------------------------------
+def per_mask(df, dependent_var, x_per_block_and_quartile):
+    """ The previous implementation of get_data_per_cond_block_quartile() """
+    result = {}
+
+    for cond in df.Condition.unique():
+        cdf = df[df.Condition == cond]
+        result[cond] = []
+
+        for block in sorted(df.block.unique()):
+            block_x = []
+            block_y = []
+            block_se = []
+            for quartile in sorted(df.quartile.unique()):
+                qdf = cdf[(cdf.block == block) & (cdf.quartile == quartile)]
+                mean_per_subject = [qdf[qdf.Subject == s][dependent_var].mean() for s in qdf.Subject.unique()]
+                block_x.append(x_per_block_and_quartile[block][quartile])
+                block_y.append(np.mean(mean_per_subject))
+                block_se.append(np.std(mean_per_subject) / math.sqrt(len(mean_per_subject)))
+
+            result[cond].append(dict(x=np.array(block_x), y=np.array(block_y), se=np.array(block_se)))
+
+    return result
+
+
+def best_time(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+#---------------------------------------------------------------------------
+n_subjects = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+rng = np.random.default_rng(1)
+
+#-- 4 conditions x 3 blocks x 32 items per subject; quartiles of 8 items
+n_items = 32
+subj, cond, block, item = [a.ravel() for a in np.meshgrid(np.arange(n_subjects), list('ABCD'), np.arange(3), np.arange(n_items),
+                                                          indexing='ij')]
+df = pd.DataFrame(dict(Subject=subj, Condition=cond, block=block, ItemNum=item, quartile=item // 8 + 1,
+                       PMissingMorphemes=rng.random(len(subj))))
+print('{} subjects, {} rows'.format(n_subjects, len(df)))
+
+x_per_block_and_quartile = sc.plots._get_x_per_block_and_quartile(df)[0]
+
+old = per_mask(df, 'PMissingMorphemes', x_per_block_and_quartile)
+new = sc.plots.get_data_per_cond_block_quartile(df, 'PMissingMorphemes', x_per_block_and_quartile)
+same = old.keys() == new.keys() and all(np.array_equal(o['x'], n['x']) and np.allclose(o['y'], n['y']) and np.allclose(o['se'], n['se'])
+                                        for c in old for o, n in zip(old[c], new[c]))
+print('Same results: {}'.format(same))
+
+t_old = best_time(lambda: per_mask(df, 'PMissingMorphemes', x_per_block_and_quartile))
+t_new = best_time(lambda: sc.plots.get_data_per_cond_block_quartile(df, 'PMissingMorphemes', x_per_block_and_quartile))
+print('Per-mask loops: {:.3f} sec'.format(t_old))
+print('Groupby:        {:.3f} sec ({:.0f}x faster)'.format(t_new, t_old / t_new))
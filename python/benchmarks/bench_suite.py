@@ -0,0 +1,214 @@
+"""
+Benchmark suite: coding (ErrorAnalyzer.run_for_worksheets), loading, the sc.analyze functions and the sc.plots functions,
+on synthetic raw data (see synthetic.py) at several multiples of the size of a current study.
+
+Each run is appended to a results file (one JSON record per scale), and the timings are printed next to those of
+the previous run with the same data size, so that runs can be compared over time.
+
+Usage: python bench_suite.py [--scales 1 10 100] [--repeat 3] [--n-jobs N] [--work-dir DIR] [--results FILE] [--no-save]
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+import sc.analyze
+import sc.loader
+import sc.markerr
+import sc.plots
+
+from synthetic import generate_raw_data, unknown_chars
+
+#-- The size of a current study (scale = 1); larger scales have more subjects
+study_size = dict(n_subjects=30, n_items=32, conditions=('A', 'B', 'C', 'D'), error_rate=0.2)
+
+dependent_vars = ['PMissingDigits', 'PMissingClasses', 'PMissingMorphemes']
+
+default_results_fn = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_suite_results.jsonl')
+
+
+#---------------------------------------------------------------------------
+def best_time(func, repeat=1, setup=None):
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def raw_data_file(work_dir, scale):
+    """ The raw data of this scale (generated once, and reused by later runs) """
+    size = dict(study_size, n_subjects=study_size['n_subjects'] * scale)
+    filename = os.path.join(work_dir, 'raw_{n_subjects}x{n_items}x{n_conds}_{error_rate}.xlsx'.format(n_conds=len(size['conditions']), **size))
+    if not os.path.exists(filename):
+        print('Generating {}...'.format(filename))
+        generate_raw_data(filename + '.tmp.xlsx', **size)
+        os.replace(filename + '.tmp.xlsx', filename)
+    return filename, size
+
+
+#---------------------------------------------------------------------------
+def run_scale(scale, work_dir, repeat, n_jobs):
+    """ Run all the benchmarks on the data of one scale. Returns the data size, the number of coded rows and a dict: benchmark -> seconds """
+
+    raw_fn, size = raw_data_file(work_dir, scale)
+    out_dir = tempfile.mkdtemp(dir=work_dir)
+    try:
+        n_rows, timings = _run_benchmarks(raw_fn, size, out_dir, repeat, n_jobs)
+    finally:
+        shutil.rmtree(out_dir)
+
+    return size, n_rows, timings
+
+
+def _run_benchmarks(raw_fn, size, out_dir, repeat, n_jobs):
+
+    timings = {}
+
+    #-- Coding
+    analyzer = sc.markerr.ErrorAnalyzer(subj_id_in_xls=False, unknown_response_chars=unknown_chars)
+    timings['markerr.run_for_worksheets'] = best_time(lambda: analyzer.run_for_worksheets(raw_fn, out_dir=out_dir))
+    if n_jobs > 1:
+        timings['markerr.run_for_worksheets(n_jobs={})'.format(n_jobs)] = \
+            best_time(lambda: analyzer.run_for_worksheets(raw_fn, out_dir=out_dir, n_jobs=n_jobs))
+
+    #-- Loading the coded data
+    coded_fn = os.path.join(out_dir, 'data_coded.xlsx')
+    words_fn = os.path.join(out_dir, 'data_coded_words.csv')
+    timings['loader.load_data'] = best_time(lambda: sc.loader.load_data(coded_fn, use_cache=False), repeat)
+
+    df = sc.loader.load_data(coded_fn, use_cache=False)
+    df['block'] = df.Block
+    df['quartile'] = (df.ItemNum - 1) * 4 // size['n_items'] + 1
+    words = sc.loader.load_data(words_fn, use_cache=False)
+    #-- The per-position figure is for targets of one length: single 4-digit numbers
+    words = words[(words.n_target_words == 4) & ~words.target.astype(str).str.contains('/')]
+
+    conds = list(size['conditions'])
+    subj_ids = sorted(df.Subject.unique())
+    half = df.Subject.isin(subj_ids[::2])
+    #-- The per-subject figure shows the first 12 subjects (in the default groups of 3)
+    subj_grouping = [subj_ids[i:i+3] for i in range(0, 12, 3)]
+
+    #-- The paired tests need the same items in all conditions (i.e., without the excluded trials)
+    n_conds_per_item = df.groupby(['Subject', 'ItemNum']).Condition.transform('size')
+    paired_df = df[n_conds_per_item == len(conds)]
+
+    #-- Analyses (the cached cubes are cleared before each run)
+    analyses = {
+        'analyze.DataSummary': lambda: sc.analyze.DataSummary(df, dependent_vars),
+        'analyze.compare_conds_per_item': lambda: sc.analyze.compare_conds_per_item(df, conds[0], conds[-1], dependent_vars[0]),
+        'analyze.paired_tests_per_subj': lambda: sc.analyze.paired_tests_per_subj(paired_df, list(zip(conds[:-1], conds[1:])), dependent_vars),
+        'analyze.compare_conds_sign_flip': lambda: sc.analyze.compare_conds_sign_flip(df, conds[0], conds[-1], dependent_vars[0],
+                                                                                       n_permutations=1000, seed=0),
+        'analyze.compare_effect_size': lambda: sc.analyze.compare_effect_size(dependent_vars[0], df[half], df[~half],
+                                                                              conds[:2], conds[:2]),
+        'analyze.get_value_per_subj_and_cond': lambda: sc.analyze.get_value_per_subj_and_cond(conds, dependent_vars[0], df, subj_ids),
+    }
+    for name, func in analyses.items():
+        timings[name] = best_time(func, repeat, setup=sc.analyze.clear_cube_cache)
+
+    #-- Figures
+    fig_dir = os.path.join(out_dir, 'figures')
+    os.makedirs(fig_dir)
+    figures = {
+        'plots.plot_cond_means': lambda: sc.plots.plot_cond_means(df, dependent_vars[0], os.path.join(fig_dir, 'means.png')),
+        'plots.plot_cond_means_multiple_measures': lambda: sc.plots.plot_cond_means_multiple_measures(
+            df, dependent_vars, os.path.join(fig_dir, 'measures.png'), ymax=1, d_y_ticks=0.2, conditions=conds),
+        'plots.plot_2cond_means_per_subject': lambda: sc.plots.plot_2cond_means_per_subject(
+            df, dependent_vars[0], os.path.join(fig_dir, 'subj_2conds.png'), conds=conds[:2]),
+        'plots.plot_cond_means_per_subject': lambda: sc.plots.plot_cond_means_per_subject(
+            df, dependent_vars[0], os.path.join(fig_dir, 'subj_means.png'), subj_grouping=subj_grouping),
+        'plots.plot_performance_progress': lambda: sc.plots.plot_performance_progress(
+            df, dependent_vars[0], 'Errors', os.path.join(fig_dir, 'progress.png'), ymax=1, d_y_ticks=0.2, fig_size=(6, 3)),
+        'plots.plot_digit_accuracy_per_position': lambda: sc.plots.plot_digit_accuracy_per_position(
+            words, os.path.join(fig_dir, 'positions.png'), conditions=conds),
+    }
+    for name, func in figures.items():
+        timings[name] = best_time(func, repeat, setup=sc.analyze.clear_cube_cache)
+        plt.close('all')
+
+    return len(df), timings
+
+
+#---------------------------------------------------------------------------
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(results_fn):
+    if not os.path.exists(results_fn):
+        return []
+    with open(results_fn) as fp:
+        return [json.loads(line) for line in fp if line.strip() != '']
+
+
+def previous_record(records, record):
+    """ The latest record of an earlier run with the same data size """
+    same_size = [r for r in records if r['scale'] == record['scale'] and r['n_rows'] == record['n_rows']]
+    return same_size[-1] if len(same_size) > 0 else None
+
+
+def print_record(record, previous):
+    print('\nScale {}x: {} subjects, {} coded rows'.format(record['scale'], record['n_subjects'], record['n_rows']))
+    if previous is None:
+        print('{:<45} {:>10}'.format('Benchmark', 'Time (s)'))
+    else:
+        print('{:<45} {:>10} {:>10} {:>8}   (previous: {}, commit {})'.format('Benchmark', 'Time (s)', 'Previous', 'Change',
+                                                                             previous['time'], previous['commit']))
+
+    for name, t in record['timings'].items():
+        prev_t = None if previous is None else previous['timings'].get(name)
+        if prev_t is None:
+            print('{:<45} {:>10.3f}'.format(name, t))
+        else:
+            print('{:<45} {:>10.3f} {:>10.3f} {:>+7.0f}%'.format(name, t, prev_t, (t / prev_t - 1) * 100))
+
+
+#---------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark coding, analyses and figures on synthetic data')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help='Data sizes, as multiples of a current study')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions of each analysis/figure (the best time is reported)')
+    parser.add_argument('--n-jobs', type=int, default=1, help='If > 1, the coding is also timed with this number of processes')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'sc_bench_suite'),
+                        help='Directory for the raw data (reused by later runs) and the coded data')
+    parser.add_argument('--results', default=default_results_fn, help='File with the results of all runs (JSON lines)')
+    parser.add_argument('--no-save', action='store_true', help="Don't save the results of this run")
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    records = load_results(args.results)
+    run_info = dict(time=datetime.datetime.now().isoformat(timespec='seconds'), commit=git_commit(),
+                    python=platform.python_version(), platform=sys.platform)
+
+    for scale in args.scales:
+        size, n_rows, timings = run_scale(scale, args.work_dir, args.repeat, args.n_jobs)
+        record = dict(run_info, scale=scale, n_subjects=size['n_subjects'], n_items=size['n_items'],
+                      n_conditions=len(size['conditions']), error_rate=size['error_rate'], n_rows=n_rows, timings=timings)
+        print_record(record, previous_record(records, record))
+
+        if not args.no_save:
+            with open(args.results, 'a') as fp:
+                fp.write(json.dumps(record) + '\n')
@@ -0,0 +1,77 @@
+"""
+Benchmark: the means plotted by a set of figures (per condition, per measure x condition, per subject x condition) -
+with the previous implementation (a mask per condition/measure/subject in each plot function) vs. one DataSummary
+that all the plot functions share
+
+Usage: python bench_summary.py [n_subjects]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from sc.analyze import DataSummary
+
+dependent_vars = ['PMissingMorphemes', 'PMissingDigits', 'PMissingClasses']
+
+
+#---------------------------------------------------------------------------
+def per_mask(df):
+    """ The means, computed as the plot functions previously computed them """
+    conditions = sorted(df.Condition.unique())
+    result = {}
+
+    #-- plot_cond_means() and plot_cond_means_multiple_measures()
+    for dv in dependent_vars:
+        for cond in conditions:
+            result[(dv, cond)] = df[df.Condition == cond][dv].mean()
+
+    #-- plot_cond_means_per_subject()
+    for subj in sorted(df.Subject.unique()):
+        subj_df = df[df.Subject == subj]
+        for cond in conditions:
+            result[(subj, cond)] = subj_df[subj_df.Condition == cond][dependent_vars[0]].mean()
+
+    return result
+
+
+def with_summary(df):
+    summary = DataSummary(df, dependent_vars, ('Subject', 'Condition'))
+    result = {}
+
+    for dv in dependent_vars:
+        result.update({(dv, cond): m for cond, m in summary.mean(dv, ['Condition']).items()})
+
+    result.update(summary.mean(dependent_vars[0]).to_dict())
+
+    return result
+
+
+def best_time(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+#---------------------------------------------------------------------------
+n_subjects = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+rng = np.random.default_rng(1)
+
+#-- 4 conditions x 96 items per subject
+subj, cond, item = [a.ravel() for a in np.meshgrid(np.arange(n_subjects), list('ABCD'), np.arange(96), indexing='ij')]
+df = pd.DataFrame(dict(Subject=subj, Condition=cond, ItemNum=item, **{dv: rng.random(len(subj)) for dv in dependent_vars}))
+print('{} subjects, {} rows'.format(n_subjects, len(df)))
+
+old = per_mask(df)
+new = with_summary(df)
+print('Same results: {}'.format(old.keys() == new.keys() and all(np.isclose(old[k], new[k]) for k in old)))
+
+t_old = best_time(lambda: per_mask(df))
+t_new = best_time(lambda: with_summary(df))
+print('Per-mask loops: {:.3f} sec'.format(t_old))
+print('DataSummary:    {:.3f} sec ({:.0f}x faster)'.format(t_new, t_old / t_new))
@@ -0,0 +1,148 @@
+"""
+A generator of synthetic raw data in the ErrorAnalyzer input format: one worksheet per subject, with the columns Block,
+Condition, ItemNum, target, response, NWordsPerTarget, exclude and manual (as ErrorAnalyzer(subj_id_in_xls=False) reads them).
+
+The targets are 1-3 numbers separated by "/", some of them written with "t" (thousand), e.g. "3 t 450 / 27".
+The responses use the same grammar: "+" for a correct response or a correct number, errors in digits, digit order,
+number length and omitted numbers, unknown digits ("-", "?"), no response, and optional parts after ";".
+
+Usage: python synthetic.py out.xlsx [n_subjects] [n_items] [n_conditions] [error_rate]
+"""
+import sys
+
+import numpy as np
+import openpyxl
+
+import sc.markerr
+
+unknown_chars = ('-', '?')
+
+error_types = ('digit', 'swap', 'omit_digit', 'add_zero', 'omit_number', 'unknown_digit', 'no_response', 'optional')
+
+
+#---------------------------------------------------------------------------
+def generate_raw_data(filename, n_subjects=30, n_items=32, conditions=('A', 'B', 'C', 'D'), error_rate=0.2, exclude_rate=0.02,
+                      seed=1):
+    """
+    Create an Excel file with the raw data of a synthetic experiment: the same items in all conditions and for all subjects.
+    Each condition is a block; the order of blocks is rotated between subjects.
+
+    :param n_items: Number of items (presented in each condition)
+    :param error_rate: The mean proportion of trials with an incorrect response. It increases from the first condition
+                       to the last one, and varies between subjects.
+    :param exclude_rate: Proportion of trials marked as excluded
+    :return: The number of trials
+    """
+    rng = np.random.default_rng(seed)
+    analyzer = sc.markerr.ErrorAnalyzer(subj_id_in_xls=False, unknown_response_chars=unknown_chars)
+
+    targets = [_random_target(rng) for _ in range(n_items)]
+    n_words = {t: len(analyzer.parse_target(t, 0)[0]) for t in targets}
+
+    cond_factors = np.linspace(0.8, 1.2, len(conditions)) if len(conditions) > 1 else np.ones(1)
+
+    wb = openpyxl.Workbook(write_only=True)
+    n_trials = 0
+
+    for subj_num in range(n_subjects):
+        ws = wb.create_sheet('S{:04d}'.format(subj_num + 1))
+        ws.append(['Block', 'Condition', 'ItemNum', 'target', 'response', 'NWordsPerTarget', 'exclude', 'manual'])
+
+        subj_factor = rng.uniform(0.5, 1.5)
+        for block in range(len(conditions)):
+            cond_num = (block + subj_num) % len(conditions)
+            cond = conditions[cond_num]
+            p_error = min(error_rate * cond_factors[cond_num] * subj_factor, 0.95)
+
+            for item_num, target in enumerate(targets):
+                response = _random_response(rng, target, p_error)
+                exclude = 1 if rng.random() < exclude_rate else None
+                cell = int(target) if target.isdigit() and rng.random() < 0.5 else target
+                ws.append([block + 1, cond, item_num + 1, cell, response, n_words[target], exclude, None])
+                n_trials += 1
+
+    wb.save(filename)
+    return n_trials
+
+
+#---------------------------------------------------------------------------
+def _random_number(rng, n_digits):
+    return str(rng.integers(1, 10)) + ''.join(str(d) for d in rng.integers(0, 10, n_digits - 1))
+
+
+def _format_number(rng, number):
+    """ A number with 4-6 digits is sometimes written with "t" (e.g. "3 t 450") """
+    if number.isdigit() and len(number) >= 4 and number[-3] != '0' and rng.random() < 0.3:
+        return '{} t {}'.format(number[:-3], number[-3:])
+    return number
+
+
+def _random_target(rng):
+    n_numbers = rng.choice([1, 2, 3], p=[0.6, 0.3, 0.1])
+    numbers = [_random_number(rng, rng.choice([1, 2, 3, 4, 5, 6], p=[0.05, 0.1, 0.2, 0.25, 0.2, 0.2])) for _ in range(n_numbers)]
+    return ' / '.join(_format_number(rng, n) for n in numbers)
+
+
+#---------------------------------------------------------------------------
+def _random_response(rng, target, p_error):
+
+    numbers = [n.replace(' t ', '') for n in target.split(' / ')]
+
+    if rng.random() >= p_error:
+        #-- Correct: mostly "+", sometimes the number itself
+        return '+' if rng.random() < 0.9 else ' / '.join(_format_number(rng, n) for n in numbers)
+
+    error_type = error_types[rng.integers(len(error_types))]
+    if error_type == 'no_response':
+        return unknown_chars[rng.integers(len(unknown_chars))]
+
+    response = list(numbers)
+    i = rng.integers(len(response))
+    number = response[i]
+
+    if error_type == 'omit_number' and len(response) > 1:
+        del response[i]
+    elif error_type in ('omit_digit', 'omit_number') and len(number) > 1:
+        j = rng.integers(1, len(number))
+        response[i] = number[:j] + number[j+1:]
+    elif error_type == 'add_zero' and len(number) < 6:
+        j = rng.integers(1, len(number) + 1)
+        response[i] = number[:j] + '0' + number[j:]
+    elif error_type == 'swap' and len(number) > 1 and len(set(number[1:])) > 1:
+        #-- Swap two adjacent digits (not the first one, to avoid a leading zero)
+        j = rng.integers(1, len(number) - 1)
+        while number[j] == number[j+1]:
+            j = j + 1 if j + 2 < len(number) else 1
+        response[i] = number[:j] + number[j+1] + number[j] + number[j+2:]
+    elif error_type == 'unknown_digit':
+        j = rng.integers(len(number))
+        response[i] = number[:j] + unknown_chars[rng.integers(len(unknown_chars))] + number[j+1:]
+    else:
+        j = rng.integers(len(number))
+        digit = rng.choice([d for d in '0123456789' if d != number[j] and (j > 0 or d != '0')])
+        response[i] = number[:j] + digit + number[j+1:]
+
+    #-- Numbers that were not changed are sometimes written as "+" (only when no number was omitted)
+    same_length = len(response) == len(numbers)
+    segments = ['+' if same_length and len(numbers) > 1 and r == n and rng.random() < 0.5 else _format_number(rng, r)
+                for r, n in zip(response, numbers if same_length else response)]
+    response = ' / '.join(segments)
+
+    if error_type == 'optional':
+        response += ';' + str(rng.integers(1, 10))
+
+    return response
+
+
+#---------------------------------------------------------------------------
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    n_conds = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+    n = generate_raw_data(sys.argv[1], n_subjects=int(sys.argv[2]) if len(sys.argv) > 2 else 30,
+                          n_items=int(sys.argv[3]) if len(sys.argv) > 3 else 32,
+                          conditions=tuple('ABCDEFGHIJ'[:n_conds]),
+                          error_rate=float(sys.argv[5]) if len(sys.argv) > 5 else 0.2)
+    print('{} trials saved to {}'.format(n, sys.argv[1]))
@@ -1,5 +1,4 @@
 
-import pandas as pd
 import sc
 import matplotlib as mpl
 
@@ -22,7 +21,7 @@ supp_fig_per_subj_size = (8, 6)
 
 cond_names_exp1_blocked = None
 
-exp12 = pd.read_excel(d+'exp1&2/data_coded.xlsx')
+exp12 = sc.loader.load_data(d+'exp1&2/data_coded.xlsx')
 exp1 = exp12[exp12.Condition.isin(['A', 'B', 'C', 'D'])]
 
 #-- Blocked (PStat:FigExp1BlockedConds)
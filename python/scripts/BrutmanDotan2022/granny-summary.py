@@ -1,5 +1,4 @@
 
-import pandas as pd
 import sc
 import matplotlib as mpl
 
@@ -11,7 +10,7 @@ d = '/Users/dror/data/acad-proj/4-Published/2022 syntactic chunking Nadin/data/'
 fig_dir = '/Users/dror/data/acad-proj/4-Published/2022 syntactic chunking Nadin/figures/'
 
 
-exp12 = pd.read_excel(d+'exp1&2/data_coded.xlsx')
+exp12 = sc.loader.load_data(d+'exp1&2/data_coded.xlsx')
 exp1 = exp12[exp12.Condition.isin(['B', 'D'])]
 
 #-- Blocked (PStat:FigExp1BlockedConds)
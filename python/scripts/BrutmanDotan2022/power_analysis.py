@@ -0,0 +1,31 @@
+import sc
+
+d = '/Users/dror/data/acad-proj/3-Submitted/syntactic chunking Nadin/data/'
+
+n_sims = 200
+n_subjects = (None, 35)
+
+
+def power_analysis(df, cond_values=None, n_subjects=n_subjects):
+    model = sc.power.RandomInterceptModel(df, 'PMissingMorphemes', cond_values)
+    curve = sc.power.power_curve(df, 'PMissingMorphemes', n_subjects=n_subjects, cond_values=cond_values, n_sims=n_sims, n_jobs=None)
+    sc.power.print_power_curve(model, curve)
+
+
+if __name__ == '__main__':
+
+    exp12 = sc.loader.load_data(d+'exp1&2/data_coded.xlsx')
+    exp1 = exp12[exp12.Condition.isin(['A', 'B', 'C', 'D'])]
+    exp2 = exp12[exp12.Condition.isin(range(10))]
+
+    for cond1, cond2 in (('A', 'B'), ('B', 'C'), ('C', 'D')):
+        print('\n\n======================== {} Versus {}'.format(cond1, cond2))
+        power_analysis(exp1[exp1.Condition.isin([cond1, cond2])])
+
+    #-- Experiment 2: the condition as a numeric factor
+    print('\n\n======================== Experiment 2')
+    power_analysis(exp2, cond_values={c: i for i, c in enumerate(sorted(exp2.Condition.unique()))})
+
+    for exp in ('exp3', 'exp4', 'exp5'):
+        print('\n\n======================== {}'.format(exp))
+        power_analysis(sc.loader.load_data(d+'{}/data_coded.xlsx'.format(exp)), n_subjects=(None, ))
@@ -22,7 +22,7 @@ supp_fig_per_subj_size = (8, 6)
 
 cond_names_exp1_blocked = None
 
-exp12 = pd.read_excel(d+'exp1&2/data_coded.xlsx')
+exp12 = sc.loader.load_data(d+'exp1&2/data_coded.xlsx')
 exp1 = exp12[exp12.Condition.isin(['A', 'B', 'C', 'D'])]
 exp2 = exp12[exp12.Condition.isin(range(10))]
 
@@ -81,7 +81,7 @@ sc.plots.plot_2cond_means_per_subject(exp2, 'PMissingMorphemes', fig_dir+'exp2_p
 #  Experiment 3
 #--------------------------------------------------------------------------------------------------
 
-exp3 = pd.read_excel(d+'exp3/data_coded.xlsx')
+exp3 = sc.loader.load_data(d+'exp3/data_coded.xlsx')
 
 #-- (PStat:FigExp3Conds)
 sc.plots.plot_cond_means_multiple_measures(exp3, dependent_vars=['PMissingMorphemes', 'PMissingDigits', 'PMissingClasses'],
@@ -102,7 +102,7 @@ sc.analyze.compare_conds_per_item(exp3, 'A', 'B', 'PMissingMorphemes')
 #  Experiment 4
 #--------------------------------------------------------------------------------------------------
 
-exp4 = pd.read_excel(d+'exp4/data_coded.xlsx')
+exp4 = sc.loader.load_data(d+'exp4/data_coded.xlsx')
 
 sc.plots.plot_cond_means_multiple_measures(exp4, dependent_vars=['PMissingMorphemes', 'PMissingDigits', 'PMissingClasses'],
                                            out_fn=fig_dir+'exp4_cond_mean_all.pdf', ymax=0.4, d_y_ticks=.05, fig_size=(4, 2),
@@ -128,7 +128,7 @@ sc.analyze.compare_effect_size('PMissingClasses', exp3, exp4, expnames=(3, 4))
 #  Experiment 5
 #--------------------------------------------------------------------------------------------------
 
-exp5 = pd.read_excel(d+'exp5/data_coded.xlsx')
+exp5 = sc.loader.load_data(d+'exp5/data_coded.xlsx')
 
 #-- (PStat:FigExp5)
 sc.plots.plot_cond_means_multiple_measures(exp5, dependent_vars=['PMissingMorphemes', 'PMissingDigits', 'PMissingClasses'],
@@ -1,4 +1,4 @@
-import pandas as pd
+import sc.loader
 
 base_dir = '/Users/dror/data/acad-proj/2-InProgress/syntactic chunking nonwords/data/'
 
@@ -15,7 +15,7 @@ def split_target_to_segments(target, cond):
 
 
 
-df = pd.read_excel(base_dir + 'data_clean.xlsx')
+df = sc.loader.load_data(base_dir + 'data_clean.xlsx')
 
 df['verbal target'] = [split_target_to_segments(t, c) for t, c in zip(df.target, df.Condition)]
 
@@ -15,7 +15,7 @@ GREENS = ('#455C41', '#62845C', '#79A472', '#A2D49A', '#C1F7B8')
 GREEN = GREENS[2]
 
 
-data = pd.read_excel(d+'data_clean.xlsx')
+data = sc.loader.load_data(d+'data_clean.xlsx')
 
 
 #-- Figure: Comparison of conditions (P:FigCmpConds)
@@ -71,7 +71,7 @@ sc.plots.plot_cond_means_per_subject(data, 'PMissingMorphemes', fig_dir+'per_sub
 
 
 #-- Compare effect size in this experiment vs. in real words (Dotan & Brutmann 2022)
-data_real_numbers_exp1 = pd.read_excel(fn_real_words)
+data_real_numbers_exp1 = sc.loader.load_data(fn_real_words)
 
 sc.analyze.compare_effect_size('PMissingMorphemes', data_real_numbers_exp1, data[data.Subject <= 35],
                                conds1=('B', 'D'), conds2=('B', 'C'),
@@ -1,4 +1,3 @@
-import pandas as pd
 import sc
 import matplotlib as mpl
 
@@ -13,7 +12,7 @@ RED = '#BF5860'
 GREEN = '#62845C'
 
 
-data = pd.read_excel(d+'data_clean.xlsx')
+data = sc.loader.load_data(d+'data_clean.xlsx')
 
 sc.plots.plot_cond_means_multiple_measures(data, dependent_vars=['PMissingMorphemes'],
                                            out_fn=fig_dir+'safta.pdf', ymax=0.38, d_y_ticks=.1, fig_size=(3, 2),
@@ -1,4 +1,18 @@
-from . import utils
-from . import markerr
-from . import analyze
-from . import plots
\ No newline at end of file
+"""
+The submodules are loaded on first use (e.g. sc.plots is imported when sc.plots is first accessed), so that
+"import sc" does not import the dependencies of all submodules - matplotlib, scipy, pandas, mtl etc.
+"""
+import importlib
+
+__all__ = ['utils', 'writers', 'loader', 'matcher', 'lexicon', 'runstats', 'permutation', 'markerr', 'analyze', 'bootstrap',
+           'power', 'plots', 'batch']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + __all__)
@@ -1,15 +1,191 @@
 from operator import itemgetter
+import hashlib
+import weakref
 import numpy as np
 from collections import namedtuple
 import scipy.stats
-import scipy.signal
 import pandas as pd
 
 import mtl.utils as mu
 
+import sc.permutation
+
 TTestResult = namedtuple('TTestResult', ['subj', 't', 'p'])
 
 
+#---------------------------------------------------------------------------
+class AggregateCube(object):
+    """
+    The sum, count and sum of squares of a dependent variable per subject x condition (or any other grouping columns,
+    e.g. subject x condition x item), computed in a single groupby pass over the data.
+
+    Means and variances of coarser groupings (e.g. subject x condition from a subject x condition x item cube) are
+    computed from the sums, without going over the data again. Missing values of the dependent variable are ignored,
+    as in pandas' mean().
+    """
+
+    def __init__(self, df, dependent_var, by=('Subject', 'Condition')):
+        self.dependent_var = dependent_var
+        self.by = tuple(by)
+        self.n_rows = df.shape[0]
+
+        values = df[dependent_var].astype(float)
+        tmp = pd.DataFrame({c: df[c] for c in self.by})
+        tmp['sum'] = values
+        tmp['sumsq'] = values ** 2
+        tmp['count'] = values.notna().astype(int)
+
+        self.stats = tmp.groupby(list(self.by), sort=True, observed=True).sum()
+
+    @classmethod
+    def from_stats(cls, stats, dependent_var, n_rows):
+        """ Create a cube from precomputed sum/sumsq/count per group (e.g. from a DataSummary) """
+        cube = cls.__new__(cls)
+        cube.dependent_var = dependent_var
+        cube.by = tuple(stats.index.names)
+        cube.n_rows = n_rows
+        cube.stats = stats
+        return cube
+
+    def _stats_by(self, by):
+        if by is None or tuple(by) == self.by:
+            return self.stats
+        return self.stats.groupby(level=list(by), sort=True, observed=True).sum()
+
+    def mean(self, by=None):
+        """ Mean per group (a Series). by = a subset of the cube's grouping columns (default: all of them) """
+        stats = self._stats_by(by)
+        return stats['sum'] / stats['count'].where(stats['count'] > 0)
+
+    def count(self, by=None):
+        return self._stats_by(by)['count']
+
+    def var(self, by=None, ddof=1):
+        """ Variance per group (a Series) """
+        stats = self._stats_by(by)
+        n = stats['count']
+        return (stats['sumsq'] - stats['sum'] ** 2 / n.where(n > 0)) / (n - ddof).where(n > ddof)
+
+    def mean_table(self, rows='Subject', cols='Condition', row_values=None, col_values=None):
+        """
+        Mean per rows x cols (a DataFrame). Combinations without data are NaN.
+
+        :param row_values: The row labels to include (default: all of them)
+        :param col_values: The column labels to include (default: all of them)
+        """
+        table = self.mean(by=(rows, cols)).unstack(cols)
+        if row_values is not None:
+            table = table.reindex(index=list(row_values))
+        if col_values is not None:
+            table = table.reindex(columns=list(col_values))
+        return table
+
+
+#---------------------------------------------------------------------------
+class DataSummary(object):
+    """
+    The sum, count and sum of squares of several dependent variables per combination of grouping columns, computed in
+    a single groupby pass over the data. The plotting functions accept a DataSummary instead of the data frame, so a set
+    of figures can be built from one aggregation of the data.
+
+    Rows in which a grouping column is empty are ignored.
+    """
+
+    def __init__(self, df, dependent_vars, by=('Subject', 'Condition')):
+        if df is None:
+            return
+
+        self.dependent_vars = list(dependent_vars)
+        self.by = tuple(by)
+        self.n_rows = df.shape[0]
+
+        columns = {}
+        for dv in self.dependent_vars:
+            values = df[dv].astype(float)
+            columns[(dv, 'sum')] = values
+            columns[(dv, 'sumsq')] = values ** 2
+            columns[(dv, 'count')] = values.notna().astype(int)
+
+        tmp = pd.DataFrame(columns, index=df.index)
+        self.stats = tmp.groupby([df[c] for c in self.by], sort=True, observed=True).sum()
+
+    def cube(self, dependent_var, by=None):
+        """
+        The AggregateCube of one dependent variable
+
+        :param by: The cube's grouping columns - a subset of the summary's grouping columns (default: all of them)
+        """
+        if dependent_var not in self.dependent_vars:
+            raise ValueError('The data summary does not include "{}"'.format(dependent_var))
+        cube = AggregateCube.from_stats(self.stats[dependent_var], dependent_var, self.n_rows)
+        if by is not None and tuple(by) != self.by:
+            cube = AggregateCube.from_stats(cube._stats_by(by), dependent_var, self.n_rows)
+        return cube
+
+    def mean(self, dependent_var, by=None):
+        """ Mean per group (a Series) """
+        return self.cube(dependent_var).mean(by)
+
+    def levels(self, column):
+        """ The values of a grouping column that appear in the data """
+        return self.stats.index.get_level_values(column).unique()
+
+    def where(self, **values):
+        """
+        Get the summary of some of the groups, e.g. where(Condition='A') or where(Condition=['A', 'B'])
+        """
+        mask = np.ones(self.stats.shape[0], dtype=bool)
+        for column, value in values.items():
+            value = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            mask &= self.stats.index.get_level_values(column).isin(value)
+
+        result = DataSummary(None, None)
+        result.dependent_vars = self.dependent_vars
+        result.by = self.by
+        result.n_rows = self.n_rows
+        result.stats = self.stats[mask]
+        return result
+
+    def has(self, dependent_vars, by):
+        """ Whether the summary can be used for these dependent variables and grouping columns """
+        return set(dependent_vars) <= set(self.dependent_vars) and set(by) <= set(self.by)
+
+
+_cubes = {}
+
+
+def get_cube(df, dependent_var, by=('Subject', 'Condition')):
+    """
+    Get the AggregateCube of a data frame. The cube is cached as long as the data frame exists, so several analyses of
+    the same data use one groupby pass. The cached cube is used only if the content of the columns it was computed
+    from has not changed since (e.g. by an in-place edit of the data frame).
+    """
+    key = id(df), dependent_var, tuple(by)
+    content_hash = _content_hash(df, tuple(by) + (dependent_var, ))
+    cached = _cubes.get(key)
+    if cached is None or cached[0] != content_hash:
+        if not any(k[0] == id(df) for k in _cubes):
+            weakref.finalize(df, _forget_cubes, id(df))
+        cached = content_hash, AggregateCube(df, dependent_var, by)
+        _cubes[key] = cached
+
+    return cached[1]
+
+
+def _content_hash(df, columns):
+    hashes = pd.util.hash_pandas_object(df[list(columns)], index=False)
+    return hashlib.blake2b(hashes.values.tobytes(), digest_size=16).digest()
+
+
+def _forget_cubes(df_id):
+    for k in [k for k in _cubes if k[0] == df_id]:
+        del _cubes[k]
+
+
+def clear_cube_cache():
+    _cubes.clear()
+
+
 #---------------------------------------------------------------------------
 def exp1_auto_group_subjects(df, dependent_var):
     """
@@ -19,7 +195,8 @@ def exp1_auto_group_subjects(df, dependent_var):
     conditions = sorted(df.Condition.unique())
     subj_ids = sorted(df.Subject.unique())
 
-    subjtypes = [subj_pattern(df[df.Subject == subj], conditions, dependent_var) for subj in subj_ids]
+    means = get_cube(df, dependent_var).mean_table(row_values=subj_ids, col_values=conditions)
+    subjtypes = [_mean_pattern(means.loc[subj].values) for subj in subj_ids]
 
     sinf = sorted([(pat, i) for i, pat in zip(subj_ids, subjtypes)])
     for pat, i in sinf:
@@ -28,7 +205,11 @@ def exp1_auto_group_subjects(df, dependent_var):
 
 #---------------------------------------------------------------------------
 def subj_pattern(subj_df, conditions, dependent_var):
-    mean_per_cond = np.array([subj_df[subj_df.Condition == cond][dependent_var].mean() for cond in conditions])
+    mean_per_cond = AggregateCube(subj_df, dependent_var, ['Condition']).mean().reindex(list(conditions)).values
+    return _mean_pattern(mean_per_cond)
+
+
+def _mean_pattern(mean_per_cond):
     dmeans = mean_per_cond[1:] - mean_per_cond[:-1]
     msign = [1 if m >= 0 else -1 for m in dmeans]
     return tuple(msign)
@@ -64,48 +245,153 @@ def compare_conds_per_subj(df, cond_good, cond_bad, dependent_var):
     :param cond_bad: The condition in which worse performance is expected
     :param dependent_var:
     """
+    print_paired_tests(paired_tests_per_subj(df, [(cond_good, cond_bad)], [dependent_var]))
+
 
-    t_and_p = []
+#---------------------------------------------------------------------------
+def paired_tests_per_subj(df, cond_pairs, dependent_vars):
+    """
+    Paired t-tests (item by item) between pairs of conditions, separately for each subject, for several dependent variables.
+
+    For each dependent variable and pair of conditions, the subjects are sorted by p, and the p values are corrected
+    with a sequential (Holm-style) correction - as in compare_conds_per_subj. The p values are those that
+    compare_conds_per_subj has always reported: half of the one-tailed p.
+
+    :param cond_pairs: List of (cond_good, cond_bad) pairs: the condition in which better performance is expected,
+                       and the condition in which worse performance is expected
+    :param dependent_vars: List of dependent variables
+    :return: A DataFrame with one row per dependent variable x condition pair x subject, with the columns: measure,
+             cond_good, cond_bad, subject, n_items, mean_good, mean_bad, predicted_direction (whether the mean of cond_good
+             is lower), t, p, corrected_p. When the direction is opposite to prediction, there is no t-test: t and
+             corrected_p are NaN, and p = 0.5
+    """
 
+    dependent_vars = list(dependent_vars)
     subj_ids = sorted(df.Subject.unique())
-    for subj in subj_ids:
-        sdf1 = df[(df.Subject == subj) & (df.Condition == cond_good)].sort_values('ItemNum')
-        sdf2 = df[(df.Subject == subj) & (df.Condition == cond_bad)].sort_values('ItemNum')
-        assert list(sdf1.ItemNum) == list(sdf2.ItemNum)
 
-        if sdf1[dependent_var].mean() < sdf2[dependent_var].mean():
-            t, p = scipy.stats.ttest_rel(sdf1[dependent_var], sdf2[dependent_var])
-            p = p / 2
-        else:
-            t = None
-            p = 1
+    #-- The rows of each condition, sorted by subject and item (one table for all dependent variables)
+    items = df.set_index(['Condition', 'Subject', 'ItemNum'])[dependent_vars].astype(float).sort_index(kind='stable')
+
+    families = []
+    for cond_good, cond_bad in cond_pairs:
+        good = _rows_of_condition(items, cond_good)
+        bad = _rows_of_condition(items, cond_bad)
+        if not good.index.equals(bad.index):
+            raise AssertionError('The items of conditions {} and {} are not the same for all subjects'.format(cond_good, cond_bad))
 
-        nrows = sdf1.shape[0]
-        t_and_p.append((t, p / 2, nrows, subj))
+        t, n_items = _paired_t_per_subj(good, bad, subj_ids)
+        p = scipy.stats.t.sf(np.abs(t), np.maximum(n_items - 1, 1)[:, np.newaxis])
 
-    t_and_p.sort(key=itemgetter(1))
+        for i, dependent_var in enumerate(dependent_vars):
+            means = get_cube(df, dependent_var).mean_table(row_values=subj_ids, col_values=(cond_good, cond_bad))
+            predicted = (means[cond_good] < means[cond_bad]).values
 
-    min_t = None
-    corrected_ps = []
+            family = pd.DataFrame(dict(measure=dependent_var, cond_good=cond_good, cond_bad=cond_bad, subject=subj_ids,
+                                       n_items=n_items, mean_good=means[cond_good].values, mean_bad=means[cond_bad].values,
+                                       predicted_direction=predicted,
+                                       t=np.where(predicted, t[:, i], np.nan),
+                                       p=np.where(predicted, p[:, i] / 2, 0.5)))
 
-    div_by = len(subj_ids)
-    for t, p, n, subj in t_and_p:
-        if t is None:
-            print('Subject {}: Opposite to prediction'.format(subj))
+            #-- Python's sort, so that missing p values (NaN) are ordered as in compare_conds_per_subj
+            p_values = family.p.tolist()
+            family = family.iloc[sorted(range(len(p_values)), key=p_values.__getitem__)].reset_index(drop=True)
+            div_by = len(subj_ids) - np.arange(len(subj_ids))
+            family['corrected_p'] = np.where(family.predicted_direction, family.p * div_by, np.nan)
+            families.append(family)
 
+    return pd.concat(families, ignore_index=True)
+
+
+def _rows_of_condition(items, cond):
+    if cond in items.index.get_level_values(0):
+        return items.xs(cond, level='Condition')
+    return items.iloc[:0].droplevel('Condition')
+
+
+def _paired_t_per_subj(rows1, rows2, subj_ids):
+    """
+    Paired t of rows1 vs. rows2 per subject, for all columns at once (the rows are sorted by subject).
+    Returns an array of t (subjects x columns) and the number of items per subject
+    """
+    t = np.full((len(subj_ids), rows1.shape[1]), np.nan)
+    n_items = np.zeros(len(subj_ids), dtype=int)
+    if rows1.shape[0] == 0:
+        return t, n_items
+
+    subjects = rows1.index.get_level_values('Subject')
+    starts = np.flatnonzero(np.r_[True, subjects[1:] != subjects[:-1]])
+    n = np.diff(np.r_[starts, len(subjects)])
+
+    d = rows1.values - rows2.values
+    mean_d = np.add.reduceat(d, starts, axis=0) / n[:, np.newaxis]
+    var_d = np.add.reduceat((d - np.repeat(mean_d, n, axis=0)) ** 2, starts, axis=0) / (n - 1)[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        subj_t = mean_d / np.sqrt(var_d / n[:, np.newaxis])
+
+    subj_inds = pd.Index(subj_ids).get_indexer(subjects[starts])
+    t[subj_inds] = subj_t
+    n_items[subj_inds] = n
+
+    return t, n_items
+
+
+#---------------------------------------------------------------------------
+def print_paired_tests(results):
+    """
+    Print the results of paired_tests_per_subj() - the format of compare_conds_per_subj
+    """
+
+    families = results.groupby(['measure', 'cond_good', 'cond_bad'], sort=False)
+
+    for (measure, cond_good, cond_bad), family in families:
+        if families.ngroups > 1:
+            print('\n{}, {} vs. {}:'.format(measure, cond_good, cond_bad))
+
+        min_t = None
+        corrected_ps = []
+
+        for r in family.itertuples():
+            if not r.predicted_direction:
+                print('Subject {}: Opposite to prediction'.format(r.subject))
+
+            else:
+                corrected_ps.append(r.corrected_p)
+
+                print('Subject {}: t({}) = {:.2f}, p = {}, corrected p = {}'.format(r.subject, r.n_items-1, r.t, mu.p_str(r.p),
+                                                                                   mu.p_str(r.corrected_p)))
+
+                if min_t is None or r.t < min_t:
+                    min_t = r.t
+
+        if min_t is None:
+            print('Overall: no subject in the predicted direction')
         else:
-            corrected_p = p * div_by
-            corrected_ps.append(corrected_p)
+            print('Overall: t > {:.2f}'.format(min_t))
+        print('Sorted corrected p: {}'.format([mu.p_str(p) for p in sorted(corrected_ps, reverse=True)]))
+
 
-            print('Subject {}: t({}) = {:.2f}, p = {}, corrected p = {}'.format(subj, n-1, t, mu.p_str(p), mu.p_str(corrected_p)))
+#---------------------------------------------------------------------------
+def compare_conds_sign_flip(df, cond_good, cond_bad, dependent_var, n_permutations=10000, seed=None, ci_width=None, n_jobs=1):
+    """
+    Compare the performance between 2 conditions over subjects, with a sign-flip permutation test on the per-subject
+    deltas (see sc.permutation.sign_flip_test)
+
+    :param cond_good: The condition in which better performance (a lower value) is expected
+    :param cond_bad: The condition in which worse performance is expected
+    :return: PermutationResult
+    """
+
+    means = get_cube(df, dependent_var).mean_table(col_values=(cond_good, cond_bad))
+    deltas = (means[cond_bad] - means[cond_good]).values
 
-            if min_t is None or t < min_t:
-                min_t = t
+    result = sc.permutation.sign_flip_test(deltas, 'greater', n_permutations=n_permutations, seed=seed, ci_width=ci_width,
+                                           n_jobs=n_jobs)
 
-        div_by -= 1
+    print('{}: mean delta between conditions {} and {} = {:.2f}%, sign-flip permutation test ({}{} permutations): one-tailed p={}'.
+          format(dependent_var, cond_bad, cond_good, result.statistic * 100, 'all ' if result.exact else '',
+                 result.n_permutations, mu.p_str(result.p)))
 
-    print('Overall: t > {:.2f}'.format(min_t))
-    print('Sorted corrected p: {}'.format([mu.p_str(p) for p in sorted(corrected_ps, reverse=True)]))
+    return result
 
 
 #---------------------------------------------------------------------------
@@ -114,7 +400,8 @@ def _get_success_per_item(df, dependent_var):
 
 
 #---------------------------------------------------------------------------
-def compare_effect_size(dependent_var, df1, df2, conds1=None, conds2=None, expnames=('A', 'B')):
+def compare_effect_size(dependent_var, df1, df2, conds1=None, conds2=None, expnames=('A', 'B'), n_permutations=None,
+                        seed=None, n_jobs=1):
     """
     Compare the effect size between two experiments.
     The effect size is defined, per subject, as delta-accuracy between two conditions.
@@ -124,6 +411,9 @@ def compare_effect_size(dependent_var, df1, df2, conds1=None, conds2=None, expna
     :param conds1: Condition names for experiment 1
     :param df2: Data of experiment 2
     :param conds2: Condition names for experiment 2
+    :param n_permutations: If specified, the per-subject values are also compared with a permutation test (see sc.permutation)
+    :param seed: Random seed for the permutation test
+    :param n_jobs: Number of processes for the permutation test
     """
 
     if conds1 is None:
@@ -147,16 +437,20 @@ def compare_effect_size(dependent_var, df1, df2, conds1=None, conds2=None, expna
     else:
         print('opposite to predicted direction')
 
+    if n_permutations is not None:
+        perm = sc.permutation.label_shuffle_test(effect_sizes_1, effect_sizes_2, 'greater', n_permutations=n_permutations,
+                                                 seed=seed, n_jobs=n_jobs)
+        print('Permutation test ({} label shuffles): one-tailed p={}'.format(perm.n_permutations, mu.p_str(perm.p)))
+
     print('No. of participants in the predicted direction: {} in experiment {}, {} in experiment {}'.
           format(sum(np.array(effect_sizes_1) >= 0), expnames[0], sum(np.array(effect_sizes_2) >= 0), expnames[1]))
 
 
 def _get_effect_size(df, conds, dependent_var):
     subjects = sorted(set(df.Subject))
-    means1 = df[df.Condition == conds[0]].groupby('Subject')[dependent_var].aggregate(np.mean)
-    means2 = df[df.Condition == conds[1]].groupby('Subject')[dependent_var].aggregate(np.mean)
+    means = get_cube(df, dependent_var).mean()
 
-    return [means2[s] - means1[s] for s in subjects]
+    return [means[(s, conds[1])] - means[(s, conds[0])] for s in subjects]
 
 
 #---------------------------------------------------------------------------
@@ -169,11 +463,13 @@ def get_value_per_subj_and_cond(conds, dependent_var, df, subj_ids, sort_by_delt
     The dict also contains a 'delta' key, whose value is the difference between the last and first conditions.
     """
 
+    means = get_cube(df, dependent_var).mean_table(row_values=subj_ids, col_values=conds)
+
     subj_inf = []
     for subj in subj_ids:
         i = dict(subject=subj)
         for condnum in range(len(conds)):
-            i['c{}'.format(condnum+1)] = df[(df.Condition == conds[condnum]) & (df.Subject == subj)][dependent_var].mean()
+            i['c{}'.format(condnum+1)] = means.iat[len(subj_inf), condnum]
         i['delta'] = i['c{}'.format(len(conds))] - i['c1']
         subj_inf.append(i)
 
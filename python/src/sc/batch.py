@@ -0,0 +1,152 @@
+"""
+Code several raw-data files in one run, with one shared pool of worker processes.
+
+All worksheets of all jobs are submitted to the pool before the results are collected, so jobs run concurrently.
+Each worker process keeps one parse cache for all the jobs it codes; jobs with the same analyzer settings share its entries.
+
+Command line usage:  python -m sc.batch manifest.json [--n-jobs N]
+
+The manifest is a JSON file with a list of jobs, e.g.:
+
+[
+  {"in_fn": "exp1&2/data_exp12.xlsx", "out_dir": "exp1&2",
+   "analyzer": {"subj_id_transformer": "sc.utils.clean_subj_id", "consider_thousand_as_digit": false}, "incremental": true},
+  {"in_fn": "nonwords/raw-data.xlsx", "worksheets": ["SC1", "SC2"], "out_dir": "nonwords", "out_fn_prefix": "data_coded"}
+]
+
+"analyzer" contains the ErrorAnalyzer arguments; functions (subj_id_transformer) are given as "module.function" names.
+"""
+import argparse
+import importlib
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from sc.markerr import ErrorAnalyzer
+
+JobStats = namedtuple('JobStats', ['name', 'n_rows', 'ok', 'wall_time', 'coding_time', 'rows_per_sec'])
+
+
+#---------------------------------------------------------------------------
+class CodingJob(object):
+    """
+    One raw-data file to code
+
+    :param in_fn: Excel file with the raw data
+    :param out_dir: Directory for output files
+    :param worksheets: Worksheets to code (None = all)
+    :param analyzer: An ErrorAnalyzer, or a dict of ErrorAnalyzer arguments
+    :param out_fn_prefix:
+    :param out_format: 'xlsx', 'csv' or 'parquet'
+    :param name: Job name for the report (default: the input file name)
+    :param incremental: Recode only the rows that changed since the previous run (see ErrorAnalyzer.run_for_worksheets)
+    :param words_format: Format of the per-word results file: 'csv' or 'parquet'
+    """
+
+    def __init__(self, in_fn, out_dir, worksheets=None, analyzer=None, out_fn_prefix='data_coded', out_format='xlsx', name=None,
+                 incremental=False, words_format='csv'):
+        self.in_fn = in_fn
+        self.out_dir = out_dir
+        self.worksheets = worksheets
+        self.analyzer = analyzer if isinstance(analyzer, ErrorAnalyzer) else create_analyzer(analyzer or {})
+        self.out_fn_prefix = out_fn_prefix
+        self.out_format = out_format
+        self.name = in_fn if name is None else name
+        self.incremental = incremental
+        self.words_format = words_format
+
+    def create_row_cache(self):
+        return self.analyzer.create_row_cache(self.out_dir, self.out_fn_prefix) if self.incremental else None
+
+
+#---------------------------------------------------------------------------
+def create_analyzer(config):
+    """
+    Create an ErrorAnalyzer from a dict of arguments (as in the manifest file)
+    """
+    config = dict(config)
+    if isinstance(config.get('subj_id_transformer'), str):
+        config['subj_id_transformer'] = _get_function(config['subj_id_transformer'])
+    return ErrorAnalyzer(**config)
+
+
+def _get_function(full_name):
+    module_name, func_name = full_name.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+#---------------------------------------------------------------------------
+def load_manifest(manifest_fn):
+    """
+    Load the list of jobs from a manifest file. Relative file names are relative to the manifest's directory.
+    """
+    with open(manifest_fn) as fp:
+        job_specs = json.load(fp)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_fn))
+    jobs = []
+    for spec in job_specs:
+        spec = dict(spec)
+        spec['in_fn'] = os.path.join(base_dir, spec['in_fn'])
+        spec['out_dir'] = os.path.join(base_dir, spec['out_dir'])
+        jobs.append(CodingJob(**spec))
+
+    return jobs
+
+
+#---------------------------------------------------------------------------
+def run_batch(jobs, n_jobs=None, executor=None):
+    """
+    Code all jobs with one pool of worker processes, and report the time and speed of each job
+
+    :param jobs: List of CodingJob
+    :param n_jobs: Number of worker processes (default: number of CPUs)
+    :param executor: An existing executor to use instead of creating a pool
+    :return: List of JobStats, one per job
+    """
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=n_jobs)
+
+    try:
+        t0 = time.perf_counter()
+        pending = [job.analyzer.submit_worksheets(job.in_fn, job.worksheets, executor, job.create_row_cache()) for job in jobs]
+
+        result = []
+        for job, job_pending in zip(jobs, pending):
+            print('\n========== {}'.format(job.name))
+            summary = job.analyzer.collect_worksheets(job_pending, job.out_dir, job.out_fn_prefix, job.out_format, job.words_format)
+            wall_time = time.perf_counter() - t0
+            result.append(JobStats(job.name, summary.n_rows, summary.ok, wall_time, summary.coding_time,
+                                   summary.n_rows / summary.coding_time if summary.coding_time > 0 else None))
+
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    print_report(result)
+
+    return result
+
+
+#---------------------------------------------------------------------------
+def print_report(job_stats):
+    print('\n{:<40} {:>8} {:>10} {:>10} {:>10}'.format('Job', 'Rows', 'Wall (s)', 'Coding (s)', 'Rows/sec'))
+    for s in job_stats:
+        print('{:<40} {:>8} {:>10.2f} {:>10.2f} {:>10}{}'.format(s.name[-40:], s.n_rows, s.wall_time, s.coding_time,
+                                                                 '-' if s.rows_per_sec is None else '{:.0f}'.format(s.rows_per_sec),
+                                                                 '' if s.ok else '  (errors)'))
+    print('Wall time = time from the batch start until the job was saved; coding time = total time the workers spent on the job')
+
+
+#---------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Code several raw-data files with one pool of worker processes')
+    parser.add_argument('manifest', help='JSON file with the list of jobs')
+    parser.add_argument('--n-jobs', type=int, default=None, help='Number of worker processes (default: number of CPUs)')
+    args = parser.parse_args()
+
+    run_batch(load_manifest(args.manifest), n_jobs=args.n_jobs)
@@ -0,0 +1,302 @@
+"""
+Bootstrap confidence intervals for condition means
+
+Subjects are resampled with replacement, and optionally also items within each subject (hierarchical bootstrap).
+The replicates are computed from the sums and counts of the dependent variable per subject x condition (x item) - see
+sc.analyze.AggregateCube - and not from the raw rows: each replicate is a vector of weights (how many times each
+subject/item was drawn), so a chunk of replicates is a product of its weight matrix with a sparse cells x groups
+indicator matrix. The memory depends on chunk_size, not on the number of replicates. Chunks have their own random
+seeds, spawned from the bootstrap's seed, so the results do not depend on the number of processes.
+
+The results are cached in memory by (hash of the data, dependent variable, grouping, bootstrap settings), so figures can
+be rebuilt in the same process without aggregating the data or recomputing the intervals. With cache_dir, the results
+are also saved in files, so later runs of a script reuse them.
+"""
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+import sc.analyze
+from sc.analyze import AggregateCube, DataSummary
+
+_cache = OrderedDict()
+_cache_size = 200
+
+
+#---------------------------------------------------------------------------
+def bootstrap_means(df, dependent_var, groups=('Condition',), statistic='pooled', items=False, n_boot=2000, ci=0.95,
+                    seed=0, chunk_size=250, n_jobs=1, executor=None, use_cache=True, cache_dir=None):
+    """
+    Get the mean of a dependent variable per group (e.g. per condition), with a bootstrap confidence interval
+
+    :param df: The data (one row per trial), or a DataSummary grouped by at least Subject and the group columns
+               (and ItemNum, when resampling items)
+    :param groups: Columns defining the groups (e.g. ('Condition', 'block'))
+    :param statistic: 'pooled' = the mean of all trials in the group (as in plot_cond_means);
+                      'subject_mean' = the mean of the per-subject means
+    :param items: Whether to resample items (ItemNum) within each subject, in addition to resampling subjects
+    :param n_boot: Number of bootstrap replicates
+    :param ci: Confidence level
+    :param seed: Random seed
+    :param chunk_size: Number of replicates computed together
+    :param n_jobs: Number of processes (1 = compute in this process)
+    :param executor: A concurrent.futures executor to use instead of creating a pool
+    :param use_cache: Whether to use/save cached results
+    :param cache_dir: If specified (and use_cache=True), the results are also saved in this directory, and reused by
+                      later runs with the same data and settings
+    :return: DataFrame with one row per group (indexed by the group columns), and the columns mean, low, high
+    """
+
+    if statistic not in ('pooled', 'subject_mean'):
+        raise ValueError('Invalid statistic "{}"'.format(statistic))
+
+    groups = tuple(groups)
+    by = ('Subject',) + groups + (('ItemNum',) if items else ())
+    if isinstance(df, DataSummary):
+        cube = df.cube(dependent_var, by)
+        data_hash = _data_hash(cube.stats.reset_index())
+    else:
+        cube = None
+        data_hash = _data_hash(df[list(by) + [dependent_var]])
+
+    key = (data_hash, dependent_var, groups, statistic, items, n_boot, ci, seed)
+    if use_cache:
+        result = _get_from_cache(key, cache_dir)
+        if result is not None:
+            return result
+
+    if cube is None:
+        cube = AggregateCube(df, dependent_var, by)
+    cells = _Cells(cube.stats, groups, items)
+
+    seed_seq = np.random.SeedSequence(seed)
+    chunk_sizes = [min(chunk_size, n_boot - start) for start in range(0, n_boot, chunk_size)]
+    chunk_args = [(cells, statistic, size, chunk_seed) for size, chunk_seed in zip(chunk_sizes, seed_seq.spawn(len(chunk_sizes)))]
+
+    if n_jobs == 1 and executor is None:
+        replicates = [_replicate_chunk(*args) for args in chunk_args]
+    else:
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+        try:
+            replicates = list(executor.map(_replicate_chunk, *zip(*chunk_args)))
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    replicates = np.concatenate(replicates, axis=0)
+    alpha = (1 - ci) / 2
+    with np.errstate(all='ignore'):
+        low, high = np.nanquantile(replicates, [alpha, 1 - alpha], axis=0)
+
+    result = pd.DataFrame(dict(mean=cells.statistic(statistic, cells.all_subject_weights(), cells.all_item_weights())[0],
+                               low=low, high=high), index=cells.group_index)
+
+    if use_cache:
+        _save_in_cache(key, result, cache_dir)
+
+    return result
+
+
+#---------------------------------------------------------------------------
+def bootstrap_subject_effects(df, dependent_var, cond1, cond2, n_boot=2000, ci=0.95, seed=0, use_cache=True, cache_dir=None):
+    """
+    The effect per subject (mean in cond2 minus mean in cond1), with a bootstrap confidence interval from resampling
+    the subject's items
+
+    :param cache_dir: Directory for saving the results, to be reused by later runs (see bootstrap_means)
+    :return: DataFrame indexed by subject, with the columns effect, low, high
+    """
+    by = ['Subject', 'Condition', 'ItemNum']
+    df = df.loc[df.Condition.isin((cond1, cond2)), by + [dependent_var]]
+
+    key = (_data_hash(df), dependent_var, ('subject_effect', cond1, cond2), n_boot, ci, seed)
+    if use_cache:
+        result = _get_from_cache(key, cache_dir)
+        if result is not None:
+            return result
+
+    cube = AggregateCube(df, dependent_var, by)
+
+    #-- All subjects are computed together: each group is a subject x condition, and only the items are resampled
+    cells = _Cells(cube.stats, ('Subject', 'Condition'), True)
+    means = cells.statistic('pooled', cells.all_subject_weights(), cells.all_item_weights())
+    replicates = _replicate_chunk(cells, 'pooled', n_boot, np.random.SeedSequence(seed), resample_subjects=False)
+
+    cols = pd.Series(np.arange(cells.n_groups), index=cells.group_index)
+    subjects = cells.group_index.get_level_values('Subject').unique()
+    col1 = cols.reindex(pd.MultiIndex.from_product([subjects, [cond1]])).values
+    col2 = cols.reindex(pd.MultiIndex.from_product([subjects, [cond2]])).values
+    has_both = ~(np.isnan(col1) | np.isnan(col2))
+    col1 = np.where(has_both, col1, 0).astype(int)
+    col2 = np.where(has_both, col2, 0).astype(int)
+
+    effects = np.where(has_both, replicates[:, col2] - replicates[:, col1], np.nan)
+    alpha = (1 - ci) / 2
+    with np.errstate(all='ignore'):
+        low, high = np.nanquantile(effects, [alpha, 1 - alpha], axis=0)
+
+    result = pd.DataFrame(dict(effect=np.where(has_both, means[0, col2] - means[0, col1], np.nan), low=low, high=high),
+                          index=pd.Index(subjects, name='Subject'))
+
+    if use_cache:
+        _save_in_cache(key, result, cache_dir)
+
+    return result
+
+
+#---------------------------------------------------------------------------
+class _Cells(object):
+    """
+    The cells of an AggregateCube (subject x groups [x item]), as arrays for computing the replicates
+    """
+
+    def __init__(self, stats, groups, items):
+        index = stats.index
+        self.sums = stats['sum'].values
+        self.counts = stats['count'].values.astype(float)
+
+        self.subject_of_cell, subjects = pd.factorize(index.get_level_values('Subject'), sort=True)
+        self.n_subjects = len(subjects)
+
+        group_keys = pd.MultiIndex.from_arrays([index.get_level_values(g) for g in groups], names=groups)
+        self.group_of_cell, group_index = pd.factorize(group_keys, sort=True)
+        group_index.names = groups
+        self.group_index = group_index if len(groups) > 1 else group_index.get_level_values(0)
+        self.n_groups = len(group_index)
+
+        #-- Items are resampled within subjects: a unit is a (subject, item) pair
+        if items:
+            units = pd.MultiIndex.from_arrays([index.get_level_values('Subject'), index.get_level_values('ItemNum')])
+            self.unit_of_cell, unit_index = pd.factorize(units, sort=True)
+            self.subject_of_unit = pd.factorize(unit_index.get_level_values(0), sort=True)[0]
+        else:
+            self.unit_of_cell = None
+            self.subject_of_unit = None
+
+        #-- Sparse cells x groups and cells x (subject x group) indicator matrices
+        self.in_group = _indicator(self.group_of_cell, self.n_groups)
+        self.in_subject_group = _indicator(self.subject_of_cell * self.n_groups + self.group_of_cell, self.n_subjects * self.n_groups)
+
+    def all_subject_weights(self):
+        return np.ones((1, self.n_subjects))
+
+    def all_item_weights(self):
+        return None if self.unit_of_cell is None else np.ones((1, len(self.subject_of_unit)))
+
+    def statistic(self, statistic, subject_weights, item_weights):
+        """
+        The statistic per group, for each replicate (a replicates x groups array)
+
+        :param subject_weights: replicates x subjects array
+        :param item_weights: replicates x units array (or None)
+        """
+        cell_weights = np.ones((subject_weights.shape[0], len(self.sums))) if item_weights is None \
+            else item_weights[:, self.unit_of_cell]
+
+        if statistic == 'pooled':
+            cell_weights = cell_weights * subject_weights[:, self.subject_of_cell]
+            in_group = self.in_group
+        else:
+            in_group = self.in_subject_group
+
+        #-- The weighted sums and counts per group (pooled) or per subject x group (subject_mean), for all the replicates
+        sums = np.asarray((cell_weights * self.sums) @ in_group)
+        counts = np.asarray((cell_weights * self.counts) @ in_group)
+
+        with np.errstate(all='ignore'):
+            means = sums / counts
+        if statistic == 'pooled':
+            return means
+
+        #-- subject_mean: the weighted mean of the per-subject means
+        subj_means = means.reshape(-1, self.n_subjects, self.n_groups)
+        weights = np.where(np.isnan(subj_means), 0, subject_weights[:, :, np.newaxis])
+        with np.errstate(all='ignore'):
+            return np.nansum(subj_means * weights, axis=1) / weights.sum(axis=1)
+
+
+def _indicator(codes, n_codes):
+    """ A sparse matrix with one row per cell and one column per code: 1 in the column of the cell's code """
+    return scipy.sparse.csr_matrix((np.ones(len(codes)), (np.arange(len(codes)), codes)), shape=(len(codes), n_codes))
+
+
+def _replicate_chunk(cells, statistic, size, seed, resample_subjects=True):
+    rng = np.random.default_rng(seed)
+
+    if resample_subjects:
+        subject_weights = rng.multinomial(cells.n_subjects, np.full(cells.n_subjects, 1 / cells.n_subjects), size=size)
+    else:
+        subject_weights = np.ones((size, cells.n_subjects))
+
+    item_weights = None
+    if cells.unit_of_cell is not None:
+        item_weights = np.zeros((size, len(cells.subject_of_unit)))
+        for subj in range(cells.n_subjects):
+            units = np.flatnonzero(cells.subject_of_unit == subj)
+            item_weights[:, units] = rng.multinomial(len(units), np.full(len(units), 1 / len(units)), size=size)
+
+    return cells.statistic(statistic, subject_weights.astype(float), item_weights)
+
+
+def _data_hash(df):
+    h = hashlib.blake2b(repr(list(df.columns)).encode('utf-8'), digest_size=16)
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def _get_from_cache(key, cache_dir):
+    """ The cached result (a copy), or None """
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key].copy()
+
+    if cache_dir is not None:
+        filename = _cache_filename(key, cache_dir)
+        if os.path.exists(filename):
+            with open(filename, 'rb') as fp:
+                result = pickle.load(fp)
+            _save_in_cache(key, result)
+            return result.copy()
+
+    return None
+
+
+def _save_in_cache(key, result, cache_dir=None):
+    _cache[key] = result.copy()
+    while len(_cache) > _cache_size:
+        _cache.popitem(last=False)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_fn = tempfile.mkstemp(dir=cache_dir, suffix='.pkl')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump(result, fp)
+            os.replace(tmp_fn, _cache_filename(key, cache_dir))
+        except BaseException:
+            os.remove(tmp_fn)
+            raise
+
+
+def _cache_filename(key, cache_dir):
+    """ The file of a cached result: the key also covers the code that computes the results """
+    h = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16)
+    for module in (sc.analyze, sys.modules[__name__]):
+        with open(inspect.getsourcefile(module), 'rb') as fp:
+            h.update(fp.read())
+    return os.path.join(cache_dir, 'sc_bootstrap_{}.pkl'.format(h.hexdigest()))
+
+
+def clear_cache():
+    _cache.clear()
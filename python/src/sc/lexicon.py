@@ -0,0 +1,208 @@
+"""
+A precomputed table with the number words of each segment (one number in a target/response)
+"""
+import hashlib
+import inspect
+import itertools
+import os
+import tempfile
+
+import numpy as np
+from mtl import verbalnumbers
+
+#-- The process's lexicons, per settings and directory (see get_lexicon)
+_lexicons = {}
+
+_not_looked_up = object()
+
+
+#------------------------------------------------------
+def segment_to_words(segment, digit_mapping, consider_thousand_as_digit):
+    """
+    Convert a segment (after cleaning - see SegmentTokenizer.clean_digits) into a list of NumberWord objects
+
+    :param consider_thousand_as_digit: If False, the word "thousand" of 4-digit numbers is the decimal word "thousand"
+    """
+    result = verbalnumbers.hebrew.number_to_words(segment, digit_mapping=digit_mapping)
+
+    if not consider_thousand_as_digit:
+        one_thousand = verbalnumbers.general.NumberWord(verbalnumbers.hebrew.thousands, 1)
+        decimal_word_thousand = verbalnumbers.general.NumberWord(verbalnumbers.hebrew.decword_thousand, None)
+        for i, w in enumerate(result):
+            if w == one_thousand:
+                result[i] = decimal_word_thousand
+
+    return result
+
+
+#------------------------------------------------------
+def segment_space(digit_mapping):
+    """
+    All the segments that a lexicon contains: 1-3 digits, a digit followed by "000", and "t" (the word "thousand").
+    Each digit is a character in digit_mapping or the unknown-digit character "x".
+    """
+    digits = sorted({c for c in digit_mapping if len(c) == 1} | {'x'})
+    for n_digits in (1, 2, 3):
+        for chars in itertools.product(digits, repeat=n_digits):
+            yield ''.join(chars)
+    for d in digits:
+        yield d + '000'
+    yield 't'
+
+
+#------------------------------------------------------
+class Lexicon(object):
+    """
+    The number words of each segment, for one digit mapping and "thousand" policy.
+
+    Segments that are not in the lexicon (e.g. numbers with more than 3 digits, invalid characters) should be converted
+    with segment_to_words().
+
+    A lexicon loaded from a file (see load) keeps the file memory-mapped, so processes that load the same file share
+    its pages; the NumberWord objects of a segment are created when the segment is first looked up.
+    """
+
+    #: Change this when the format of the saved file changes
+    version = 1
+
+    def __init__(self, digit_mapping, consider_thousand_as_digit, words_per_segment=None):
+        """
+        :param words_per_segment: dict: segment -> tuple of NumberWord objects. None = compute the words of all
+                                  segments in segment_space()
+        """
+        self.digit_mapping = dict(digit_mapping)
+        self.consider_thousand_as_digit = consider_thousand_as_digit
+
+        if words_per_segment is None:
+            words_per_segment = {}
+            for segment in segment_space(self.digit_mapping):
+                try:
+                    words_per_segment[segment] = tuple(segment_to_words(segment, self.digit_mapping, consider_thousand_as_digit))
+                except Exception:
+                    #-- Segments that can't be converted are left out; converting them again raises the same error
+                    pass
+
+        self._words = words_per_segment
+
+        #: The memory-mapped table of a loaded lexicon (None if the lexicon was computed in this process)
+        self.table = None
+        self._number_words = {}
+
+    def __len__(self):
+        return len(self._words) if self.table is None else len(self.table)
+
+    def words(self, segment):
+        """ The words of a segment (a tuple of NumberWord objects), or None if the segment is not in the lexicon """
+        if self.table is None:
+            return self._words.get(segment)
+
+        words = self._words.get(segment, _not_looked_up)
+        if words is _not_looked_up:
+            words = self._words_from_table(segment)
+            self._words[segment] = words
+        return words
+
+    def _words_from_table(self, segment):
+        """ Find the segment's row in the table (sorted by segment), and create its NumberWord objects """
+        segments = self.table['segment']
+        i = np.searchsorted(segments, segment)
+        if i == len(segments) or segments[i] != segment:
+            return None
+
+        row = self.table[i]
+        words = []
+        for key in zip(row['lexical_class'][:row['n_words']].tolist(), row['digit'][:row['n_words']].tolist()):
+            #-- One NumberWord object per distinct word
+            word = self._number_words.get(key)
+            if word is None:
+                word = verbalnumbers.general.NumberWord(key[0], None if key[1] < 0 else key[1])
+                self._number_words[key] = word
+            words.append(word)
+
+        return tuple(words)
+
+    def settings_hash(self):
+        """ A hash of the lexicon's settings and of the verbal-numbers code that created it """
+        h = hashlib.blake2b(repr((self.version, sorted(self.digit_mapping.items()), self.consider_thousand_as_digit)).encode('utf-8'),
+                            digest_size=8)
+        for module in (verbalnumbers.hebrew, verbalnumbers.general):
+            fn = inspect.getsourcefile(module)
+            if fn is not None:
+                with open(fn, 'rb') as fp:
+                    h.update(fp.read())
+        return h.hexdigest()
+
+    def filename(self, directory):
+        """ The lexicon's file in this directory """
+        return os.path.join(directory, 'sc_lexicon_{}.npy'.format(self.settings_hash()))
+
+    def save(self, directory):
+        """
+        Save the lexicon as a numpy table (one row per segment, sorted by segment) that can be loaded with memory
+        mapping. The file is replaced atomically, so several processes can save the same lexicon concurrently.
+        """
+        classes = {w.lexical_class for words in self._words.values() for w in words}
+        if any(not isinstance(c, str) for c in classes):
+            raise TypeError('Only lexicons with string lexical classes can be saved')
+
+        max_words = max((len(words) for words in self._words.values()), default=0)
+        max_class_len = max((len(c) for c in classes), default=1)
+        dtype = np.dtype([('segment', 'U4'), ('n_words', np.int8), ('lexical_class', 'U{}'.format(max_class_len), (max_words,)),
+                          ('digit', np.int8, (max_words,))])
+
+        table = np.zeros(len(self._words), dtype=dtype)
+        for i, (segment, words) in enumerate(sorted(self._words.items())):
+            table[i]['segment'] = segment
+            table[i]['n_words'] = len(words)
+            table[i]['digit'] = -1
+            for j, w in enumerate(words):
+                table[i]['lexical_class'][j] = w.lexical_class
+                table[i]['digit'][j] = -1 if w.digit is None else w.digit
+
+        os.makedirs(directory, exist_ok=True)
+        filename = self.filename(directory)
+        fd, tmp_fn = tempfile.mkstemp(dir=directory, suffix='.npy')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                np.save(fp, table)
+            os.replace(tmp_fn, filename)
+        except BaseException:
+            os.remove(tmp_fn)
+            raise
+        return filename
+
+    @classmethod
+    def load(cls, directory, digit_mapping, consider_thousand_as_digit):
+        """
+        Load the lexicon saved with these settings (memory-mapped), or return None if there is no such file
+        """
+        lexicon = cls(digit_mapping, consider_thousand_as_digit, words_per_segment={})
+        filename = lexicon.filename(directory)
+        if not os.path.exists(filename):
+            return None
+
+        lexicon.table = np.load(filename, mmap_mode='r')
+        return lexicon
+
+
+#------------------------------------------------------
+def get_lexicon(digit_mapping, consider_thousand_as_digit, directory=None):
+    """
+    Get the lexicon for these settings. The lexicon is created once per process.
+
+    :param directory: If specified, the lexicon is loaded from this directory (created and saved there if it
+                      doesn't exist yet), so that processes share one precomputed file
+    """
+    key = tuple(sorted(digit_mapping.items())), consider_thousand_as_digit, directory
+    lexicon = _lexicons.get(key)
+
+    if lexicon is None:
+        if directory is not None:
+            lexicon = Lexicon.load(directory, digit_mapping, consider_thousand_as_digit)
+        if lexicon is None:
+            lexicon = Lexicon(digit_mapping, consider_thousand_as_digit)
+            if directory is not None:
+                lexicon.save(directory)
+        _lexicons[key] = lexicon
+
+    return lexicon
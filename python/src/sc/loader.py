@@ -0,0 +1,276 @@
+"""
+Load data files (coded data, cleaned data) with a binary cache.
+
+The first time a file is loaded, it is read with pandas (read_excel / read_csv) and saved as a "sidecar" file in a
+.sc_cache directory next to it. Later loads read the sidecar instead of parsing the file again.
+
+- The sidecar is an uncompressed Feather (Arrow IPC) file, so it can be read with memory mapping. Low-cardinality text
+  columns are saved as categorical columns, and other text columns as Arrow string columns. Columns that mix strings,
+  numbers and booleans (e.g. targets, or condition names together with condition numbers) are saved as a string column
+  plus a column with the type of each value, so they are loaded with the same values and types. Only values of other
+  types are pickled (each value separately, in a binary column).
+  Feather sidecars require the pyarrow package; without it, the whole data is saved as a pickle sidecar.
+- The sidecar is valid if the source file has the same size and modification time as when the sidecar was saved. If
+  the modification time changed but the file's hash did not (e.g. the file was copied), the sidecar is still used.
+"""
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+cache_dir_name = '.sc_cache'
+_version = 2
+_metadata_key = b'sc.loader'
+_encodings_key = b'sc.loader.encodings'
+
+#-- The type tags of values in 'typed' columns (see _encode_objects)
+_type_tags = ('nan', 'none', 'str', 'int', 'float', 'bool')
+
+
+#---------------------------------------------------------------------------
+def load_data(filename, sheet_name=0, categorical='auto', use_cache=True, memory_map=True):
+    """
+    Load an Excel/CSV data file, using the binary sidecar cache
+
+    :param filename: xlsx or csv file
+    :param sheet_name: The Excel worksheet to load
+    :param categorical: Columns to save as categorical: a list of column names, 'auto' (text columns in which most
+                        values are repeated), or None
+    :param use_cache: False = always read the source file (and don't save a sidecar)
+    :param memory_map: Read Feather sidecars with memory mapping
+    :return: DataFrame
+    """
+    if not use_cache:
+        return _read_source(filename, sheet_name)
+
+    source_stat = os.stat(filename)
+    #-- Options are compared with the ones saved in the sidecar, as JSON
+    options = json.loads(json.dumps(dict(sheet_name=sheet_name, categorical=categorical)))
+
+    for sidecar_fn, reader in ((_sidecar_filename(filename, sheet_name, 'feather'), _read_feather),
+                               (_sidecar_filename(filename, sheet_name, 'pkl'), _read_pickle)):
+        if not os.path.exists(sidecar_fn):
+            continue
+
+        try:
+            metadata, df = reader(sidecar_fn, memory_map)
+        except Exception as e:
+            print('Warning: the cache file {} could not be read ({}), it will be recreated'.format(sidecar_fn, e))
+            continue
+
+        status = _sidecar_status(metadata, filename, source_stat, options)
+        if status == 'valid':
+            return df
+        if status == 'same_content':
+            _save_sidecar(df, filename, sheet_name, _metadata(filename, source_stat, options, metadata['source_hash']))
+            return df
+
+    df = _read_source(filename, sheet_name)
+    df = _to_categorical(df, categorical)
+    _save_sidecar(df, filename, sheet_name, _metadata(filename, source_stat, options, _file_hash(filename)))
+    return df
+
+
+#---------------------------------------------------------------------------
+def clear_cache(filename, sheet_name=0):
+    """ Delete the sidecar files of a data file """
+    for ext in ('feather', 'pkl'):
+        sidecar_fn = _sidecar_filename(filename, sheet_name, ext)
+        if os.path.exists(sidecar_fn):
+            os.remove(sidecar_fn)
+
+
+#---------------------------------------------------------------------------
+def _read_source(filename, sheet_name):
+    if filename.lower().endswith('.csv'):
+        return pd.read_csv(filename)
+    else:
+        return pd.read_excel(filename, sheet_name=sheet_name)
+
+
+def _to_categorical(df, categorical):
+    if categorical is None:
+        return df
+
+    if categorical == 'auto':
+        categorical = [col for col in df.columns if _is_repeated_text(df[col])]
+
+    df = df.copy()
+    for col in categorical:
+        df[col] = df[col].astype('category')
+    return df
+
+
+def _is_repeated_text(values):
+    if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+        return False
+    values = values.dropna()
+    return len(values) > 0 and all(isinstance(v, str) for v in values) and values.nunique() <= len(values) / 2
+
+
+#---------------------------------------------------------------------------
+def _sidecar_filename(filename, sheet_name, ext):
+    dir_name, base_name = os.path.split(os.path.abspath(filename))
+    return os.path.join(dir_name, cache_dir_name, '{}.{}.{}'.format(base_name, sheet_name, ext))
+
+
+def _metadata(filename, source_stat, options, source_hash):
+    return dict(version=_version, source=os.path.basename(filename), source_size=source_stat.st_size,
+                source_mtime_ns=source_stat.st_mtime_ns, source_hash=source_hash, options=options)
+
+
+def _sidecar_status(metadata, filename, source_stat, options):
+    """
+    :return: 'valid', 'same_content' (the file's modification time changed but its content did not), or 'invalid'
+    """
+    if metadata.get('version') != _version or metadata.get('options') != options or \
+            metadata.get('source_size') != source_stat.st_size:
+        return 'invalid'
+
+    if metadata.get('source_mtime_ns') == source_stat.st_mtime_ns:
+        return 'valid'
+
+    return 'same_content' if metadata.get('source_hash') == _file_hash(filename) else 'invalid'
+
+
+def _file_hash(filename):
+    h = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+#---------------------------------------------------------------------------
+def _save_sidecar(df, filename, sheet_name, metadata):
+    feather_fn = _sidecar_filename(filename, sheet_name, 'feather')
+    pickle_fn = _sidecar_filename(filename, sheet_name, 'pkl')
+    os.makedirs(os.path.dirname(feather_fn), exist_ok=True)
+
+    try:
+        table = _to_arrow(df, metadata)
+    except ImportError:
+        table = None
+
+    if table is not None:
+        import pyarrow.feather
+        tmp_fn = feather_fn + '.tmp'
+        pyarrow.feather.write_feather(table, tmp_fn, compression='uncompressed')
+        os.replace(tmp_fn, feather_fn)
+        stale_fn = pickle_fn
+    else:
+        tmp_fn = pickle_fn + '.tmp'
+        with open(tmp_fn, 'wb') as fp:
+            pickle.dump(dict(metadata=metadata, data=df), fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fn, pickle_fn)
+        stale_fn = feather_fn
+
+    if os.path.exists(stale_fn):
+        os.remove(stale_fn)
+
+
+def _to_arrow(df, metadata):
+    import pyarrow as pa
+
+    #-- Columns of Python objects are replaced by encoded columns; a typed column's tags are added as an extra column
+    encodings = []
+    tag_columns = {}
+    object_cols = [i for i, col in enumerate(df.columns) if pd.api.types.is_object_dtype(df.iloc[:, i])]
+    if len(object_cols) > 0:
+        df = df.copy()
+        for i in object_cols:
+            encoding, values, tags = _encode_objects(df.iloc[:, i])
+            df.isetitem(i, values)
+            encodings.append((i, encoding))
+            if tags is not None:
+                tag_columns[_tags_column(i)] = tags
+        df = pd.concat([df, pd.DataFrame(tag_columns)], axis=1) if len(tag_columns) > 0 else df
+    table = pa.Table.from_pandas(df)
+
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[_metadata_key] = json.dumps(metadata).encode('utf-8')
+    schema_metadata[_encodings_key] = json.dumps(encodings).encode('utf-8')
+    return table.replace_schema_metadata(schema_metadata)
+
+
+def _encode_objects(values):
+    """
+    Encode a column of Python objects as Arrow-compatible columns. Returns (encoding, values, tags):
+    - 'string': strings (missing values are NaN); tags is None
+    - 'typed': strings, numbers and booleans, saved as strings; tags is the type of each value (an index in _type_tags)
+    - 'pickle': other objects, each pickled separately; tags is None
+    """
+    types = [_type_tag(v) for v in values]
+
+    if None in types:
+        return 'pickle', pd.Series([pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL) for v in values], index=values.index), None
+
+    if set(types) <= {'str', 'nan'}:
+        return 'string', pd.Series([None if t == 'nan' else v for v, t in zip(values, types)], index=values.index, dtype=object), None
+
+    encoded = [v if t == 'str' else repr(float(v)) if t == 'float' else None if t in ('nan', 'none') else str(v)
+               for v, t in zip(values, types)]
+    tags = np.array([_type_tags.index(t) for t in types], dtype=np.int8)
+    return 'typed', pd.Series(encoded, index=values.index, dtype=object), pd.Series(tags, index=values.index)
+
+
+def _type_tag(v):
+    """ The type tag of a value (see _type_tags), or None if it can't be saved as a string """
+    if v is None:
+        return 'none'
+    if isinstance(v, str):
+        return 'str'
+    if isinstance(v, (bool, np.bool_)):
+        return 'bool'
+    if isinstance(v, (int, np.integer)):
+        return 'int'
+    if isinstance(v, (float, np.floating)):
+        return 'nan' if np.isnan(v) else 'float'
+    return None
+
+
+def _decode_objects(encoding, values, tags):
+    if encoding == 'pickle':
+        return pd.Series([pickle.loads(v) for v in values], index=values.index, dtype=object)
+
+    if encoding == 'string':
+        return pd.Series([np.nan if v is None else v for v in values], index=values.index, dtype=object)
+
+    decoders = dict(nan=lambda v: np.nan, none=lambda v: None, str=str, int=int, float=float, bool=lambda v: v == 'True')
+    return pd.Series([decoders[_type_tags[t]](v) for v, t in zip(values.tolist(), tags.tolist())], index=values.index, dtype=object)
+
+
+def _tags_column(i):
+    return '__sc_tags_{}'.format(i)
+
+
+def _read_feather(sidecar_fn, memory_map):
+    import pyarrow as pa
+
+    source = pa.memory_map(sidecar_fn) if memory_map else pa.OSFile(sidecar_fn)
+    with pa.ipc.open_file(source) as reader:
+        metadata = json.loads(reader.schema.metadata[_metadata_key])
+        if metadata.get('version') != _version:
+            #-- The sidecar is invalid (see _sidecar_status)
+            return metadata, None
+        encodings = json.loads(reader.schema.metadata[_encodings_key])
+        df = reader.read_all().to_pandas()
+
+    tag_columns = []
+    for i, encoding in encodings:
+        tags = None
+        if encoding == 'typed':
+            tags = df[_tags_column(i)]
+            tag_columns.append(_tags_column(i))
+        df.isetitem(i, _decode_objects(encoding, df.iloc[:, i], tags))
+
+    return metadata, df.drop(columns=tag_columns)
+
+
+def _read_pickle(sidecar_fn, memory_map):
+    with open(sidecar_fn, 'rb') as fp:
+        content = pickle.load(fp)
+    return content['metadata'], content['data']
@@ -1,27 +1,416 @@
 """
 Mark errors in the results file
 """
-import openpyxl
 import re
 import os
 import math
-import numpy as np
-import pandas as pd
-from mtl import verbalnumbers
+import io
+import time
+import contextlib
+import hashlib
+import inspect
+import pickle
+import queue
+import threading
+import warnings
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from sc.writers import create_writer, WordResults
+from sc.matcher import word_table
+from sc.lexicon import segment_to_words, get_lexicon
+from sc.runstats import RunStats
 
 import mtl.verbalnumbers.hebrew as hebnum
 
 lexical_classes = hebnum.ones, hebnum.tens, hebnum.hundreds, hebnum.thousands
 
+WorksheetResult = namedtuple('WorksheetResult', ['worksheet', 'n_rows', 'n_excluded', 'n_phonerr', 'ok'])
+RunSummary = namedtuple('RunSummary', ['n_rows', 'ok', 'coding_time', 'stages', 'stats'], defaults=(None, None))
+StageStats = namedtuple('StageStats', ['stage', 'n_rows', 'busy_time', 'wait_time'])
+PendingRun = namedtuple('PendingRun', ['in_fn', 'worksheets', 'tasks', 'row_cache'])
+CodedTrial = namedtuple('CodedTrial', ['rownum', 'status', 'row', 'words'])
+
+
+#------------------------------------------------------
+class ParseCache(object):
+    """
+    A bounded LRU cache of parsed targets/responses.
+
+    The key is the raw text + the analyzer's parsing settings; the value is a tuple of parsed segments
+    (each segment is a tuple of words). Values are immutable, so they can be shared by all rows and analyzers.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """ Return the cached value, or None if the key is not in the cache """
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def info(self):
+        n_lookups = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, size=len(self._entries), maxsize=self.maxsize,
+                    hit_rate=self.hits / n_lookups if n_lookups > 0 else None)
+
+
+#-- The default cache, shared by all ErrorAnalyzer objects (entries of analyzers with different settings don't mix)
+shared_parse_cache = ParseCache()
+
+
+#------------------------------------------------------
+class SegmentTokenizer(object):
+    """
+    Tokenizer for the target/response grammar: segments separated by "/", an optional ";" part in responses,
+    "<digits> t <digits>" thousand segments, and digit segments with commas and unknown-digit characters.
+
+    The regular expressions and the translation table are built once, when the tokenizer is created, and a
+    regular expression is matched only if the text contains the relevant character (";" or "t").
+    """
+
+    def __init__(self, unknown_response_chars):
+        self._thousand_re = re.compile('^([0-9,]*)\\s*t\\s*([0-9,]+)?$')
+        self._optional_re = re.compile('(.*);(.+)')
+
+        unknown_chars = [c for c in unknown_response_chars if c not in ('x', 'X')]
+        if all(len(c) == 1 for c in unknown_chars):
+            self._translation = {ord(c): 'x' for c in unknown_chars}
+            self._translation[ord(',')] = None
+            self._replacements = None
+        else:
+            #-- Multi-character strings must be replaced one by one, in order
+            self._translation = {ord(','): None}
+            self._replacements = unknown_chars
+
+    def split_optional(self, response):
+        """
+        Split a response into the main part and the optional part (after the last ";").
+        The optional part is None if there is no ";"
+        """
+        m = self._optional_re.match(response) if ';' in response else None
+        if m is None:
+            return response, None
+        return m.group(1), m.group(2)
+
+    def segments(self, text):
+        """
+        Split the text into segments.
+        Return a list with one (segment, pre_thousand, post_thousand) tuple per segment. pre_thousand is None unless the
+        segment has the "<digits> t <digits>" format; post_thousand is None if there are no digits after the "t".
+        """
+        result = []
+        for seg in text.split('/'):
+            seg = seg.strip()
+            m = self._thousand_re.match(seg) if 't' in seg else None
+            if m is None:
+                result.append((seg, None, None))
+            else:
+                result.append((seg, m.group(1), m.group(2)))
+        return result
+
+    def clean_digits(self, segment):
+        """ Delete commas and set the unknown-digit characters to 'x' """
+        segment = segment.translate(self._translation)
+        if self._replacements is not None:
+            for c in self._replacements:
+                segment = segment.replace(c, 'x')
+        return segment
+
+
+#------------------------------------------------------
+class RowCache(object):
+    """
+    The coding results of the previous run, for incremental coding: per worksheet, the result of each input row,
+    keyed by a hash of the row's content. The results are saved in a file next to the coded data, together with a hash
+    of the analyzer configuration; when the configuration changes, the saved results are ignored.
+
+    Rows that printed any message (errors, warnings) are not saved, so they are recoded - and reported - on every run.
+    """
+
+    #: Change this when the format of the saved results changes
+    version = 2
+
+    def __init__(self, filename, config_hash):
+        self.filename = filename
+        self.config_hash = config_hash
+        self.previous = self._load()
+        self.current = {}
+
+    def _load(self):
+        if not os.path.exists(self.filename):
+            return {}
+
+        try:
+            with open(self.filename, 'rb') as fp:
+                data = pickle.load(fp)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            print('WARNING: the results of the previous run could not be read from {}, all rows will be coded'.format(self.filename))
+            return {}
+
+        if data.get('version') != self.version or data.get('config') != self.config_hash:
+            print('The analyzer configuration has changed since the previous run, all rows will be coded')
+            return {}
+
+        return data['worksheets']
+
+    def rows_for_worksheet(self, worksheet, col_inds):
+        """
+        Return the saved results of a worksheet's rows (dict: row hash -> row result), or an empty dict if the worksheet
+        was not coded in the previous run or its columns have changed
+        """
+        header, rows = self.previous.get(worksheet, (None, {}))
+        return rows if header == _hash_values(tuple(col_inds.items())) else {}
+
+    def set_rows_for_worksheet(self, worksheet, col_inds, rows):
+        self.current[worksheet] = _hash_values(tuple(col_inds.items())), rows
+
+    def save(self):
+        """ Save the results of the current run (worksheets that were not coded now are dropped) """
+        tmp_fn = self.filename + '.tmp'
+        with open(tmp_fn, 'wb') as fp:
+            pickle.dump(dict(version=self.version, config=self.config_hash, worksheets=self.current), fp,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fn, self.filename)
+
+
+def _load_workbook(in_fn):
+    #-- openpyxl is imported here, and not when the module is loaded, so that worker processes don't import it
+    import openpyxl
+    return openpyxl.load_workbook(in_fn, read_only=True)
+
+
+def _hash_values(values):
+    return hashlib.blake2b(repr(values).encode('utf-8'), digest_size=16).digest()
+
+
+class _WorksheetTally(object):
+    """
+    The counts of a worksheet's coded rows. Rows are added in order (see ErrorAnalyzer.code_worksheet).
+    """
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.found_empty_rows = False
+        self.n_excluded = 0
+        self.n_phonerr = 0
+        self.n_rows = 0
+        self.ok = True
+
+    def add(self, rownum, rc, out_row, write_row):
+        """
+        Add the result of one row (code_row()'s return code and output row). Successfully coded rows are passed to
+        write_row (if it's not None).
+        """
+        if rc == 'empty':
+            self.found_empty_rows = True
+
+        elif rc == 'excluded':
+            self.n_excluded += 1
+
+        elif rc == 'error':
+            self.ok = False
+
+        else:
+            self.n_phonerr += rc
+            self.n_rows += 1
+            if write_row is not None:
+                write_row(out_row)
+
+            if self.found_empty_rows:
+                print('ERROR: row {} in worksheet "{}" contains data but there were few empty rows previously. Skipped.'.
+                      format(rownum, self.worksheet))
+                self.ok = False
+
+    def result(self):
+        return WorksheetResult(self.worksheet, self.n_rows, self.n_excluded, self.n_phonerr, self.ok)
+
+
+class _StageTimer(object):
+    """
+    The number of rows and the busy/waiting time of one pipeline stage (see ErrorAnalyzer.run_for_worksheets)
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.n_rows = 0
+        self.busy_time = 0
+        self.wait_time = 0
+
+    def put(self, q, item):
+        """ Put an item in the next stage's queue (waiting while the queue is full) """
+        t0 = time.perf_counter()
+        q.put(item)
+        self.wait_time += time.perf_counter() - t0
+
+    def get(self, q):
+        """ Get an item from the previous stage's queue (waiting while the queue is empty) """
+        t0 = time.perf_counter()
+        item = q.get()
+        self.wait_time += time.perf_counter() - t0
+        return item
+
+    def wait_for(self, future):
+        t0 = time.perf_counter()
+        result = future.result()
+        self.wait_time += time.perf_counter() - t0
+        return result
+
+    def stats(self):
+        return StageStats(self.stage, self.n_rows, self.busy_time, self.wait_time)
+
+
+def print_stage_stats(stages):
+    """ Print the throughput of each pipeline stage """
+    print('\n{:<8} {:>8} {:>10} {:>10} {:>10}'.format('Stage', 'Rows', 'Busy (s)', 'Wait (s)', 'Rows/sec'))
+    for s in stages:
+        rate = '{:.0f}'.format(s.n_rows / s.busy_time) if s.busy_time > 0 else '-'
+        print('{:<8} {:>8} {:>10.2f} {:>10.2f} {:>10}'.format(s.stage, s.n_rows, s.busy_time, s.wait_time, rate))
+
+
+class _RowAsWorksheet(object):
+    """
+    A row of values, accessed like an openpyxl worksheet with 1-based columns: for ErrorAnalyzer subclasses that
+    override the hooks with their previous signatures. The row number is ignored.
+    """
+
+    def __init__(self, row):
+        self.row = row
+
+    def cell(self, row, column):
+        return _RowCell(self.row, column - 1)
+
+
+class _RowCell(object):
+
+    def __init__(self, row, ind):
+        self.row = row
+        self.ind = ind
+
+    @property
+    def value(self):
+        return self.row[self.ind]
+
+    @value.setter
+    def value(self, value):
+        self.row[self.ind] = value
+
+
+def _adapt_old_hooks(cls, old_hooks):
+    """
+    Wrap the overrides of ErrorAnalyzer hooks that have the previous signatures (old_hooks), so that they are called
+    with the current signatures. _save_value is always wrapped, as the old overrides call it with the previous signature.
+    """
+
+    if 'custom_process_row' in old_hooks:
+        old_custom_process_row = cls.custom_process_row
+
+        def custom_process_row(self, in_row, out_row, in_rownum, col_inds):
+            col_inds = {c: i + 1 for c, i in col_inds.items()}
+            old_custom_process_row(self, _RowAsWorksheet(in_row), _RowAsWorksheet(out_row), in_rownum, None, col_inds)
+
+        cls.custom_process_row = custom_process_row
+
+    if 'set_fixed_values' in old_hooks:
+        old_set_fixed_values = cls.set_fixed_values
+
+        def set_fixed_values(self, fixed_values, out_row):
+            old_set_fixed_values(self, fixed_values, _RowAsWorksheet(out_row), None)
+
+        cls.set_fixed_values = set_fixed_values
+
+    save_value = cls._save_value
+    if '_save_value' in old_hooks:
+        #-- Called as (out_row, colname, value) or (out_ws, rownum, colname, value)
+        def _save_value(self, *args):
+            if len(args) == 3:
+                args = (_RowAsWorksheet(args[0]), None) + args[1:]
+            save_value(self, *args)
+    else:
+        def _save_value(self, *args):
+            if len(args) == 4:
+                out_ws, _, colname, value = args
+                args = (out_ws.row, colname, value)
+            save_value(self, *args)
+
+    cls._save_value = _save_value
+
 
 # noinspection PyMethodMayBeStatic
 class ErrorAnalyzer(object):
+    """
+    Codes the errors in each trial of the raw data (see run_for_worksheets).
+
+    Subclasses can customize the coding by overriding custom_process_row(). The rows are passed as sequences of values,
+    not as worksheet cells (this changed when the worksheets started being read in one pass):
+    - custom_process_row(self, in_row, out_row, in_rownum, col_inds) replaces
+      custom_process_row(self, in_ws, out_ws, in_rownum, out_rownum, col_inds). in_row is a tuple with the values of
+      the input row, and col_inds is 0-based: replace in_ws.cell(in_rownum, col_inds[c]).value with in_row[col_inds[c]].
+      out_row is the list of output values.
+    - _save_value(self, out_row, colname, value) replaces _save_value(self, out_ws, rownum, colname, value): replace
+      self._save_value(out_ws, out_rownum, c, v) with self._save_value(out_row, c, v).
+    - set_fixed_values(self, fixed_values, out_row) replaces set_fixed_values(self, fixed_values, out_ws, out_row_num).
+    Overrides with the previous signatures still work (with a DeprecationWarning): they get the rows as objects with
+    the worksheet's cell(row, column) method, 1-based col_inds, and None as the output row number. In such subclasses,
+    self._save_value() can be called with either signature, but super()._save_value() only with the new one.
+    """
+
+    #: The methods that are timed when instrument=True
+    instrumented_methods = ('parse_row', 'parse_target', 'parse_response', 'analyze_response', 'target_items_said',
+                            '_save_accuracy_per_word', '_read_worksheet')
+
+    #: The methods that subclasses may override, whose signatures changed (see the class docstring)
+    _hook_methods = ('custom_process_row', '_save_value', 'set_fixed_values')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        #-- Overrides with the previous signatures are wrapped, so that they get the rows as worksheet-like objects
+        old_hooks = []
+        for name in cls._hook_methods:
+            method = cls.__dict__.get(name)
+            if method is None:
+                continue
+            params = inspect.signature(method).parameters.values()
+            if any(p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD) for p in params):
+                continue
+            expected = inspect.signature(getattr(ErrorAnalyzer, name))
+            if len(params) == len(expected.parameters) + 1:
+                warnings.warn('{}.{}{} uses the previous signature of ErrorAnalyzer.{}{}: rows are now passed as sequences '
+                              'of values, not as worksheet cells (see the ErrorAnalyzer docstring)'.
+                              format(cls.__qualname__, name, inspect.signature(method), name, expected), DeprecationWarning, stacklevel=2)
+                old_hooks.append(name)
+
+        if len(old_hooks) > 0:
+            _adapt_old_hooks(cls, old_hooks)
 
     #------------------------------------------------------
     def __init__(self, digit_mapping=None, unknown_response_chars=('-', '?'),
                  subj_id_transformer=None, consider_thousand_as_digit=True, accuracy_per_digit=False,
                  fail_on_segment_order_error=False, subj_id_in_xls=True, in_col_names=None, phonological_error_flds=(),
-                 set_per_subject=None, save_verbal_response=False):
+                 set_per_subject=None, save_verbal_response=False, parse_cache=True, lexicon=True, instrument=False):
         """
 
         :param phonological_error_flds: List of xls columns which contain number of phonological errors. All these columns will be summed.
@@ -30,6 +419,14 @@ class ErrorAnalyzer(object):
         :param consider_thousand_as_digit:  Whether the word "thousand" should count towards digit errors also in numbers with 5 or 6 digits
         :param accuracy_per_digit: This concerns the output files per word/morpheme: whether to compute the word/digit accuracy
                 for each specific word or less precisely. Value=True is impossible if the target contains duplicate digits.
+        :param parse_cache: Cache for the parsed targets/responses: True = the cache shared by all analyzers;
+                False/None = no caching; or a ParseCache object
+        :param lexicon: Convert segments to words with a precomputed table (see sc.lexicon): True = create the table
+                in memory; a directory name = load the table from this directory (save it there if it doesn't exist);
+                False = convert each segment separately
+        :param instrument: Collect statistics of each run - the time spent in each stage, cache hit rates, rows/sec
+                per worksheet, peak memory (see sc.runstats.RunStats). The statistics are printed, returned in
+                RunSummary.stats, and saved in <out_fn_prefix>_stats.json.
         """
         self._digit_mapping = {str(d): d for d in range(0, 10)}
         if digit_mapping is not None:
@@ -43,6 +440,20 @@ class ErrorAnalyzer(object):
         self.subj_id_in_xls = subj_id_in_xls
         self.save_verbal_response = save_verbal_response
         self.unknown_response_chars = unknown_response_chars
+        self._tokenizer = SegmentTokenizer(unknown_response_chars)
+
+        if parse_cache is True:
+            self.parse_cache = shared_parse_cache
+        elif parse_cache is False:
+            self.parse_cache = None
+        else:
+            self.parse_cache = parse_cache
+        self.lexicon = lexicon
+        self._lexicon = None
+        self.instrument = instrument
+        self.stats = None
+        self._parse_settings = (type(self), tuple(sorted(self._digit_mapping.items())), consider_thousand_as_digit,
+                                tuple(unknown_response_chars))
 
         self.in_col_names = dict(block='Block', condition='Condition', itemnum='ItemNum', target='target', response='response',
                                  nwords='NWordsPerTarget', exclude='exclude', manual='manual')
@@ -73,9 +484,12 @@ class ErrorAnalyzer(object):
                 self.fixed_value_per_subject[sid] = {cn: set_per_subject[cn][i] for cn in set_per_subject.keys() if cn != 'subjid'}
             self.xls_out_cols += tuple(cn for cn in set_per_subject.keys() if cn != 'subjid')
 
+        self._out_col_inds = {c: i for i, c in enumerate(self.xls_out_cols)}
+
 
     #------------------------------------------------------
-    def run_for_worksheet(self, in_fn, worksheet='data', out_dir=None, out_fn_prefix='data_coded'):
+    def run_for_worksheet(self, in_fn, worksheet='data', out_dir=None, out_fn_prefix='data_coded', out_format='xlsx',
+                          incremental=False, words_format='csv'):
         """
         Analyze the error rates (digit, class, morpheme, word) in each trial
 
@@ -83,125 +497,566 @@ class ErrorAnalyzer(object):
         :param worksheet: Name of worksheet to read
         :param out_dir: Directory for output files
         :param out_fn_prefix:
+        :param out_format: Format of the coded data file: 'xlsx', 'csv' or 'parquet'
+        :param incremental: Recode only the rows that changed since the previous run (see run_for_worksheets)
+        :param words_format: Format of the per-word results file: 'csv' or 'parquet'
         """
-        self.run_for_worksheets(in_fn, [worksheet], out_dir, out_fn_prefix)
+        return self.run_for_worksheets(in_fn, [worksheet], out_dir, out_fn_prefix, out_format, incremental=incremental,
+                                       words_format=words_format)
 
 
     #------------------------------------------------------
-    def run_for_worksheets(self, in_fn, worksheets=None, out_dir=None, out_fn_prefix='data_coded'):
+    def run_for_worksheets(self, in_fn, worksheets=None, out_dir=None, out_fn_prefix='data_coded', out_format='xlsx',
+                           n_jobs=1, executor=None, incremental=False, words_format='csv', pipeline=False, chunk_size=200,
+                           queue_size=8):
         """
         Analyze the error rates (digit, class, morpheme, word) in each trial
 
         :param set_per_subject: values to set for each participant. This is a dict with a 'subjid' entry and
                                 one additional entry for each column to set
+        :param out_format: Format of the coded data file: 'xlsx', 'csv' or 'parquet'. The coded rows are written
+                           to this file one by one, as soon as each trial is coded.
+        :param n_jobs: Number of processes for coding the worksheets in parallel (1 = code them in this process).
+                       The output files are the same as when coding serially. On platforms that start worker processes
+                       by importing the main script (Windows, macOS), the calling script needs an if __name__ == '__main__' guard.
+        :param executor: A concurrent.futures executor to code the worksheets with (instead of creating one with n_jobs processes)
+        :param incremental: Save the result of each input row (in out_dir), and in later runs recode only rows whose content
+                            has changed. The output files are rewritten in full, and are the same as when coding all rows.
+                            All rows are recoded if the analyzer's configuration or code has changed.
+        :param words_format: Format of the per-word results file (<out_fn_prefix>_words): 'csv' or 'parquet'
+        :param pipeline: Read, code and write concurrently: a reader thread reads the worksheets, n_jobs coder processes
+                         (or the executor's workers) code chunks of chunk_size rows, and a writer thread writes the coded
+                         rows in the input order. The output files and messages are the same as when coding serially.
+                         The throughput of each stage is printed and returned in RunSummary.stages.
+        :param chunk_size: Number of rows coded together (in pipeline mode)
+        :param queue_size: Maximal number of chunks waiting between two stages (in pipeline mode). When the queue is full,
+                           the previous stage waits.
+        :return: RunSummary
         """
 
-        out_wb, out_ws = self.create_output_workbook()
-        wb = openpyxl.load_workbook(in_fn)
-        if worksheets is None:
-            worksheets = [ws.title for ws in wb.worksheets]
+        self._start_stats()
+
+        if pipeline:
+            if incremental:
+                raise ValueError('Incremental coding is not supported in pipeline mode')
+            return self._run_pipeline(in_fn, worksheets, out_dir, out_fn_prefix, out_format, n_jobs, executor, words_format,
+                                      chunk_size, queue_size)
+
+        row_cache = self.create_row_cache(out_dir, out_fn_prefix) if incremental else None
 
-        result_per_word = []
-        n_excluded = []
-        n_phonerr = []
+        if n_jobs == 1 and executor is None:
+            writer = None if out_dir is None else self.create_output_writer(out_dir, out_fn_prefix, out_format)
+            wb = _load_workbook(in_fn)
+            if worksheets is None:
+                worksheets = [ws.title for ws in wb.worksheets]
 
-        ok = True
-        out_row_num = 2
+            result_per_word = WordResults()
+            t0 = time.perf_counter()
+            ws_results = list(self._code_worksheets_serially(wb, worksheets, in_fn, writer, result_per_word, row_cache))
+            wb.close()
+
+            return self._save_results(in_fn, worksheets, ws_results, time.perf_counter() - t0, writer, result_per_word,
+                                      out_dir, out_fn_prefix, row_cache, words_format)
+
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+
+        try:
+            pending = self.submit_worksheets(in_fn, worksheets, executor, row_cache)
+            return self.collect_worksheets(pending, out_dir, out_fn_prefix, out_format, words_format)
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+
+    #------------------------------------------------------
+    def _code_worksheets_serially(self, wb, worksheets, in_fn, writer, result_per_word, row_cache):
+        """
+        Code the worksheets one by one. Yields a WorksheetResult per (valid) worksheet.
+        """
+
+        write_row = None if writer is None else self._timed('write_row', writer.write_row)
 
         for worksheet in worksheets:
             print('\nProcessing worksheet "{}"...'.format(worksheet))
 
             try:
-                in_ws, col_inds = self._open_worksheet(wb, worksheet, in_fn)
+                col_inds, rows = self._read_worksheet(self._open_worksheet(wb, worksheet, in_fn))
             except ValueError as e:
                 print('>>> ERROR (worksheet ignored): {}'.format(e))
                 continue
 
-            found_empty_rows = False
-            subj_n_excluded = 0
-            subj_n_phonerr = 0
+            t0 = time.perf_counter()
+            if row_cache is None:
+                ws_result = self.code_worksheet(worksheet, col_inds, rows, write_row, result_per_word)
+            else:
+                row_results = {}
+                ws_result = self.code_worksheet(worksheet, col_inds, rows, write_row, result_per_word,
+                                                row_cache.rows_for_worksheet(worksheet, col_inds), row_results)
+                row_cache.set_rows_for_worksheet(worksheet, col_inds, row_results)
+
+            if self.stats is not None:
+                self.stats.add_worksheet(worksheet, ws_result.n_rows, time.perf_counter() - t0)
+            yield ws_result
 
-            if 'manual' in self.in_col_names:
-                nrep = sum('repeat' in str(in_ws.cell(rownum, col_inds[self.in_col_names['manual']]).value) for rownum in range(2, in_ws.max_row+1))
-                if nrep > 0:
-                    print('{}: {} excluded&repeated trials'.format(worksheet.title(), nrep))
 
-            for rownum in range(2, in_ws.max_row+1):
-                if self.fixed_value_per_subject is not None and worksheet in self.fixed_value_per_subject:
-                    self.set_fixed_values(self.fixed_value_per_subject[worksheet], out_ws, out_row_num)
+    #------------------------------------------------------
+    def _run_pipeline(self, in_fn, worksheets, out_dir, out_fn_prefix, out_format, n_jobs, executor, words_format,
+                      chunk_size, queue_size):
+        """
+        Code the worksheets in three concurrent stages (see run_for_worksheets). The reader thread puts the rows of each
+        worksheet in a queue, in chunks; this thread submits each chunk to the coders, and puts the pending result in a
+        second queue; and the writer thread takes the results from that queue in order.
+        """
 
-                rc = self.parse_row(in_ws, out_ws, rownum, out_row_num, col_inds, result_per_word, worksheet)
+        writer = None if out_dir is None else self.create_output_writer(out_dir, out_fn_prefix, out_format)
+        write_row = None if writer is None else self._timed('write_row', writer.write_row)
+        result_per_word = WordResults()
 
-                if rc == 'empty':
-                    found_empty_rows = True
+        read_queue = queue.Queue(maxsize=queue_size)
+        write_queue = queue.Queue(maxsize=queue_size)
+        read_timer, code_timer, write_timer = _StageTimer('read'), _StageTimer('code'), _StageTimer('write')
+        sheet_names = []
+        ws_results = []
+        errors = []
+
+        def read():
+            try:
+                t0 = time.perf_counter()
+                wb = _load_workbook(in_fn)
+                sheet_names.extend([ws.title for ws in wb.worksheets] if worksheets is None else worksheets)
+
+                for worksheet in sheet_names:
+                    try:
+                        col_inds, rows = self._read_worksheet(self._open_worksheet(wb, worksheet, in_fn))
+                    except ValueError as e:
+                        items = [('start', worksheet, e, None)]
+                    else:
+                        items = [('start', worksheet, col_inds, self._repeated_trials_message(worksheet, col_inds, rows))]
+                        items += [('rows', worksheet, col_inds, rows[i:i+chunk_size], i + 2) for i in range(0, len(rows), chunk_size)]
+                        items.append(('end', worksheet))
+                        read_timer.n_rows += len(rows)
+                    read_timer.busy_time += time.perf_counter() - t0
+
+                    for item in items:
+                        read_timer.put(read_queue, item)
+                    t0 = time.perf_counter()
+
+                wb.close()
+
+            except BaseException as e:
+                errors.append(e)
+
+            finally:
+                read_queue.put(None)
+
+        def write():
+            tally = None
+            ws_time = 0
+            while True:
+                item = write_timer.get(write_queue)
+                if item is None:
+                    break
+                if len(errors) > 0:
+                    #-- Keep emptying the queue, so that the other stages are not blocked
                     continue
 
-                elif rc == 'excluded':
-                    subj_n_excluded += 1
+                try:
+                    if item[0] == 'rows':
+                        row_results, elapsed, worker_stats = write_timer.wait_for(item[2])
+                        code_timer.n_rows += len(row_results)
+                        code_timer.busy_time += elapsed
+                        ws_time += elapsed
+                        if self.stats is not None:
+                            self.stats.merge(worker_stats)
+
+                    t0 = time.perf_counter()
+
+                    if item[0] == 'start':
+                        print('\nProcessing worksheet "{}"...'.format(item[1]))
+                        if isinstance(item[2], Exception):
+                            print('>>> ERROR (worksheet ignored): {}'.format(item[2]))
+                        elif item[3] is not None:
+                            print(item[3])
+                        tally = _WorksheetTally(item[1])
+                        ws_time = 0
+
+                    elif item[0] == 'rows':
+                        for rownum, log, (rc, out_row, words) in row_results:
+                            print(log, end='')
+                            result_per_word.extend(words)
+                            tally.add(rownum, rc, out_row, write_row)
+                        write_timer.n_rows += len(row_results)
+
+                    else:
+                        ws_results.append(tally.result())
+                        if self.stats is not None:
+                            self.stats.add_worksheet(item[1], tally.n_rows, ws_time)
+
+                    write_timer.busy_time += time.perf_counter() - t0
+
+                except BaseException as e:
+                    errors.append(e)
+
+        self._prepare_lexicon_for_workers()
+
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+
+        t_start = time.perf_counter()
+        reader = threading.Thread(target=read, name='sc-reader', daemon=True)
+        writer_thread = threading.Thread(target=write, name='sc-writer', daemon=True)
+        reader.start()
+        writer_thread.start()
 
-                elif rc == 'error':
-                    ok = False
+        try:
+            while True:
+                item = read_queue.get()
+                if item is not None and item[0] == 'rows':
+                    _, worksheet, col_inds, rows, first_rownum = item
+                    item = 'rows', worksheet, executor.submit(_code_rows_in_worker, self, worksheet, col_inds, rows, first_rownum)
+                code_timer.put(write_queue, item)
+                if item is None:
+                    break
+
+        except BaseException as e:
+            errors.append(e)
+            write_queue.put(None)
+            while read_queue.get() is not None:
+                pass
 
-                else:
-                    subj_n_phonerr += rc
-                    out_row_num += 1
+        finally:
+            reader.join()
+            writer_thread.join()
+            if own_executor:
+                executor.shutdown()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        summary = self._save_results(in_fn, sheet_names, ws_results, time.perf_counter() - t_start, writer, result_per_word,
+                                     out_dir, out_fn_prefix, None, words_format)
+
+        stages = [read_timer.stats(), code_timer.stats(), write_timer.stats()]
+        print_stage_stats(stages)
+
+        return summary._replace(stages=stages)
+
+
+    #------------------------------------------------------
+    def submit_worksheets(self, in_fn, worksheets, executor, row_cache=None):
+        """
+        Read the worksheets, and submit them to be coded by the executor (one task per worksheet).
+        Returns a PendingRun, to be passed to collect_worksheets()
+
+        :param row_cache: RowCache for incremental coding (see create_row_cache), or None to code all rows
+        """
+
+        self._start_stats()
+        self._prepare_lexicon_for_workers()
+
+        wb = _load_workbook(in_fn)
+        if worksheets is None:
+            worksheets = [ws.title for ws in wb.worksheets]
+
+        tasks = []
+        for worksheet in worksheets:
+            try:
+                col_inds, rows = self._read_worksheet(self._open_worksheet(wb, worksheet, in_fn))
+            except ValueError as e:
+                tasks.append((worksheet, None, e))
+                continue
+
+            prev_row_results = None if row_cache is None else row_cache.rows_for_worksheet(worksheet, col_inds)
+            future = executor.submit(_code_worksheet_in_worker, self, worksheet, col_inds, rows, prev_row_results)
+            tasks.append((worksheet, future, col_inds))
+
+        wb.close()
+
+        return PendingRun(in_fn, list(worksheets), tasks, row_cache)
+
+
+    #------------------------------------------------------
+    def collect_worksheets(self, pending, out_dir=None, out_fn_prefix='data_coded', out_format='xlsx', words_format='csv'):
+        """
+        Wait for the worksheets submitted by submit_worksheets(), and save the results (like run_for_worksheets).
+        The results are merged in the original worksheet order, and each worksheet's messages are printed
+        together with its results.
+        """
+
+        writer = None if out_dir is None else self.create_output_writer(out_dir, out_fn_prefix, out_format)
+        result_per_word = WordResults()
+        ws_results = []
+        coding_time = 0
+
+        for worksheet, future, col_inds_or_error in pending.tasks:
+            print('\nProcessing worksheet "{}"...'.format(worksheet))
+            if future is None:
+                print('>>> ERROR (worksheet ignored): {}'.format(col_inds_or_error))
+                continue
+
+            ws_result, out_rows, words, log, elapsed, row_results, worker_stats = future.result()
+            print(log, end='')
+            if pending.row_cache is not None:
+                pending.row_cache.set_rows_for_worksheet(worksheet, col_inds_or_error, row_results)
+            if self.stats is not None:
+                self.stats.merge(worker_stats)
+                self.stats.add_worksheet(worksheet, ws_result.n_rows, elapsed)
 
-                    if found_empty_rows:
-                        print('ERROR: row {} in worksheet "{}" contains data but there were few empty rows previously. Skipped.'.
-                              format(rownum, worksheet))
-                        ok = False
+            if writer is not None:
+                write_row = self._timed('write_row', writer.write_row)
+                for out_row in out_rows:
+                    write_row(out_row)
+            result_per_word.extend(words)
+            ws_results.append(ws_result)
+            coding_time += elapsed
 
-            n_excluded.append(subj_n_excluded)
-            n_phonerr.append(int(subj_n_phonerr))
+        return self._save_results(pending.in_fn, pending.worksheets, ws_results, coding_time, writer, result_per_word,
+                                  out_dir, out_fn_prefix, pending.row_cache, words_format)
 
-            #-- Last row is not needed
-            out_ws.delete_rows(out_row_num)
+
+    #------------------------------------------------------
+    def _save_results(self, in_fn, worksheets, ws_results, coding_time, writer, result_per_word, out_dir, out_fn_prefix,
+                      row_cache=None, words_format='csv'):
+
+        n_excluded = [r.n_excluded for r in ws_results]
+        n_phonerr = [int(r.n_phonerr) for r in ws_results]
+        n_rows = sum(r.n_rows for r in ws_results)
+        ok = all(r.ok for r in ws_results)
 
         if ok:
-            print('{} rows were processed, no errors found.'.format(out_row_num-1))
+            print('{} rows were processed, no errors found.'.format(n_rows))
         else:
             print('Some errors were encountered.')
 
-        out_ws.freeze_panes = out_ws['A2']
-        self.auto_col_width(out_ws)
-
         if out_dir is None:
             print('WARNING: results were not saved for {}'.format(in_fn))
 
         else:
-            out_wb.save(out_dir + os.sep + out_fn_prefix + '.xlsx')
-            pd.DataFrame(result_per_word).to_csv(out_dir + os.sep + out_fn_prefix + '_words.csv', index=False)
+            t0 = time.perf_counter()
+            writer.close()
+            result_per_word.save(out_dir + os.sep + out_fn_prefix + '_words', words_format)
 
+            import pandas as pd
             subjstat = pd.DataFrame(dict(subject=worksheets, n_excluded=n_excluded))
             if len(self.phonological_error_flds) > 0:
                 subjstat['n_phonerr'] = n_phonerr
             subjstat.to_csv(out_dir + os.sep + out_fn_prefix + '_subjstat.csv', index=False)
 
+            if row_cache is not None:
+                row_cache.save()
+
+            if self.stats is not None:
+                self.stats.add_time('save_results', time.perf_counter() - t0)
+
+        if self.stats is None:
+            return RunSummary(n_rows, ok, coding_time)
+
+        self._count_cache_use()
+        self.stats.finish()
+        self.stats.print()
+        if out_dir is not None:
+            self.stats.save(out_dir + os.sep + out_fn_prefix + '_stats.json')
+
+        return RunSummary(n_rows, ok, coding_time, stats=self.stats)
+
 
     #------------------------------------------------------
-    def parse_row(self, in_ws, out_ws, rownum, out_rownum, col_inds, result_per_word, worksheet):
+    def code_worksheet(self, worksheet, col_inds, rows, write_row, result_per_word, prev_row_results=None, row_results=None):
         """
-        Parse a single row, copy it to the output file
+        Code all rows of one worksheet
+
+        :param worksheet: The worksheet name
+        :param col_inds: The index of each column in the rows
+        :param rows: List of input rows (tuples of values)
+        :param write_row: Function that gets each successfully coded output row (or None)
+        :param result_per_word: WordResults (or list) to which the per-word results are appended
+        :param prev_row_results: For incremental coding: the results of the previous run (dict: row hash -> code_row() result).
+                                 Rows found here are not recoded.
+        :param row_results: For incremental coding: dict to which the result of each row is saved
+        :return: WorksheetResult
+        """
+
+        tally = _WorksheetTally(worksheet)
+
+        message = self._repeated_trials_message(worksheet, col_inds, rows)
+        if message is not None:
+            print(message)
+
+        n_reused = 0
+
+        for rownum, row in enumerate(rows, start=2):
+            if row_results is None:
+                rc, out_row, words = self.code_row(worksheet, col_inds, row, rownum)
+
+            else:
+                row_hash = _hash_values(row)
+                row_result = None if prev_row_results is None else prev_row_results.get(row_hash)
+                if row_result is None:
+                    log = io.StringIO()
+                    with contextlib.redirect_stdout(log):
+                        row_result = self.code_row(worksheet, col_inds, row, rownum)
+                    print(log.getvalue(), end='')
+                    if log.tell() == 0:
+                        row_results[row_hash] = row_result
+                else:
+                    n_reused += 1
+                    row_results[row_hash] = row_result
+                rc, out_row, words = row_result
+
+            result_per_word.extend(words)
+            tally.add(rownum, rc, out_row, write_row)
+
+        if row_results is not None:
+            print('{} rows were recoded, {} rows were unchanged since the previous run'.format(len(rows) - n_reused, n_reused))
+            if self.stats is not None:
+                self.stats.count('row_cache_hits', n_reused)
+                self.stats.count('row_cache_misses', len(rows) - n_reused)
+
+        return tally.result()
+
+
+    #------------------------------------------------------
+    def _repeated_trials_message(self, worksheet, col_inds, rows):
+        """ The message about the worksheet's excluded&repeated trials (None if there are none) """
+        if 'manual' in self.in_col_names:
+            nrep = sum('repeat' in str(row[col_inds[self.in_col_names['manual']]]) for row in rows)
+            if nrep > 0:
+                return '{}: {} excluded&repeated trials'.format(worksheet.title(), nrep)
+        return None
+
+
+    #------------------------------------------------------
+    def iter_code(self, trials, worksheet=None, first_rownum=1):
+        """
+        Code trials from any source, one by one. This is a generator: each trial is read and coded only when the next
+        result is requested, so the trials can come from a large file, a database cursor etc. without being loaded
+        into memory.
+
+        Yields a CodedTrial per trial:
+        - rownum: The trial's number (for messages)
+        - status: 'ok', 'excluded', 'error' (the error message was printed) or 'empty' (no target)
+        - row: The coded trial (a dict with the columns of xls_out_cols), or None if the status is not 'ok'
+        - words: The per-word results (a list with one dict per target word, with the columns of WordResults.columns)
+
+        :param trials: An iterable of mappings (e.g. dicts, or df.to_dict('records')) with the same columns as the
+                       input worksheet. Empty values should be None, numbers should be int/float.
+        :param worksheet: The worksheet name: the subject ID when subj_id_in_xls=False, and the subject whose values
+                          are set by set_per_subject
+        :param first_rownum: The number of the first trial
+        """
+
+        columns = None
+        col_inds = None
+
+        for rownum, trial in enumerate(trials, start=first_rownum):
+            keys = tuple(trial.keys())
+            if keys != columns:
+                columns = keys
+                col_inds = self._xls_structure(columns)
+
+            row = tuple(None if isinstance(v, float) and math.isnan(v) else v for v in trial.values())
+            rc, out_row, words = self.code_row(worksheet, col_inds, row, rownum)
+
+            words = [dict(zip(WordResults.columns, w)) for w in words]
+            if isinstance(rc, str):
+                yield CodedTrial(rownum, rc, None, words)
+            else:
+                yield CodedTrial(rownum, 'ok', dict(zip(self.xls_out_cols, out_row)), words)
+
+
+    #------------------------------------------------------
+    def code_row(self, worksheet, col_inds, row, rownum):
+        """
+        Code one input row.
+        Returns a tuple: parse_row()'s return value, the output row, and a list of the per-word results
+        """
+        out_row = [None] * len(self.xls_out_cols)
+        if self.fixed_value_per_subject is not None and worksheet in self.fixed_value_per_subject:
+            self.set_fixed_values(self.fixed_value_per_subject[worksheet], out_row)
+
+        words = []
+        rc = self.parse_row(row, out_row, rownum, col_inds, words, worksheet)
+
+        return rc, out_row, words
+
+
+    #------------------------------------------------------
+    def __getstate__(self):
+        #-- The shared cache is not sent to worker processes; they use their own shared cache
+        state = dict(self.__dict__)
+        if self.parse_cache is shared_parse_cache:
+            state['parse_cache'] = True
+        #-- Worker processes get the lexicon with get_lexicon()
+        state['_lexicon'] = None
+        #-- Worker processes collect their own statistics (see _start_stats)
+        for name in self.instrumented_methods:
+            state.pop(name, None)
+        state['stats'] = None
+        return state
+
+    def __setstate__(self, state):
+        if state['parse_cache'] is True:
+            state['parse_cache'] = shared_parse_cache
+        self.__dict__.update(state)
+        self._start_stats()
+
+
+    #------------------------------------------------------
+    def _start_stats(self):
+        """ Start collecting statistics of a run (if instrument=True): time the instrumented methods """
+        if not self.instrument:
+            return
+
+        self.stats = RunStats()
+        for name in self.instrumented_methods:
+            setattr(self, name, self.stats.timed(name, getattr(type(self), name).__get__(self)))
+        self._parse_cache_counts = (0, 0) if self.parse_cache is None else (self.parse_cache.hits, self.parse_cache.misses)
+
+    def _timed(self, name, func):
+        """ Time a function under the given stage name (if instrument=True) """
+        return func if self.stats is None or func is None else self.stats.timed(name, func)
+
+    def _count_cache_use(self):
+        """ Add the parse cache hits/misses since the last call to the statistics """
+        if self.stats is None or self.parse_cache is None:
+            return
+        hits, misses = self.parse_cache.hits, self.parse_cache.misses
+        self.stats.count('parse_cache_hits', hits - self._parse_cache_counts[0])
+        self.stats.count('parse_cache_misses', misses - self._parse_cache_counts[1])
+        self._parse_cache_counts = hits, misses
+
+
+    #------------------------------------------------------
+    def parse_row(self, in_row, out_row, rownum, col_inds, result_per_word, worksheet):
+        """
+        Parse a single row, copy it to the output row
         Return: the number of phonological errors; or a string reflecting the error/issue
+
+        :param in_row: The row's values (a tuple), as read from the input worksheet
+        :param out_row: List of output values, one per column in xls_out_cols. It is filled by this function.
+        :param col_inds: The index of each column in in_row
         """
 
         if self.in_col_names['exclude'] in col_inds:
-            exclude = in_ws.cell(rownum, col_inds[self.in_col_names['exclude']]).value
+            exclude = in_row[col_inds[self.in_col_names['exclude']]]
             if exclude == 1:
                 return 'excluded'
 
         if self.subj_id_in_xls:
-            subj_id = in_ws.cell(rownum, col_inds[self.in_col_names['subject']]).value
+            subj_id = in_row[col_inds[self.in_col_names['subject']]]
         else:
             subj_id = worksheet
 
-        raw_target = in_ws.cell(rownum, col_inds[self.in_col_names['target']]).value
-        raw_response = in_ws.cell(rownum, col_inds[self.in_col_names['response']]).value
+        raw_target = in_row[col_inds[self.in_col_names['target']]]
+        raw_response = in_row[col_inds[self.in_col_names['response']]]
 
         if self.in_col_names['nwords'] is None:
             n_target_words = None
         else:
-            n_target_words = in_ws.cell(rownum, col_inds[self.in_col_names['nwords']]).value
+            n_target_words = in_row[col_inds[self.in_col_names['nwords']]]
 
             if n_target_words is None:
                 print("Error in line {}: 'NWordsPerTarget' was not specified".format(rownum))
@@ -213,14 +1068,14 @@ class ErrorAnalyzer(object):
         #-- Save basic columns
 
         subj_id = subj_id if self.subj_id_transformer is None else self.subj_id_transformer(subj_id)
-        self._save_value(out_ws, out_rownum, 'Subject', subj_id)
+        self._save_value(out_row, 'Subject', subj_id)
         if self.save_verbal_response:
             vr_col = self.in_col_names['VerbalResponse']
-            self._save_value(out_ws, out_rownum, vr_col, in_ws.cell(rownum, col_inds[vr_col]).value)
+            self._save_value(out_row, vr_col, in_row[col_inds[vr_col]])
 
         copy_cols = self.xls_mandatory_cols + tuple([c for c in self.xls_optional_cols if self.in_col_names[c] in col_inds])
         for colname in copy_cols:
-            self._save_value(out_ws, out_rownum, colname, in_ws.cell(rownum, col_inds[colname]).value)
+            self._save_value(out_row, colname, in_row[col_inds[colname]])
 
         #-- Analyze target & response
 
@@ -241,79 +1096,86 @@ class ErrorAnalyzer(object):
 
         #-- Phonological errors
         if len(self.phonological_error_flds) > 0:
-            n_phonerr = [in_ws.cell(rownum, col_inds[c]).value for c in self.phonological_error_flds]
+            n_phonerr = [in_row[col_inds[c]] for c in self.phonological_error_flds]
             n_phonerr = [n for n in n_phonerr if not _isnull(n)]
             if sum(not isinstance(n, (int, float)) for n in n_phonerr) > 0:
                 print('Error in line {}: invalid number of phonological errors ({})'.format(rownum, n_phonerr))
                 n_phonerr = 0
             else:
                 n_phonerr = sum(n_phonerr)
-                self._save_value(out_ws, out_rownum, 'NPhonologicalErrors', n_phonerr)
+                self._save_value(out_row, 'NPhonologicalErrors', n_phonerr)
 
         else:
             n_phonerr = 0
 
         #-- Save performance measures
 
-        n_target_digits = sum([t.digit is not None for t in target])
+        word_digit = word_table.digit
+        n_target_digits = sum([word_digit[t] is not None for t in target])
 
-        self._save_value(out_ws, out_rownum, 'NMissingWords', n_word_errs)
-        self._save_value(out_ws, out_rownum, 'NMissingDigits', n_digit_errs)
-        self._save_value(out_ws, out_rownum, 'NMissingClasses', n_class_errs)
+        self._save_value(out_row, 'NMissingWords', n_word_errs)
+        self._save_value(out_row, 'NMissingDigits', n_digit_errs)
+        self._save_value(out_row, 'NMissingClasses', n_class_errs)
 
-        self._save_value(out_ws, out_rownum, 'NTargetDigits', n_target_digits)
-        self._save_value(out_ws, out_rownum, 'PMissingWords', n_word_errs / n_target_words)
-        self._save_value(out_ws, out_rownum, 'PMissingDigits', n_digit_errs / n_target_digits)
-        self._save_value(out_ws, out_rownum, 'PMissingClasses', n_class_errs / n_target_words)
-        self._save_value(out_ws, out_rownum, 'PMissingMorphemes', (n_class_errs + n_digit_errs) / (n_target_words + n_target_digits))
+        self._save_value(out_row, 'NTargetDigits', n_target_digits)
+        self._save_value(out_row, 'PMissingWords', n_word_errs / n_target_words)
+        self._save_value(out_row, 'PMissingDigits', n_digit_errs / n_target_digits)
+        self._save_value(out_row, 'PMissingClasses', n_class_errs / n_target_words)
+        self._save_value(out_row, 'PMissingMorphemes', (n_class_errs + n_digit_errs) / (n_target_words + n_target_digits))
 
-        self.custom_process_row(in_ws, out_ws, rownum, out_rownum, col_inds)
+        self.custom_process_row(in_row, out_row, rownum, col_inds)
 
-        self._save_accuracy_per_word(subj_id, in_ws, rownum, col_inds, target, target_word_said, target_digit_said, raw_response, raw_target,
+        self._save_accuracy_per_word(subj_id, in_row, col_inds, target, target_word_said, target_digit_said, raw_response, raw_target,
                                      result_per_word)
 
         return n_phonerr
 
 
     #------------------------------------------------------------------------------
-    def custom_process_row(self, in_ws, out_ws, in_rownum, out_rownum, col_inds):
+    def custom_process_row(self, in_row, out_row, in_rownum, col_inds):
         pass
 
 
     #------------------------------------------------------------------------------
     def parse_target(self, raw_target, rownum):
+        """
+        Return the target words (a tuple of word codes - see sc.matcher.WordTable), and the target segments
+        """
         target_segments = self.parse_target_or_response(raw_target, rownum)
-        target = np.array(self.collapse_segments(target_segments)[::-1])  # put the ones word in position 1
+        target = tuple(self.collapse_segments(target_segments)[::-1])  # put the ones word in position 1
         return target, target_segments
 
 
     #------------------------------------------------------------------------------
-    def _save_accuracy_per_word(self, subj_id, in_ws, rownum, col_inds, target, target_word_said, target_digit_said,
+    def _save_accuracy_per_word(self, subj_id, in_row, col_inds, target, target_word_said, target_digit_said,
                                 raw_response, raw_target, result_per_word):
 
-        block = None if self.in_col_names['block'] is None else in_ws.cell(rownum, col_inds[self.in_col_names['block']]).value
-        cond_name = in_ws.cell(rownum, col_inds['Condition']).value
-        item_num = in_ws.cell(rownum, col_inds['ItemNum']).value
+        block = None if self.in_col_names['block'] is None else in_row[col_inds[self.in_col_names['block']]]
+        cond_name = in_row[col_inds['Condition']]
+        item_num = in_row[col_inds['ItemNum']]
         n_target_words = len(target_word_said)
 
-        for i, (word_said, digit_said, target_word) in enumerate(zip(target_word_said, target_digit_said, target)):
-
-            lexical_class_order = lexical_classes.index(target_word.lexical_class) if target_word.lexical_class in lexical_classes else ''
-
-            r = dict(subject=subj_id,
-                     block=block,
-                     condition=cond_name,
-                     item_num=item_num,
-                     n_target_words=n_target_words,
-                     target=raw_target,
-                     response=raw_response,
-                     word_order=n_target_words-i,
-                     word_class=target_word.lexical_class,
-                     word_class_order=lexical_class_order,
-                     target_word=target_word,
-                     word_ok=1 if word_said else 0,
-                     digit_ok=None if digit_said is None else 1 if digit_said else 0,
-                     )
+        for i, (word_said, digit_said, word_code) in enumerate(zip(target_word_said, target_digit_said, target)):
+
+            target_word = word_table.words[word_code]
+            lexical_class = word_table.classes[word_table.lexical_class[word_code]]
+            lexical_class_order = lexical_classes.index(lexical_class) if lexical_class in lexical_classes else ''
+
+            #-- The values of WordResults.columns
+            r = (subj_id,
+                 block,
+                 cond_name,
+                 item_num,
+                 n_target_words,
+                 raw_target,
+                 raw_response,
+                 n_target_words-i,
+                 lexical_class,
+                 lexical_class_order,
+                 target_word,
+                 1 if word_said else 0,
+                 None if digit_said is None else 1 if digit_said else 0,
+                 )
 
             result_per_word.append(r)
 
@@ -348,14 +1210,15 @@ class ErrorAnalyzer(object):
 
 
     #------------------------------------------------------
-    def _save_value(self, out_ws, rownum, colname, value):
-        out_ws.cell(rownum, 1 + self.xls_out_cols.index(colname)).value = value
+    def _save_value(self, out_row, colname, value):
+        out_row[self._out_col_inds[colname]] = value
 
 
     #------------------------------------------------------
     def _n_missing_classes(self, target, response):
-        target = [t.lexical_class for t in target]
-        response = [r.lexical_class for r in response]
+        word_class = word_table.lexical_class
+        target = [word_class[t] for t in target]
+        response = [word_class[r] for r in response]
 
         for r in response:
             if r in target:
@@ -366,7 +1229,14 @@ class ErrorAnalyzer(object):
 
     #------------------------------------------------------
     def target_items_said(self, target_words, response_words):
-        """ Return an array of bool: for each target item, whether it was said or not """
+        """
+        Return an array of bool: for each target item, whether it was said or not
+
+        :param target_words: The target word codes
+        :param response_words: The response word codes
+        """
+
+        word_digit = word_table.digit
 
         #---- Step 1: fully-correct words
 
@@ -391,11 +1261,11 @@ class ErrorAnalyzer(object):
 
         target_digit_said = list(target_word_said)
         for i, t in enumerate(target_words):
-            if t.digit is None:
+            if word_digit[t] is None:
                 target_digit_said[i] = None
 
-        remaining_target_digit_inds = {t.digit: i for i, t in enumerate(tmp_target_words) if t is not None and t.digit is not None}
-        remaining_response_digits = [r.digit for r in response_words if r is not None and r.digit is not None]
+        remaining_target_digit_inds = {word_digit[t]: i for i, t in enumerate(tmp_target_words) if t is not None and word_digit[t] is not None}
+        remaining_response_digits = [word_digit[r] for r in response_words if r is not None and word_digit[r] is not None]
 
         #-- Loop through response, mark each said digit
         for i, resp in enumerate(remaining_response_digits):
@@ -451,12 +1321,11 @@ class ErrorAnalyzer(object):
         response_str = str(response_str)
 
         #-- Check if there are optional things
-        m = re.match('(.*);(.+)', response_str)
-        if m is None:
+        response_str, optional_str = self._tokenizer.split_optional(response_str)
+        if optional_str is None:
             response_segments_unknown_loc = []
         else:
-            response_str = m.group(1)
-            response_segments_unknown_loc = self.parse_target_or_response(m.group(2), rownum)
+            response_segments_unknown_loc = self.parse_target_or_response(optional_str, rownum)
             if response_segments_unknown_loc is None:
                 return None
 
@@ -498,7 +1367,7 @@ class ErrorAnalyzer(object):
     #------------------------------------------------------
     def parse_target_or_response(self, raw_text, rownum):
         """
-        Return a list of segments, each of which is a list of words
+        Return a list of segments, each of which is a tuple of word codes (see sc.matcher.WordTable)
         """
 
         if isinstance(raw_text, float):
@@ -506,25 +1375,40 @@ class ErrorAnalyzer(object):
         elif isinstance(raw_text, int):
             raw_text = "{:}".format(raw_text)
 
-        segments = [e.strip() for e in raw_text.split('/')]
+        if self.parse_cache is None:
+            return self._parse_target_or_response(raw_text, rownum)
+
+        key = (raw_text, self._parse_settings)
+        parsed_segments = self.parse_cache.get(key)
+        if parsed_segments is None:
+            parsed_segments = self._parse_target_or_response(raw_text, rownum)
+            if parsed_segments is None:
+                #-- Invalid texts are not cached, so the warning is printed for each row
+                return None
+            self.parse_cache.put(key, tuple(parsed_segments))
+
+        return list(parsed_segments)
+
+
+    #------------------------------------------------------
+    def _parse_target_or_response(self, raw_text, rownum):
 
         parsed_segments = []
-        for seg in segments:
-            m = re.match('^([0-9,]*)\\s*t\\s*([0-9,]+)?$', seg)
+        for seg, pre_thousand, post_thousand in self._tokenizer.segments(raw_text):
 
-            if m is None:
+            if pre_thousand is None:
                 parsed_segment = [self.parse_segment_into_word_list(seg)]
             else:
-                parsed_segment = self._parse_pre_thousand_segment(m, seg)
-                if m.group(2) is not None:
-                    parsed_segment.append(self.parse_segment_into_word_list(m.group(2)))
+                parsed_segment = self._parse_pre_thousand_segment(pre_thousand, seg)
+                if post_thousand is not None:
+                    parsed_segment.append(self.parse_segment_into_word_list(post_thousand))
 
             if None in parsed_segment:  # invalid format
                 print('WARNING: unsupported target/response format: "{}" -- line {} ignored'.format(raw_text, rownum))
                 return None
 
-            #-- combine parts of the parsed segment
-            parsed_segment = [e for seg in parsed_segment for e in seg]
+            #-- combine parts of the parsed segment, and encode the words ("correct" remains as is)
+            parsed_segment = [e if isinstance(e, str) else word_table.code(e) for seg in parsed_segment for e in seg]
 
             parsed_segments.append(tuple(parsed_segment))
 
@@ -532,20 +1416,20 @@ class ErrorAnalyzer(object):
 
 
     #------------------------------------------------------
-    def _parse_pre_thousand_segment(self, matcher, segment):
+    def _parse_pre_thousand_segment(self, pre_thousand, segment):
         """ Parse the 'thousand' and the preceding digits """
 
-        if len(matcher.group(1)) == 0:
+        if len(pre_thousand) == 0:
             # -- The word "thousand" with no preceding digit
             return [self.parse_segment_into_word_list('t')]
 
-        elif len(matcher.group(1)) == 1:
+        elif len(pre_thousand) == 1:
             # -- A 4-digit number: the "thousand" is combined with the preceding digit
-            return [self.parse_segment_into_word_list(matcher.group(1) + '000')]
+            return [self.parse_segment_into_word_list(pre_thousand + '000')]
 
-        elif len(matcher.group(1)) in (2, 3):
+        elif len(pre_thousand) in (2, 3):
             # -- A 5- or 6-digit number: the "thousand" is a separate word
-            return [self.parse_segment_into_word_list(matcher.group(1)), self.parse_segment_into_word_list('t')]
+            return [self.parse_segment_into_word_list(pre_thousand), self.parse_segment_into_word_list('t')]
 
         else:
             raise Exception('Unsupported format: {}'.format(segment))
@@ -566,48 +1450,74 @@ class ErrorAnalyzer(object):
             return []
 
         #-- delete commas, set the unknown-digit characters to 'x'
-        segment = segment.replace(',', '')
-        for c in self.unknown_response_chars:
-            if c not in ('x', 'X'):
-                segment = segment.replace(c, 'x')
+        segment = self._tokenizer.clean_digits(segment)
 
-        result = verbalnumbers.hebrew.number_to_words(segment, digit_mapping=self._digit_mapping)
+        if self.lexicon is not False:
+            words = self._get_lexicon().words(segment)
+            if words is not None:
+                return list(words)
 
-        if not self.consider_thousand_as_digit:
-            one_thousand = verbalnumbers.general.NumberWord(verbalnumbers.hebrew.thousands, 1)
-            decimal_word_thousand = verbalnumbers.general.NumberWord(verbalnumbers.hebrew.decword_thousand, None)
-            for i, w in enumerate(result):
-                if w == one_thousand:
-                    result[i] = decimal_word_thousand
+        return segment_to_words(segment, self._digit_mapping, self.consider_thousand_as_digit)
 
-        return result
+
+    #------------------------------------------------------
+    def _get_lexicon(self):
+        """ The lexicon of this analyzer's settings (see the "lexicon" argument of the constructor) """
+        if self._lexicon is None:
+            directory = None if self.lexicon is True else self.lexicon
+            self._lexicon = get_lexicon(self._digit_mapping, self.consider_thousand_as_digit, directory)
+        return self._lexicon
 
 
     #------------------------------------------------------
-    def set_fixed_values(self, fixed_values, out_ws, out_row_num):
+    def _prepare_lexicon_for_workers(self):
+        """ Create and save the lexicon file (if the lexicon is saved in a directory), so that the workers only load it """
+        if self.lexicon not in (True, False):
+            self._get_lexicon()
+
+
+    #------------------------------------------------------
+    def set_fixed_values(self, fixed_values, out_row):
         for k, v in fixed_values.items():
-            self._save_value(out_ws, out_row_num, k, v)
+            self._save_value(out_row, k, v)
 
 
     #------------------------------------------------------
     def _open_worksheet(self, wb, worksheet, filename):
         if len(wb.worksheets) == 1:
-            ws = wb.worksheets[0]
-        else:
-            sheet_names = [s.title for s in wb.worksheets]
-            if worksheet not in sheet_names:
-                raise ValueError('{} does not contain any worksheet named "{}"'.format(filename, worksheet))
-            ws = wb.get_sheet_by_name(worksheet)
+            return wb.worksheets[0]
+
+        sheet_names = [s.title for s in wb.worksheets]
+        if worksheet not in sheet_names:
+            raise ValueError('{} does not contain any worksheet named "{}"'.format(filename, worksheet))
+
+        return wb[worksheet]
+
+
+    #------------------------------------------------------
+    def _read_worksheet(self, ws):
+        """
+        Read the whole worksheet in one pass.
+        Returns the index of each column (by the header row), and a list with one tuple of values per data row
+        """
 
-        col_inds = self._xls_structure(ws)
+        #-- The dimensions stored in the file may be stale; read whatever rows exist
+        if hasattr(ws, 'reset_dimensions'):
+            ws.reset_dimensions()
 
-        return ws, col_inds
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, ())
+        col_inds = self._xls_structure(header)
 
+        n_cols = len(header)
+        table = [row if len(row) == n_cols else (tuple(row) + (None,) * n_cols)[:n_cols] for row in rows]
 
-    def _xls_structure(self, ws):
+        return col_inds, table
+
+
+    def _xls_structure(self, header):
         result = {}
-        for i in range(1, ws.max_column+1):
-            col_name = ws.cell(1, i).value
+        for i, col_name in enumerate(header):
             result[col_name] = i
 
         missing_cols = [c for c in self.xls_cols if c not in result]
@@ -618,29 +1528,108 @@ class ErrorAnalyzer(object):
 
 
     #------------------------------------------------------
-    def create_output_workbook(self):
+    def create_row_cache(self, out_dir, out_fn_prefix):
+        """
+        Create the RowCache for incremental coding. The row results are saved in out_dir, next to the coded data.
+        """
+        if out_dir is None:
+            raise ValueError('Incremental coding requires an output directory')
+        return RowCache(out_dir + os.sep + out_fn_prefix + '_rowcache.pkl', self.config_hash())
+
+
+    def config_hash(self):
+        """
+        A hash of everything that affects the coding results: the analyzer's settings, the source code of its class
+        (including base classes) and of the modules that coding uses, and the version of mtl
+        """
+        import sc.lexicon
+        import sc.matcher
+        import sc.writers
+        import mtl.verbalnumbers.general
 
-        wb = openpyxl.Workbook()
-        ws = wb.worksheets[0]
+        ignored = ('parse_cache', '_tokenizer', '_parse_settings', 'lexicon', '_lexicon', 'instrument', 'stats',
+                   '_parse_cache_counts') + self.instrumented_methods
+        settings = [(k, _describe_setting(v)) for k, v in sorted(self.__dict__.items()) if k not in ignored]
 
-        for i_col, colname in enumerate(self.xls_out_cols):
-            ws.cell(1, i_col+1).value = colname
+        source_files = []
+        for cls in type(self).__mro__[:-1]:
+            try:
+                fn = inspect.getsourcefile(cls)
+            except TypeError:
+                continue
+            if fn is not None and fn not in source_files:
+                source_files.append(fn)
 
-        return wb, ws
+        for module in (sc.lexicon, sc.matcher, sc.writers, hebnum, mtl.verbalnumbers.general):
+            fn = inspect.getsourcefile(module)
+            if fn is not None and fn not in source_files:
+                source_files.append(fn)
 
+        h = hashlib.blake2b(repr((type(self).__qualname__, settings, _mtl_version())).encode('utf-8'), digest_size=16)
+        for fn in source_files:
+            with open(fn, 'rb') as fp:
+                h.update(fp.read())
+
+        return h.hexdigest()
 
-    #------------------------------------------------------
-    def auto_col_width(self, ws):
-        for col in ws.columns:
-            max_length = 0
-            for cell in col:
-                try:  # Necessary to avoid error on empty cells
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(cell.value)
-                except:
-                    pass
 
-            ws.column_dimensions[col[0].column_letter].width = max_length
+    #------------------------------------------------------
+    def create_output_writer(self, out_dir, out_fn_prefix, out_format='xlsx'):
+        return create_writer(out_format, out_dir + os.sep + out_fn_prefix, self.xls_out_cols)
+
+
+def _code_rows_in_worker(analyzer, worksheet, col_inds, rows, first_rownum):
+    """
+    Code a chunk of rows in a worker process (for pipeline mode).
+    Returns a (rownum, messages printed, code_row() result) tuple per row, the coding time, and the worker's RunStats
+    (None if the analyzer is not instrumented)
+    """
+    t0 = time.perf_counter()
+    results = []
+    for rownum, row in enumerate(rows, start=first_rownum):
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            row_result = analyzer.code_row(worksheet, col_inds, row, rownum)
+        results.append((rownum, log.getvalue(), row_result))
+    analyzer._count_cache_use()
+
+    return results, time.perf_counter() - t0, analyzer.stats
+
+
+def _code_worksheet_in_worker(analyzer, worksheet, col_inds, rows, prev_row_results=None):
+    """
+    Code one worksheet in a worker process.
+    Returns the WorksheetResult, the coded rows, the per-word results, the messages that were printed, the coding time,
+    the result per row (for incremental coding; None if prev_row_results is None), and the worker's RunStats (None if the
+    analyzer is not instrumented)
+    """
+    t0 = time.perf_counter()
+    out_rows = []
+    words = WordResults()
+    row_results = None if prev_row_results is None else {}
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        ws_result = analyzer.code_worksheet(worksheet, col_inds, rows, out_rows.append, words, prev_row_results, row_results)
+    analyzer._count_cache_use()
+
+    return ws_result, out_rows, words, log.getvalue(), time.perf_counter() - t0, row_results, analyzer.stats
+
+
+def _describe_setting(value):
+    """ A description of a setting value that is stable between runs (functions are described by their name) """
+    if callable(value):
+        return '{}.{}'.format(getattr(value, '__module__', ''), getattr(value, '__qualname__', repr(value)))
+    return value
+
+
+def _mtl_version():
+    """ The installed version of mtl (None if it isn't known, e.g. when mtl is not installed as a package) """
+    import importlib.metadata
+    import mtl
+    try:
+        return importlib.metadata.version('mtl')
+    except importlib.metadata.PackageNotFoundError:
+        return getattr(mtl, '__version__', None)
 
 
 def _isnull(v):
@@ -0,0 +1,202 @@
+"""
+Compact representation of number words, and batched target-response matching.
+
+Number words are interned in a WordTable: each distinct word (lexical class + digit) gets a small int code, and a parsed
+target/response is a tuple of codes. Two words are considered identical if they have the same lexical class and digit.
+
+The batched matcher does the computations of ErrorAnalyzer.target_items_said() and _n_missing_classes() for many
+trials at once, with array operations. The words of all trials are encoded as integer arrays (EncodedWords): one entry
+per word, with the trial index, the lexical class code and the digit (-1 = no digit).
+"""
+import itertools
+from collections import namedtuple
+
+import numpy as np
+
+EncodedWords = namedtuple('EncodedWords', ['trial', 'lexical_class', 'digit'])
+BatchMatch = namedtuple('BatchMatch', ['word_said', 'digit_said', 'has_digit', 'n_missing_classes'])
+
+_n_digit_codes = 11  # digits 0-9, and -1 for "no digit"
+
+
+#---------------------------------------------------------------------------
+class WordTable(object):
+    """
+    Interned number words. Each word code is an index to the lists:
+    - words: the NumberWord object
+    - lexical_class: the code of the word's lexical class (an index to "classes")
+    - digit: the word's digit (None if the word has no digit)
+
+    Codes are assigned in the order the words are first seen, so they are valid only within one process. Results that
+    leave the process (output rows, per-word results) contain the words themselves.
+    """
+
+    def __init__(self):
+        self._codes = {}
+        self._class_codes = {}
+        self._arrays = None
+        self.words = []
+        self.lexical_class = []
+        self.digit = []
+        self.classes = []
+
+    def code(self, word):
+        """ Get the code of a NumberWord """
+        key = word.lexical_class, word.digit
+        code = self._codes.get(key)
+        if code is None:
+            code = len(self.words)
+            self._codes[key] = code
+            self.words.append(word)
+            self.lexical_class.append(self.class_code(word.lexical_class))
+            self.digit.append(word.digit)
+        return code
+
+    def class_code(self, lexical_class):
+        code = self._class_codes.get(lexical_class)
+        if code is None:
+            code = len(self.classes)
+            self._class_codes[lexical_class] = code
+            self.classes.append(lexical_class)
+        return code
+
+    def arrays(self):
+        """ Arrays with the lexical class code and the digit (-1 = no digit) of each word code """
+        if self._arrays is None or len(self._arrays[0]) != len(self.words):
+            self._arrays = (np.array(self.lexical_class, dtype=np.int64),
+                            np.array([-1 if d is None else d for d in self.digit], dtype=np.int64))
+        return self._arrays
+
+    def encode(self, word_lists):
+        """
+        Get the EncodedWords of several trials
+
+        :param word_lists: One sequence of word codes per trial
+        """
+        lengths = np.fromiter(map(len, word_lists), dtype=np.int64, count=len(word_lists))
+        codes = np.fromiter(itertools.chain.from_iterable(word_lists), dtype=np.int64, count=int(lengths.sum()))
+        class_of_code, digit_of_code = self.arrays()
+        return EncodedWords(np.repeat(np.arange(len(word_lists)), lengths), class_of_code[codes], digit_of_code[codes])
+
+
+#: The word table of this process
+word_table = WordTable()
+
+
+#---------------------------------------------------------------------------
+def match_words(target, response, n_trials):
+    """
+    Match the target and response words of all trials
+
+    The results are the same as those of ErrorAnalyzer.target_items_said() and _n_missing_classes():
+    - A target word was said if the response has the same word; if a word appears k times in the target and m times
+      in the response, its first min(k, m) appearances in the target were said.
+    - The digit of a target word was said if the word was said, or if the word's digit appears in a response word that
+      was not matched to any target word. Each such digit is credited to one target word: the last unsaid target word
+      with this digit.
+    - The number of missing classes: for each lexical class, the number of its appearances in the target beyond its
+      number of appearances in the response.
+
+    :param target: EncodedWords with the target words of all trials. Within each trial, the words are in target order.
+    :param response: EncodedWords with the response words of all trials
+    :param n_trials: Number of trials
+    :return: BatchMatch - word_said, digit_said and has_digit are bool arrays with one entry per target word;
+             n_missing_classes is an int array with one entry per trial
+    """
+
+    n_classes = int(max(target.lexical_class.max(initial=-1), response.lexical_class.max(initial=-1))) + 1
+
+    t_word = _word_key(target, n_classes)
+    r_word = _word_key(response, n_classes)
+
+    #-- Step 1: fully-correct words
+    word_said = _occurrence_rank(t_word) < _count_in(r_word, t_word)
+
+    #-- Step 2: digits said with an incorrect class
+    has_digit = target.digit >= 0
+
+    r_word_values, r_word_counts = np.unique(r_word, return_counts=True)
+    unmatched = r_word_values[r_word_counts > _count_in(t_word, r_word_values)]
+    unmatched_digit = unmatched % _n_digit_codes - 1
+    unmatched_trial = unmatched // (n_classes * _n_digit_codes)
+    said_digits = unmatched_trial[unmatched_digit >= 0] * 10 + unmatched_digit[unmatched_digit >= 0]
+
+    unsaid_inds = np.flatnonzero(~word_said & has_digit)
+    unsaid_digits = target.trial[unsaid_inds] * 10 + target.digit[unsaid_inds]
+    credited = _is_last_occurrence(unsaid_digits) & np.isin(unsaid_digits, said_digits)
+
+    digit_said = word_said.copy()
+    digit_said[unsaid_inds[credited]] = True
+
+    #-- Missing classes
+    t_class = target.trial * n_classes + target.lexical_class
+    r_class = response.trial * n_classes + response.lexical_class
+    t_class_values, t_class_counts = np.unique(t_class, return_counts=True)
+    n_missing = np.maximum(t_class_counts - _count_in(r_class, t_class_values), 0)
+    n_missing_classes = np.bincount(t_class_values // n_classes, weights=n_missing, minlength=n_trials).astype(int)
+
+    return BatchMatch(word_said, digit_said, has_digit, n_missing_classes)
+
+
+#---------------------------------------------------------------------------
+def match_trials(targets, responses, table=None):
+    """
+    Match the words of several trials. This is a batched equivalent of calling target_items_said() and
+    _n_missing_classes() for each trial.
+
+    :param targets: One sequence of target word codes per trial (as returned by ErrorAnalyzer.parse_target)
+    :param responses: One sequence of response word codes per trial
+    :param table: The WordTable of the codes (default: this process's table)
+    :return: A list with one (target_word_said, target_digit_said, n_missing_classes) tuple per trial, in the same
+             format as returned by ErrorAnalyzer.target_items_said() and _n_missing_classes()
+    """
+    table = word_table if table is None else table
+    target = table.encode(targets)
+    m = match_words(target, table.encode(responses), len(targets))
+
+    word_said = m.word_said.tolist()
+    digit_said = [d if h else None for d, h in zip(m.digit_said.tolist(), m.has_digit.tolist())]
+    n_missing_classes = m.n_missing_classes.tolist()
+
+    bounds = np.searchsorted(target.trial, np.arange(len(targets) + 1)).tolist()
+    return [(word_said[bounds[i]:bounds[i+1]], digit_said[bounds[i]:bounds[i+1]], n_missing_classes[i])
+            for i in range(len(targets))]
+
+
+#---------------------------------------------------------------------------
+def _word_key(words, n_classes):
+    return (words.trial * n_classes + words.lexical_class) * _n_digit_codes + words.digit + 1
+
+
+def _count_in(values, keys):
+    """ The number of times each key appears in values """
+    values = np.sort(values)
+    return np.searchsorted(values, keys, side='right') - np.searchsorted(values, keys, side='left')
+
+
+def _occurrence_rank(keys):
+    """ For each entry: the number of earlier entries with the same key """
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    inds = np.arange(len(keys))
+    group_start = np.maximum.accumulate(np.where(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]], inds, 0))
+
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[order] = inds - group_start
+    return rank
+
+
+def _is_last_occurrence(keys):
+    """ For each entry: whether no later entry has the same key """
+    if len(keys) == 0:
+        return np.zeros(0, dtype=bool)
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    result = np.empty(len(keys), dtype=bool)
+    result[order] = np.r_[sorted_keys[1:] != sorted_keys[:-1], True]
+    return result
@@ -0,0 +1,187 @@
+"""
+Permutation tests
+
+- sign_flip_test(): paired design - the per-subject deltas (e.g. condition B minus condition A) are compared with 0.
+  Under the null hypothesis, the sign of each subject's delta is arbitrary, so the permutations flip the signs.
+- label_shuffle_test(): unpaired design - the values of two groups (e.g. per-subject effect sizes in two experiments)
+  are compared. Under the null hypothesis, the group labels are arbitrary, so the permutations shuffle them.
+
+The permutations are generated in chunks, as NumPy matrices (one row per permutation), and each chunk has its own
+random seed, spawned from the test's seed. The result therefore depends only on the seed - not on the number of
+processes. Chunks can be computed in a process pool; only the number of extreme permutations is kept from each chunk,
+so memory does not grow with the number of permutations. Optionally, the test stops early, once the confidence interval
+of the p value is narrow enough.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.stats
+
+PermutationResult = namedtuple('PermutationResult', ['statistic', 'p', 'n_permutations', 'p_ci', 'exact'])
+
+
+#---------------------------------------------------------------------------
+def sign_flip_test(deltas, alternative='greater', n_permutations=10000, seed=None, chunk_size=1000, ci_width=None,
+                   n_jobs=1, executor=None):
+    """
+    Test whether the mean of paired differences is different from 0, by flipping their signs.
+    If all 2^n sign combinations fit in n_permutations, the test is exact (all combinations are used).
+
+    :param deltas: One value per subject
+    :param alternative: 'greater' (mean > 0), 'less' or 'two-sided'
+    :param n_permutations: Number of random permutations
+    :param seed: Random seed (an int, a numpy SeedSequence, or None)
+    :param chunk_size: Number of permutations per chunk
+    :param ci_width: Stop when the 95% confidence interval of the p value is narrower than this (None = never stop early)
+    :param n_jobs: Number of processes (1 = compute in this process)
+    :param executor: A concurrent.futures executor to use instead of creating a pool
+    :return: PermutationResult - the statistic is the mean delta
+    """
+    deltas = np.asarray(deltas, dtype=float)
+    deltas = deltas[~np.isnan(deltas)]
+    n = len(deltas)
+
+    exact = n < 63 and 2 ** n <= n_permutations
+    if exact:
+        n_permutations = 2 ** n
+        ci_width = None
+
+    return _run('sign_flip', deltas, deltas.mean(), alternative, n_permutations, exact, seed, chunk_size, ci_width,
+                n_jobs, executor)
+
+
+#---------------------------------------------------------------------------
+def label_shuffle_test(values1, values2, alternative='greater', n_permutations=10000, seed=None, chunk_size=1000,
+                       ci_width=None, n_jobs=1, executor=None):
+    """
+    Test whether the mean of values1 is different from the mean of values2, by shuffling the values between the groups
+
+    :param alternative: 'greater' (mean of values1 > mean of values2), 'less' or 'two-sided'
+    :return: PermutationResult - the statistic is mean(values1) - mean(values2)
+    Other parameters: see sign_flip_test
+    """
+    values1 = np.asarray(values1, dtype=float)
+    values2 = np.asarray(values2, dtype=float)
+    values1 = values1[~np.isnan(values1)]
+    values2 = values2[~np.isnan(values2)]
+
+    data = np.concatenate([values1, values2]), len(values1)
+    return _run('label_shuffle', data, values1.mean() - values2.mean(), alternative, n_permutations, False, seed,
+                chunk_size, ci_width, n_jobs, executor)
+
+
+#---------------------------------------------------------------------------
+def _run(kind, data, observed, alternative, n_permutations, exact, seed, chunk_size, ci_width, n_jobs, executor):
+
+    if alternative not in ('greater', 'less', 'two-sided'):
+        raise ValueError('Invalid alternative "{}"'.format(alternative))
+
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    chunk_starts = list(range(0, n_permutations, chunk_size))
+    chunks = [(start, min(chunk_size, n_permutations - start), chunk_seed)
+              for start, chunk_seed in zip(chunk_starts, seed_seq.spawn(len(chunk_starts)))]
+
+    n_extreme = 0
+    n_done = 0
+
+    if n_jobs == 1 and executor is None:
+        for start, size, chunk_seed in chunks:
+            n_extreme += _count_extreme(kind, data, observed, alternative, start, size, exact, chunk_seed)
+            n_done += size
+            if _precise_enough(n_extreme, n_done, ci_width):
+                break
+
+    else:
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+
+        #-- A limited number of chunks is submitted ahead; the results are used in chunk order, so that early stopping
+        #-- happens after the same chunk as when running serially
+        max_pending = 2 * (n_jobs or 4)
+        pending = []
+        next_chunk = 0
+        try:
+            while next_chunk < len(chunks) or len(pending) > 0:
+                while next_chunk < len(chunks) and len(pending) < max_pending:
+                    start, size, chunk_seed = chunks[next_chunk]
+                    pending.append((size, executor.submit(_count_extreme, kind, data, observed, alternative, start, size,
+                                                          exact, chunk_seed)))
+                    next_chunk += 1
+
+                size, future = pending.pop(0)
+                n_extreme += future.result()
+                n_done += size
+                if _precise_enough(n_extreme, n_done, ci_width):
+                    break
+
+        finally:
+            for _, future in pending:
+                future.cancel()
+            if own_executor:
+                executor.shutdown()
+
+    if exact:
+        p = n_extreme / n_done
+        return PermutationResult(observed, p, n_done, (p, p), True)
+
+    #-- The observed data counts as one of the permutations
+    p = (n_extreme + 1) / (n_done + 1)
+    return PermutationResult(observed, p, n_done, _p_ci(n_extreme, n_done), False)
+
+
+def _precise_enough(n_extreme, n_done, ci_width):
+    if ci_width is None:
+        return False
+    low, high = _p_ci(n_extreme, n_done)
+    return high - low < ci_width
+
+
+def _p_ci(n_extreme, n, confidence=0.95):
+    """ Clopper-Pearson confidence interval of the p value """
+    alpha = (1 - confidence) / 2
+    low = 0.0 if n_extreme == 0 else scipy.stats.beta.ppf(alpha, n_extreme, n - n_extreme + 1)
+    high = 1.0 if n_extreme == n else scipy.stats.beta.ppf(1 - alpha, n_extreme + 1, n - n_extreme)
+    return low, high
+
+
+#---------------------------------------------------------------------------
+def _count_extreme(kind, data, observed, alternative, start, size, exact, seed):
+    """
+    Compute the statistic for one chunk of permutations, and return the number of permutations in which it was
+    at least as extreme as the observed statistic
+    """
+    if kind == 'sign_flip':
+        stats = _sign_flip_stats(data, start, size, exact, seed)
+    else:
+        stats = _label_shuffle_stats(data[0], data[1], size, seed)
+
+    #-- Tolerance for floating-point errors, so that permutations equivalent to the observed data are counted
+    tolerance = 1e-12 * max(1.0, abs(observed))
+    if alternative == 'greater':
+        return int(np.sum(stats >= observed - tolerance))
+    elif alternative == 'less':
+        return int(np.sum(stats <= observed + tolerance))
+    else:
+        return int(np.sum(np.abs(stats) >= abs(observed) - tolerance))
+
+
+def _sign_flip_stats(deltas, start, size, exact, seed):
+    n = len(deltas)
+    if exact:
+        #-- Permutation i flips the deltas whose bits are set in i
+        perm_inds = np.arange(start, start + size, dtype=np.int64)[:, np.newaxis]
+        signs = 1 - 2 * ((perm_inds >> np.arange(n, dtype=np.int64)) & 1)
+    else:
+        rng = np.random.default_rng(seed)
+        signs = 1 - 2 * rng.integers(0, 2, size=(size, n), dtype=np.int8)
+
+    return signs @ deltas / n
+
+
+def _label_shuffle_stats(pooled, n1, size, seed):
+    rng = np.random.default_rng(seed)
+    perms = rng.permuted(np.tile(np.arange(len(pooled)), (size, 1)), axis=1)
+    shuffled = pooled[perms]
+    return shuffled[:, :n1].mean(axis=1) - shuffled[:, n1:].mean(axis=1)
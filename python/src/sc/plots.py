@@ -1,18 +1,42 @@
 
+import argparse
+import hashlib
+import inspect
+import json
 import math
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-import matplotlib.pyplot as plt
+import pandas as pd
+import matplotlib
+from matplotlib.figure import Figure
+import sc.analyze
 import sc.utils
-from sc.analyze import get_value_per_subj_and_cond
+import sc.bootstrap
+import sc.loader
+from sc.analyze import DataSummary, get_value_per_subj_and_cond
+
+FigureResult = namedtuple('FigureResult', ['out_fn', 'status', 'render_time'])
+
+#-- The file in each output directory with the hash of each rendered figure
+figure_state_fn = '.sc_figures.json'
 
 
 #---------------------------------------------------------------------------
-def plot_cond_means(df, dependent_var, out_fn, ymax=None, dy=0.1, fig_size=None, cond_names=None, colors=('grey', )*10):
+def plot_cond_means(df, dependent_var, out_fn, ymax=None, dy=0.1, fig_size=None, cond_names=None, colors=('grey', )*10, ci=None):
     """
     Plot the mean value for each condition
+
+    :param df: The data, or a DataSummary grouped by Condition (and Subject, when plotting confidence intervals)
+    :param ci: Plot bootstrap confidence intervals with this confidence level (e.g. 0.95). None = no confidence intervals.
     """
 
-    conditions = sorted(df.Condition.unique())
+    summary = _summarize(df, [dependent_var], ['Condition'])
+    conditions = sorted(summary.levels('Condition'))
     n_conds = len(conditions)
 
     if cond_names is None:
@@ -20,31 +44,34 @@ def plot_cond_means(df, dependent_var, out_fn, ymax=None, dy=0.1, fig_size=None,
     else:
         assert len(cond_names) == n_conds, 'Invalid cond_names: got {} condition names, expecting {}'.format(len(cond_names), n_conds)
 
-    cond_means = [df[df.Condition == cond][dependent_var].mean() for cond in conditions]
+    cond_means = list(summary.mean(dependent_var, ['Condition']).reindex(conditions))
 
-    fig = plt.figure(figsize=fig_size)
+    fig, ax = _create_figure(fig_size)
 
     for i in range(n_conds):
-        plt.bar(i, cond_means[i], color=colors[i], zorder=10)
+        ax.bar(i, cond_means[i], color=colors[i], zorder=10)
 
-    ax = plt.gca()
+    if ci is not None:
+        _plot_ci(ax, range(n_conds), sc.bootstrap.bootstrap_means(df, dependent_var, ci=ci).reindex(conditions))
 
     _format_conds_graph(ax, conditions, dy, n_conds, ymax, font_size=None, cond_names=cond_names)
 
-    plt.savefig(out_fn)
-    plt.close(fig)
+    fig.savefig(out_fn)
+
+    return fig, ax
 
 
 #---------------------------------------------------------------------------
 def plot_cond_means_multiple_measures(df, dependent_vars, out_fn=None, ymax=None, d_y_ticks=None, fig_size=None, cond_names=None, conditions=None,
                                       cond_factor='Condition', dependent_var_names=None, cond_comparison_text=None,
-                                      colors=None, font_size=None, show_legend=True, visible_y_labels=1, print_means=False):
+                                      colors=None, font_size=None, show_legend=True, visible_y_labels=1, print_means=False, ci=None):
     """
     Plot the mean value for each condition - multiple measures
 
-    :param df:
+    :param df: The data, or a DataSummary of the dependent variables grouped by cond_factor (and Subject, when plotting
+               confidence intervals)
     :param dependent_vars: List of variables to plot (columns in df)
-    :param out_fn: Output pdf/png file name
+    :param out_fn: Output pdf/png file name (None = don't save the figure)
     :param ymax: Maximal y axis value
     :param d_y_ticks: Delta between y ticks
     :param fig_size: (width, height)
@@ -59,14 +86,17 @@ def plot_cond_means_multiple_measures(df, dependent_vars, out_fn=None, ymax=None
               None = all invisible.
     :param show_legend: Whether or not to plot the legend
     :param print_means: whether to print mean values to console.
+    :param ci: Plot bootstrap confidence intervals with this confidence level (e.g. 0.95). None = no confidence intervals.
+    :return: The figure and its axes
     """
 
-    conds_in_df = df[cond_factor].unique()
-    assert sum(_isempty(c) for c in conds_in_df) == 0, "The '{}' column is empty in some rows".format(cond_factor)
+    summary = _summarize(df, dependent_vars, [cond_factor])
+    assert sum(_isempty(c) for c in _cond_values(df, cond_factor)) == 0, "The '{}' column is empty in some rows".format(cond_factor)
+    conds_in_df = summary.levels(cond_factor)
 
     if conditions is None:
-        conditions = sorted(df[cond_factor].unique())
-    elif sorted(conditions) != sorted(df[cond_factor].unique()):
+        conditions = sorted(conds_in_df)
+    elif sorted(conditions) != sorted(conds_in_df):
         print("Warning: conditions are not identical with what's available in the data")
 
     n_conds = len(conditions)
@@ -84,25 +114,31 @@ def plot_cond_means_multiple_measures(df, dependent_vars, out_fn=None, ymax=None
     # -- Get data
     mean_per_var_and_cond = {}
     for dependent_var in dependent_vars:
-        for i_cond, cond in enumerate(conditions):
-            mean_per_var_and_cond[(dependent_var, cond)] = df[df[cond_factor] == cond][dependent_var].mean()
+        means = summary.mean(dependent_var, [cond_factor]).reindex(conditions)
+        for cond, mean in zip(conditions, means):
+            mean_per_var_and_cond[(dependent_var, cond)] = mean
+
+    if ci is not None:
+        ci_per_var = pd.concat({dependent_var: sc.bootstrap.bootstrap_means(df, dependent_var, groups=(cond_factor,), ci=ci)
+                                for dependent_var in dependent_vars})
 
     #-- Plot!
 
-    fig = plt.figure(figsize=fig_size)
+    fig, ax = _create_figure(fig_size)
 
     for i_cond, cond in enumerate(conditions):
         # mean_per_dv = [df[df[cond_factor] == cond][dependent_var].mean() for dependent_var in dependent_vars]
         mean_per_dv = [mean_per_var_and_cond[(dependent_var, cond)] for dependent_var in dependent_vars]
         x = [i_dv*(n_conds+1) + i_cond for i_dv in range(len(dependent_vars))]
-        plt.bar(x, mean_per_dv, color=colors[i_cond], zorder=10)
+        ax.bar(x, mean_per_dv, color=colors[i_cond], zorder=10)
+
+        if ci is not None:
+            _plot_ci(ax, x, ci_per_var.reindex([(dependent_var, cond) for dependent_var in dependent_vars]))
 
         if print_means:
             for dependent_var in dependent_vars:
                 print('{} condition {}: {:.1f}%'.format(dependent_var, cond, mean_per_var_and_cond[(dependent_var, cond)]*100))
 
-    ax = plt.gca()
-
     _format_conds_graph(ax, conditions, d_y_ticks, n_conds, ymax, font_size=font_size, x_labels=False, visible_y_labels=visible_y_labels)
     ax.set_xticks([i_dv*(n_conds+1) + ((n_conds+1) / 2 - 1) for i_dv in range(len(dependent_vars))])
     ax.set_xticklabels(dependent_var_names, fontsize=font_size)
@@ -124,11 +160,12 @@ def plot_cond_means_multiple_measures(df, dependent_vars, out_fn=None, ymax=None
                 sc.utils.plot_bar_comparison(ax, x1, x2, y1, y2, 0.02, cct[i_cond], 0.005)
 
     if show_legend:
-        plt.legend([cond_names[c] for c in conditions], fontsize=font_size)
+        ax.legend([cond_names[c] for c in conditions], fontsize=font_size)
 
     if out_fn is not None:
-        plt.savefig(out_fn)
-    plt.close(fig)
+        fig.savefig(out_fn)
+
+    return fig, ax
 
 
 #---------------------------------------------------------------------------
@@ -139,7 +176,7 @@ def plot_cond_means_multiple(datasets, dependent_var, out_fn, ymax, d_y_ticks, f
     """
     Plot the mean value for each condition - multiple measures
 
-    :param datasets: a list of data frames
+    :param datasets: a list of data frames (or of DataSummary objects grouped by cond_factor)
     :param dependent_vars: List of variables to plot (columns in df)
     :param out_fn: Output pdf/png file name
     :param ymax: Maximal y axis value
@@ -156,7 +193,8 @@ def plot_cond_means_multiple(datasets, dependent_var, out_fn, ymax, d_y_ticks, f
     :param show_legend: Whether or not to plot the legend
     """
 
-    conds_per_df = [set(df[cond_factor]) for df in datasets]
+    summaries = [_summarize(df, [dependent_var], [cond_factor]) for df in datasets]
+    conds_per_df = [set(_cond_values(df, cond_factor)) for df in datasets]
     conds_in_data = {c for s in conds_per_df for c in s}
     assert sum(_isempty(c) for c in conds_in_data) == 0, "The '{}' column is empty in some rows".format(cond_factor)
     assert sum(s != conds_in_data for s in conds_per_df) == 0, "The list of {}s is not the same for all datasets".format(cond_factor)
@@ -180,20 +218,19 @@ def plot_cond_means_multiple(datasets, dependent_var, out_fn, ymax, d_y_ticks, f
 
     # -- Get data
     mean_per_df_and_cond = {}
-    for i_df, df in enumerate(datasets):
-        for i_cond, cond in enumerate(conditions):
-            mean_per_df_and_cond[(i_df, cond)] = df[df[cond_factor] == cond][dependent_var].mean()
+    for i_df, summary in enumerate(summaries):
+        means = summary.mean(dependent_var, [cond_factor]).reindex(conditions)
+        for cond, mean in zip(conditions, means):
+            mean_per_df_and_cond[(i_df, cond)] = mean
 
     #-- Plot!
 
-    fig = plt.figure(figsize=fig_size)
+    fig, ax = _create_figure(fig_size)
 
     for i_cond, cond in enumerate(conditions):
         mean_per_ds = [mean_per_df_and_cond[(i, cond)] for i in range(len(datasets))]
         x = [i_df*(n_conds+1)+i_cond for i_df in range(len(datasets))]
-        plt.bar(x, mean_per_ds, color=colors[i_cond], zorder=10)
-
-    ax = plt.gca()
+        ax.bar(x, mean_per_ds, color=colors[i_cond], zorder=10)
 
     _format_conds_graph(ax, conditions, d_y_ticks, n_conds, ymax, font_size=font_size, x_labels=False, visible_y_labels=visible_y_labels)
     ax.set_xticks([i_df*(n_conds+1)+((n_conds+1) / 2 - 1) for i_df in range(len(datasets))])
@@ -218,19 +255,20 @@ def plot_cond_means_multiple(datasets, dependent_var, out_fn, ymax, d_y_ticks, f
                 sc.utils.plot_bar_comparison(ax, x1, x2, y1, y2, 0.02, cct[i_cond], 0.005)
 
     if xlim is not None:
-        plt.xlim(xlim)
+        ax.set_xlim(xlim)
 
     if show_legend:
-        plt.legend([cond_names[c] for c in conditions], fontsize=font_size, title=legend_title)
+        ax.legend([cond_names[c] for c in conditions], fontsize=font_size, title=legend_title)
 
-    plt.savefig(out_fn)
-    plt.close(fig)
+    fig.savefig(out_fn)
+
+    return fig, ax
 
 
 #---------------------------------------------------------------------------
 def plot_performance_progress(df, dependent_var, ylabel, out_fn, ymax, d_y_ticks, fig_size, cond_names=None,
                              colors=None, font_size=None, show_legend=True, visible_y_labels=1,
-                             legend_title=None, xlim=None, xlabel=None, show_xticks=True, stderr=True):
+                             legend_title=None, xlim=None, xlabel=None, show_xticks=True, stderr=True, ci=None):
     """
     Plot the mean value for each condition - multiple measures
 
@@ -249,6 +287,8 @@ def plot_performance_progress(df, dependent_var, ylabel, out_fn, ymax, d_y_ticks
     :param font_size:
     :param visible_y_labels: which y labels should be plotted (unplotted labels only have ticks)
     :param show_legend: Whether or not to plot the legend
+    :param stderr: Whether to plot a band of +/- one standard error around the mean of subjects
+    :param ci: Plot a bootstrap confidence interval with this confidence level (e.g. 0.95) instead of the standard error
     """
 
     conditions = sorted(df.Condition.unique())
@@ -261,13 +301,11 @@ def plot_performance_progress(df, dependent_var, ylabel, out_fn, ymax, d_y_ticks
 
     #-- Get the data
     x_per_block_and_quartile, all_x, x_desc = _get_x_per_block_and_quartile(df)
-    data_per_cond = get_data_per_cond_block_quartile(df, dependent_var, x_per_block_and_quartile)
+    data_per_cond = get_data_per_cond_block_quartile(df, dependent_var, x_per_block_and_quartile, ci=ci)
 
     #-- Plot!
 
-    fig = plt.figure(figsize=fig_size)
-    plt.clf()
-    ax = plt.gca()
+    fig, ax = _create_figure(fig_size)
 
     for i_cond, cond in enumerate(conditions):
         for cond_data in data_per_cond[cond]:
@@ -275,13 +313,14 @@ def plot_performance_progress(df, dependent_var, ylabel, out_fn, ymax, d_y_ticks
             y = cond_data['y']
             se = cond_data['se']
             ax.plot(x, y, color=colors[i_cond], linewidth=0.5, marker='o', markersize=4, zorder=10)
-            if stderr:
+            if ci is not None:
+                ax.fill_between(x, cond_data['low'], cond_data['high'], color=colors[i_cond], alpha=0.2, linewidth=0, zorder=5,
+                                label='_nolegend_')
+            elif stderr:
                 ax.fill_between(x, y-se, y+se, color=colors[i_cond], alpha=0.2, linewidth=0, zorder=5)
 
-    ax = plt.gca()
-
     if ymax is not None:
-        plt.ylim([0, ymax])
+        ax.set_ylim([0, ymax])
 
     if show_xticks:
         ax.set_xticks(all_x)
@@ -303,46 +342,78 @@ def plot_performance_progress(df, dependent_var, ylabel, out_fn, ymax, d_y_ticks
         ax.set_xlabel(xlabel, fontsize=font_size)
 
     if xlim is not None:
-        plt.xlim(xlim)
+        ax.set_xlim(xlim)
 
     if show_legend:
-        plt.legend([cond_names[c] for c in conditions], fontsize=font_size, title=legend_title)
+        ax.legend([cond_names[c] for c in conditions], fontsize=font_size, title=legend_title)
 
-    plt.savefig(out_fn)
-    plt.close(fig)
+    fig.savefig(out_fn)
 
+    return fig, ax
 
-def get_data_per_cond_block_quartile(df, dependent_var, x_per_block_and_quartile):
+
+def get_data_per_cond_block_quartile(df, dependent_var, x_per_block_and_quartile, ci=None):
     """
     Get the mean data for each condition, block, and quartile
     Returns x and y data, each with the same structure:
     result[condition] - array with #blocks entries, each is an array with #quartiles x/y values
+
+    :param ci: If specified, also get a bootstrap confidence interval (resampling subjects) with this confidence level,
+               as "low" and "high" values
     """
 
-    result = {}
+    #-- Mean per subject, then the mean and standard error over subjects. A group with a NaN subject mean gets NaN
+    #-- (as np.mean and np.std do)
+    mean_per_subject = df.groupby(['Condition', 'block', 'quartile', 'Subject'], sort=False, observed=True)[dependent_var].mean()
+    grouped = mean_per_subject.groupby(level=['Condition', 'block', 'quartile'], sort=False)
+    n_subjects = grouped.size()
+    has_nan = grouped.count() < n_subjects
+    stats = pd.DataFrame(dict(y=grouped.mean().mask(has_nan),
+                              se=(grouped.std(ddof=0) / np.sqrt(n_subjects)).mask(has_nan)))
+
+    if ci is not None:
+        bounds = sc.bootstrap.bootstrap_means(df, dependent_var, groups=('Condition', 'block', 'quartile'),
+                                              statistic='subject_mean', ci=ci)
+        stats = stats.join(bounds[['low', 'high']], how='outer')
+
+    blocks = sorted(df.block.unique())
+    quartiles = sorted(df.quartile.unique())
+    conditions = df.Condition.unique()
+    stats = stats.reindex(pd.MultiIndex.from_product([conditions, blocks, quartiles]))
+    block_x = [np.array([x_per_block_and_quartile[block][quartile] for quartile in quartiles]) for block in blocks]
+
+    shape = len(conditions), len(blocks), len(quartiles)
+    values = {col: stats[col].values.reshape(shape) for col in stats.columns}
 
-    for cond in df.Condition.unique():
-        cdf = df[df.Condition == cond]
-        result[cond] = []
-
-        for block in sorted(df.block.unique()):
-            block_x = []
-            block_y = []
-            block_se = []
-            for quartile in sorted(df.quartile.unique()):
-                qdf = cdf[(cdf.block == block) & (cdf.quartile == quartile)]
-                mean_per_subject = [qdf[qdf.Subject == s][dependent_var].mean() for s in qdf.Subject.unique()]
-                block_x.append(x_per_block_and_quartile[block][quartile])
-                block_y.append(np.mean(mean_per_subject))
-                block_se.append(np.std(mean_per_subject) / math.sqrt(len(mean_per_subject)))
-
-            result[cond].append(dict(x=np.array(block_x),
-                                     y=np.array(block_y),
-                                     se=np.array(block_se)))
+    result = {}
+    for i_cond, cond in enumerate(conditions):
+        result[cond] = [dict(x=block_x[i_block], **{col: values[col][i_cond, i_block] for col in values})
+                        for i_block in range(len(blocks))]
 
     return result
 
 
+def _plot_ci(ax, x, bounds):
+    """
+    Plot confidence intervals as error bars
+
+    :param bounds: DataFrame with the columns mean, low, high - one row per x value
+    """
+    means = bounds['mean'].values
+    ax.errorbar(list(x), means, yerr=[means - bounds['low'].values, bounds['high'].values - means], fmt='none',
+                 ecolor='black', elinewidth=0.8, capsize=3, zorder=11, label='_nolegend_')
+
+
+def _create_figure(fig_size):
+    """
+    Create a figure with one axes. The figure is not managed by pyplot: it is not shown and need not be closed,
+    and figures can be rendered in parallel processes. The plotting functions return it, so that the caller can
+    change it, save it or display it (e.g. in a notebook).
+    """
+    fig = Figure(figsize=fig_size)
+    return fig, fig.add_subplot()
+
+
 #---------------------------------------------------------------------------
 def _get_x_per_block_and_quartile(df):
     """
@@ -354,12 +425,13 @@ def _get_x_per_block_and_quartile(df):
     all_x = []
     x_desc = []
 
+    block_quartiles = df[['block', 'quartile']].dropna(subset=['block']).drop_duplicates().sort_values(['block', 'quartile'])
+
     x = 0
-    for block in sorted(df.block.unique()):
+    for block, quartiles in block_quartiles.groupby('block', sort=True).quartile:
         x_per_block_and_quartile[block] = {}
-        bdf = df[df.block == block]
 
-        for quartile in sorted(bdf.quartile.unique()):
+        for quartile in quartiles:
             x_per_block_and_quartile[block][quartile] = x
             all_x.append(x)
             x_desc.append('Q{}'.format(quartile))
@@ -377,7 +449,7 @@ def _format_conds_graph(ax, conditions, dy, n_conds, ymax, font_size, x_labels=T
     """
 
     if ymax is not None:
-        plt.ylim([0, ymax])
+        ax.set_ylim([0, ymax])
 
     if x_labels:
         ax.set_xticks(range(n_conds))
@@ -400,7 +472,7 @@ def _format_conds_graph(ax, conditions, dy, n_conds, ymax, font_size, x_labels=T
 #---------------------------------------------------------------------------
 def set_yticks(ax, dy, font_size=None, visible_y_labels=None, ymin=0):
 
-    ymax = plt.ylim()[1]
+    ymax = ax.get_ylim()[1]
 
     y_ticks = np.arange(ymin, ymax+.0001, dy)
     ax.set_yticks(y_ticks)
@@ -432,26 +504,25 @@ def plot_2cond_means_per_subject(df, dependent_var, out_fn, ymax=None, dy=0.1, f
 
     subj_inf = get_value_per_subj_and_cond(conds, dependent_var, df, subj_ids, sort_by_delta)
 
-    fig = plt.figure(figsize=fig_size)
+    fig, ax = _create_figure(fig_size)
 
     x0 = np.array(range(n_subjs)) * (n_conds + 1)
     for condnum in range(n_conds):
-        plt.bar(x0 + condnum, [i['c{}'.format(condnum+1)] for i in subj_inf], color=[colors[condnum]] * 3, zorder=10)
-
-    ax = plt.gca()
+        ax.bar(x0 + condnum, [i['c{}'.format(condnum+1)] for i in subj_inf], color=[colors[condnum]] * 3, zorder=10)
 
     _format_conds_graph(ax, conds, dy, n_conds, ymax, font_size=font_size, x_labels=False, cond_names=cond_names)
 
     ax.set_xticks(x0 + (n_conds-1) / 2)
     ax.set_xticklabels([get_subj_id_func(i['subject']) for i in subj_inf], fontsize=font_size)
-    plt.xlabel('Participant', fontsize=font_size)
-    plt.ylabel('Error rate', fontsize=font_size)
+    ax.set_xlabel('Participant', fontsize=font_size)
+    ax.set_ylabel('Error rate', fontsize=font_size)
 
     if cond_names is not None:
-        plt.legend([cond_names[c] for c in conds], fontsize=font_size, loc=legend_loc)
+        ax.legend([cond_names[c] for c in conds], fontsize=font_size, loc=legend_loc)
+
+    fig.savefig(out_fn)
 
-    plt.savefig(out_fn)
-    plt.close(fig)
+    return fig, ax
 
 
 #---------------------------------------------------------------------------
@@ -460,11 +531,15 @@ def plot_cond_means_per_subject(df, dependent_var, out_fn, ymax=None, dy=0.1, fi
                                 print_cond_order=False, cond_order_text_dy=-0.01):
     """
     Plot the mean value for each condition - separate plot per subject
+
+    :param df: The data, or a DataSummary grouped by Subject and Condition (and cond_order, if print_cond_order=True)
     """
 
-    conditions = sorted(df.Condition.unique())
+    summary = _summarize(df, [dependent_var], ['Subject', 'Condition'] + (['cond_order'] if print_cond_order else []))
+
+    conditions = sorted(summary.levels('Condition'))
     n_conds = len(conditions)
-    subj_ids = sorted(df.Subject.unique())
+    subj_ids = sorted(summary.levels('Subject'))
 
     #-- Group subject arbitrarily
     if subj_grouping is None:
@@ -476,13 +551,13 @@ def plot_cond_means_per_subject(df, dependent_var, out_fn, ymax=None, dy=0.1, fi
     else:
         assert len(cond_names) == n_conds, 'Invalid cond_names: got {} condition names, expecting {}'.format(len(cond_names), n_conds)
 
-    plt.figure(figsize=fig_size)
-    fig, axes = plt.subplots(n_rows, n_cols, figsize=fig_size)
+    fig = Figure(figsize=fig_size)
+    axes = fig.subplots(n_rows, n_cols)
     fig.subplots_adjust(hspace=.3, wspace=0.3)
     axes = np.reshape(axes, [n_rows * n_cols])
 
     for i_group, curr_group_subj_ids in enumerate(subj_grouping):
-        plot_subject_group(df, dependent_var, curr_group_subj_ids, conditions, cond_names, ax=axes[i_group],
+        plot_subject_group(summary, dependent_var, curr_group_subj_ids, conditions, cond_names, ax=axes[i_group],
                            ymax=ymax, dy=dy, colors=colors, font_size=font_size,
                            print_cond_order=print_cond_order, cond_order_text_dy=cond_order_text_dy)
         if i_group % 2 == 0:
@@ -491,8 +566,9 @@ def plot_cond_means_per_subject(df, dependent_var, out_fn, ymax=None, dy=0.1, fi
     for i in range(len(subj_grouping), n_cols * n_rows):
         axes[i].axis('off')
 
-    plt.savefig(out_fn)
-    plt.close(fig)
+    fig.savefig(out_fn)
+
+    return fig, axes
 
 
 #---------------------------------------------------------------------------
@@ -500,11 +576,15 @@ def plot_subject_group(df, dependent_var, subj_ids, conditions, cond_names, ax,
                        print_cond_order, cond_order_text_dy):
     """
     Plot a group of subjects as one figure (one panel)
+
+    :param df: The data, or a DataSummary grouped by Subject and Condition (and cond_order, if print_cond_order=True)
     """
 
+    summary = _summarize(df, [dependent_var], ['Subject', 'Condition'] + (['cond_order'] if print_cond_order else []))
+    means = summary.cube(dependent_var).mean_table('Subject', 'Condition', row_values=subj_ids, col_values=conditions)
+
     for i_subj, subj in enumerate(subj_ids):
-        subj_df = df[df.Subject == subj]
-        cond_means = [subj_df[subj_df.Condition == cond][dependent_var].mean() for cond in conditions]
+        cond_means = list(means.loc[subj])
 
         print('Subject {}: Minimal condition = {}'.format(subj, conditions[np.argmin(cond_means)]))
 
@@ -512,7 +592,7 @@ def plot_subject_group(df, dependent_var, subj_ids, conditions, cond_names, ax,
         ax.plot(x, cond_means, color=colors[i_subj], zorder=10, linewidth=0.5, marker='o')
 
         if print_cond_order:
-            subj_co = list(subj_df.cond_order.unique())
+            subj_co = list(summary.where(Subject=subj).levels('cond_order'))
             assert len(subj_co) == 1, "More than one cond_order for subject {}".format(subj)
             cond_order = [subj_co[0].index(c) + 1 for c in conditions]
             for xx, yy, txt in zip(x, cond_means, cond_order):
@@ -525,56 +605,64 @@ def plot_subject_group(df, dependent_var, subj_ids, conditions, cond_names, ax,
 #---------------------------------------------------------------------------
 def plot_digit_accuracy_per_position(df, save_as=None, colors=None, conditions=None, cond_names=None, pos_field='word_order', ylim=(0, 1),
                                      d_y_ticks=None, font_size=None, fig_size=None, text_dy=-0.005, marker_text=None):
+    """
+    Plot the error rate per word position, for each condition
+
+    :param df: The per-word data, or a DataSummary of digit_ok grouped by condition, pos_field and n_target_words
+    :param save_as: Output pdf/png file name (None = don't save the figure)
+    :return: The figure and its axes
+    """
 
-    if len(df.n_target_words.unique()) > 1:
+    summary = _summarize(df, ['digit_ok'], ['condition', pos_field, 'n_target_words'])
+
+    if len(summary.levels('n_target_words')) > 1:
         raise ValueError('ERROR: the data contains stimuli of different lengths')
 
-    n_target_words = df.n_target_words[0]
+    n_target_words = summary.levels('n_target_words')[0]
 
     x = list(range(1, n_target_words+1))
 
-    df = df[~df.digit_ok.isnull()]
+    #-- Only positions with a non-empty digit_ok
+    counts = summary.cube('digit_ok').count(['condition', pos_field])
+    errors = 1 - summary.mean('digit_ok', ['condition', pos_field])[counts > 0]
 
     if conditions is None:
-        conditions = sorted(df.condition.unique())
+        conditions = sorted(errors.index.get_level_values('condition').unique())
 
     if cond_names is None:
         cond_names = conditions
 
-    plt.clf()
-    fig = plt.figure(figsize=fig_size)
+    fig, ax = _create_figure(fig_size)
 
     for i_cond, cond in enumerate(conditions):
-        cdf = df[df.condition == cond]
+        cond_errors = errors[errors.index.get_level_values('condition') == cond].droplevel('condition').sort_index()
 
-        positions = sorted(cdf[pos_field].unique())
+        positions = list(cond_errors.index)
         if n_target_words < 5:
             assert len(positions) == n_target_words
         else:
             assert len(positions) == n_target_words - 1
 
-        y = [1 - cdf.digit_ok[cdf[pos_field] == pos].mean() for pos in positions]
+        y = list(cond_errors)
 
         color = None if colors is None else colors[i_cond]
-        plt.plot(positions, y, color=color, marker='o', markersize=8)
+        ax.plot(positions, y, color=color, marker='o', markersize=8)
 
         if marker_text is not None:
             for xx, yy, txt in zip(positions, y, marker_text[i_cond]):
-                plt.text(xx, yy+text_dy, txt, fontsize=7, horizontalalignment='center', color='white')
-
-    plt.legend(cond_names)
+                ax.text(xx, yy+text_dy, txt, fontsize=7, horizontalalignment='center', color='white')
 
-    ax = plt.gca()
+    ax.legend(cond_names)
 
     ax.set_xticks(x)
 
-    plt.ylim(ylim)
+    ax.set_ylim(ylim)
     if d_y_ticks is not None:
-        set_yticks(ax, d_y_ticks, font_size, ymin=plt.ylim()[0])
+        set_yticks(ax, d_y_ticks, font_size, ymin=ax.get_ylim()[0])
 
     ax.grid(axis='y', color=[0.9]*3, linewidth=0.5, zorder=0)
-    plt.ylabel('Errors', fontsize=font_size)
-    plt.xlabel('Serial position of word', fontsize=font_size)
+    ax.set_ylabel('Errors', fontsize=font_size)
+    ax.set_xlabel('Serial position of word', fontsize=font_size)
 
     ax.spines['top'].set_visible(False)
     ax.spines['right'].set_visible(False)
@@ -585,6 +673,238 @@ def plot_digit_accuracy_per_position(df, save_as=None, colors=None, conditions=N
     if save_as is not None:
         fig.savefig(save_as)
 
+    return fig, ax
+
 
 def _isempty(v):
     return v is None or v == '' or (isinstance(v, float) and math.isnan(v))
+
+
+def _summarize(df, dependent_vars, by):
+    """
+    Get a DataSummary of the data: aggregate a data frame, or check that a given summary has the required columns
+    """
+    if isinstance(df, DataSummary):
+        if not df.has(dependent_vars, by):
+            raise ValueError('The data summary must include the dependent variables {} grouped by {}'.format(list(dependent_vars), list(by)))
+        return df
+    return DataSummary(df, dependent_vars, by)
+
+
+def _cond_values(df, cond_factor):
+    """ The values of the condition column (a DataSummary ignores rows in which it is empty) """
+    return df.levels(cond_factor) if isinstance(df, DataSummary) else df[cond_factor].unique()
+
+
+#---------------------------------------------------------------------------
+#   Render many figures
+#---------------------------------------------------------------------------
+
+class FigureJob(object):
+    """
+    One figure to render with render_figures()
+
+    :param function: The plotting function - a function of this module, or its name
+    :param out_fn: Output file name (pdf, png etc.)
+    :param data: The data: a DataFrame, a list of DataFrames (for plot_cond_means_multiple), or a data file name
+                 (loaded with sc.loader.load_data)
+    :param query: Select the rows of the data file with this DataFrame.query() expression
+    :param kwargs: The other arguments of the plotting function
+    """
+
+    def __init__(self, function, out_fn, data, query=None, **kwargs):
+        self.function_name = function if isinstance(function, str) else function.__name__
+        if not callable(globals().get(self.function_name)):
+            raise ValueError('Invalid plotting function "{}"'.format(self.function_name))
+        self.out_fn = out_fn
+        self.data = data
+        self.query = query
+        self.kwargs = kwargs
+
+    def get_data(self):
+        if not isinstance(self.data, str):
+            return self.data
+        df = sc.loader.load_data(self.data)
+        return df if self.query is None else df.query(self.query)
+
+
+#---------------------------------------------------------------------------
+def load_figure_manifest(manifest_fn):
+    """
+    Load the list of figures from a JSON manifest file. Relative file names are relative to the manifest's directory.
+    The manifest is a list of figures, e.g.:
+
+    [
+      {"function": "plot_cond_means_multiple_measures", "data": "exp1&2/data_coded.xlsx",
+       "query": "Condition in ['A', 'B', 'C', 'D']", "out_fn": "figures/exp1_cond_mean_all.pdf",
+       "args": {"dependent_vars": ["PMissingMorphemes", "PMissingDigits"], "ymax": 0.28, "d_y_ticks": 0.05}}
+    ]
+    """
+    with open(manifest_fn) as fp:
+        specs = json.load(fp)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_fn))
+    return [FigureJob(spec['function'], os.path.join(base_dir, spec['out_fn']), os.path.join(base_dir, spec['data']),
+                      query=spec.get('query'), **spec.get('args', {}))
+            for spec in specs]
+
+
+#---------------------------------------------------------------------------
+def render_figures(jobs, n_jobs=None, executor=None, force=False):
+    """
+    Render figures in a pool of worker processes. A figure is skipped if it was already rendered with the same data,
+    arguments and plotting code (according to the figure_state_fn file in its directory).
+
+    :param jobs: List of FigureJob
+    :param n_jobs: Number of worker processes (default: number of CPUs; 1 = render in this process)
+    :param executor: An existing executor to use instead of creating a pool
+    :param force: Render all figures, even those that did not change
+    :return: List of FigureResult, one per job - status is 'rendered', 'skipped' or 'failed'
+    """
+
+    states = {}
+    figure_hashes = []
+    to_render = []
+
+    for job in jobs:
+        out_dir = os.path.dirname(os.path.abspath(job.out_fn))
+        if out_dir not in states:
+            states[out_dir] = _load_figure_state(out_dir)
+
+        data = job.get_data()
+        figure_hash = _figure_hash(job, data)
+        figure_hashes.append(figure_hash)
+
+        unchanged = states[out_dir].get(os.path.basename(job.out_fn)) == figure_hash and os.path.exists(job.out_fn)
+        if force or not unchanged:
+            to_render.append((job, data))
+
+    if n_jobs == 1 and executor is None:
+        outcomes = {id(job): _outcome(_render_figure, job.function_name, data, job.out_fn, job.kwargs) for job, data in to_render}
+
+    else:
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+        try:
+            futures = [(job, executor.submit(_render_figure, job.function_name, data, job.out_fn, job.kwargs))
+                       for job, data in to_render]
+            outcomes = {id(job): _outcome(future.result) for job, future in futures}
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    result = []
+    for job, figure_hash in zip(jobs, figure_hashes):
+        out_dir = os.path.dirname(os.path.abspath(job.out_fn))
+        if id(job) not in outcomes:
+            result.append(FigureResult(job.out_fn, 'skipped', 0))
+        elif isinstance(outcomes[id(job)], Exception):
+            print('Rendering {} failed: {}'.format(job.out_fn, outcomes[id(job)]))
+            states[out_dir].pop(os.path.basename(job.out_fn), None)
+            result.append(FigureResult(job.out_fn, 'failed', None))
+        else:
+            states[out_dir][os.path.basename(job.out_fn)] = figure_hash
+            result.append(FigureResult(job.out_fn, 'rendered', outcomes[id(job)]))
+
+    for out_dir, state in states.items():
+        _save_figure_state(out_dir, state)
+
+    print_figures_report(result)
+
+    return result
+
+
+def _outcome(func, *args):
+    """ The result of func(*args), or the exception it raised """
+    try:
+        return func(*args)
+    except Exception as e:
+        return e
+
+
+def _render_figure(function_name, data, out_fn, kwargs):
+    t0 = time.perf_counter()
+    kwargs = dict(kwargs)
+    kwargs['save_as' if function_name == 'plot_digit_accuracy_per_position' else 'out_fn'] = out_fn
+    globals()[function_name](data, **kwargs)
+    return time.perf_counter() - t0
+
+
+#---------------------------------------------------------------------------
+def _figure_hash(job, data):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps([job.function_name, _encode_param(job.kwargs)], sort_keys=True).encode('utf-8'))
+    for df in (data if isinstance(data, (list, tuple)) else [data]):
+        h.update(repr((list(df.columns), [str(t) for t in df.dtypes])).encode('utf-8'))
+        h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+
+    #-- Changes in the plotting code (this module, and the modules that compute what it plots) or in matplotlib also
+    #-- require rendering the figure again
+    h.update(matplotlib.__version__.encode('utf-8'))
+    for module in (sys.modules[__name__], sc.analyze, sc.bootstrap, sc.utils):
+        with open(inspect.getsourcefile(module), 'rb') as fp:
+            h.update(fp.read())
+
+    return h.hexdigest()
+
+
+def _encode_param(value):
+    """
+    Encode an argument of a plotting function as a JSON-compatible value that does not change between runs
+    (unlike the repr of functions and other objects, which includes their memory address)
+
+    :raises TypeError: If the value can't be encoded
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_encode_param(v) for v in value]
+    if isinstance(value, dict):
+        items = [[_encode_param(k), _encode_param(v)] for k, v in value.items()]
+        return {'__dict__': sorted(items, key=lambda item: json.dumps(item, sort_keys=True))}
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        data_hash = hashlib.blake2b(np.ascontiguousarray(value).tobytes(), digest_size=16).hexdigest()
+        return {'__ndarray__': [str(value.dtype), list(value.shape), data_hash]}
+    if callable(value) and hasattr(value, '__module__') and hasattr(value, '__qualname__'):
+        return {'__callable__': '{}.{}'.format(value.__module__, value.__qualname__)}
+
+    raise TypeError('Figure parameters of type {} are not supported'.format(type(value).__name__))
+
+
+def _load_figure_state(out_dir):
+    state_fn = os.path.join(out_dir, figure_state_fn)
+    if not os.path.exists(state_fn):
+        return {}
+    with open(state_fn) as fp:
+        return json.load(fp)
+
+
+def _save_figure_state(out_dir, state):
+    state_fn = os.path.join(out_dir, figure_state_fn)
+    tmp_fn = state_fn + '.tmp'
+    with open(tmp_fn, 'w') as fp:
+        json.dump(state, fp, indent=1, sort_keys=True)
+    os.replace(tmp_fn, state_fn)
+
+
+#---------------------------------------------------------------------------
+def print_figures_report(results):
+    n_rendered = sum(r.status == 'rendered' for r in results)
+    n_skipped = sum(r.status == 'skipped' for r in results)
+    n_failed = sum(r.status == 'failed' for r in results)
+    render_time = sum(r.render_time for r in results if r.status == 'rendered')
+    print('{} figures rendered ({:.1f} sec), {} unchanged figures skipped, {} failed'.format(n_rendered, render_time, n_skipped, n_failed))
+
+
+#---------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the figures of a figure manifest, in a pool of worker processes')
+    parser.add_argument('manifest', help='JSON file with the list of figures')
+    parser.add_argument('--n-jobs', type=int, default=None, help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--force', action='store_true', help='Render all figures, including unchanged ones')
+    args = parser.parse_args()
+
+    render_figures(load_figure_manifest(args.manifest), n_jobs=args.n_jobs, force=args.force)
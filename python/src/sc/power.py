@@ -0,0 +1,222 @@
+"""
+Simulation-based power analysis for the random-intercept model:
+
+    dependent_var ~ Condition + (1|Subject)
+
+The model is fitted to coded data, and new datasets are simulated from the fitted model - with the design (the
+conditions of each subject's trials) of the original subjects, recycled as needed to get more subjects, as simr's
+extend() does. Each simulated dataset is refitted, and the condition effect is tested.
+
+Fitting uses the closed-form within-subject estimator: the dependent variable and the condition are centered per
+subject, and the effect is the slope of the centered values. The subject intercepts cancel out in this estimator, so it
+needs only per-subject sums; for a within-subject design it gives the same effect estimate as lmer when each subject
+has the same design. The test is a t test with N - #subjects - 1 degrees of freedom.
+
+The simulations are done in batches, as NumPy matrices (one row per simulated dataset). Each batch has its own random
+seed, spawned from the analysis seed, so the results do not depend on the number of processes.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+ModelFit = namedtuple('ModelFit', ['intercept', 'effect', 'subject_sd', 'residual_sd', 'se', 't', 'df', 'p'])
+
+
+#---------------------------------------------------------------------------
+class RandomInterceptModel(object):
+    """
+    A random-intercept model fitted to one dataset
+
+    :param df: The data (one row per trial)
+    :param dependent_var: The dependent variable (e.g. 'PMissingMorphemes')
+    :param cond_values: The numeric value of each condition (dict). None = two conditions, coded as 0 and 1 in
+                        sorted order. Rows in other conditions are ignored.
+    """
+
+    def __init__(self, df, dependent_var, cond_values=None):
+
+        if cond_values is None:
+            conditions = sorted(df.Condition.unique())
+            if len(conditions) != 2:
+                raise ValueError('Expecting 2 conditions, found {}: specify the value of each condition'.format(len(conditions)))
+            cond_values = {conditions[0]: 0, conditions[1]: 1}
+
+        df = df[df.Condition.isin(list(cond_values.keys()))]
+        df = df[~df[dependent_var].isna()].sort_values('Subject', kind='stable')
+
+        self.dependent_var = dependent_var
+        self.cond_values = dict(cond_values)
+        self.subjects = df.Subject.unique()
+        self.x = df.Condition.map(self.cond_values).values.astype(float)
+        self.y = df[dependent_var].values.astype(float)
+        self.rows_per_subject = df.groupby('Subject', sort=False, observed=True).size().values
+
+        self.fit = _fit(self.y[np.newaxis, :], self.x, self.rows_per_subject, with_variances=True)
+        self.residuals = _within_fit(self.y[np.newaxis, :], self.x, self.rows_per_subject)[1][0]
+
+    #-------------------------------------------------------------
+    def design(self, n_subjects=None):
+        """
+        The design of a dataset with n_subjects subjects: the original subjects' designs are used in turn
+
+        :return: (x, rows_per_subject, original_row) - x and original_row have one entry per row
+        """
+        if n_subjects is None:
+            n_subjects = len(self.subjects)
+
+        starts = np.r_[0, np.cumsum(self.rows_per_subject)[:-1]]
+        subj_inds = np.arange(n_subjects) % len(self.subjects)
+        rows_per_subject = self.rows_per_subject[subj_inds]
+        original_row = np.concatenate([np.arange(starts[i], starts[i] + self.rows_per_subject[i]) for i in subj_inds])
+
+        return self.x[original_row], rows_per_subject, original_row
+
+    #-------------------------------------------------------------
+    def simulate(self, n_subjects, n_sims, rng, effect=None, resample_residuals=False):
+        """
+        Simulate datasets from the fitted model
+
+        :param effect: The condition effect (None = the fitted effect)
+        :param resample_residuals: Draw the residuals from the fitted model's residuals (instead of a normal distribution)
+        :return: (y, x, rows_per_subject) - y is a n_sims x #rows matrix
+        """
+        x, rows_per_subject, _ = self.design(n_subjects)
+        effect = self.fit.effect if effect is None else effect
+        n_rows = len(x)
+
+        subject_intercepts = rng.normal(0, self.fit.subject_sd, size=(n_sims, n_subjects))
+        if resample_residuals:
+            #-- Within-subject residuals are smaller than the errors by a factor of sqrt(df / N)
+            scale = np.sqrt(len(self.residuals) / self.fit.df)
+            errors = rng.choice(self.residuals * scale, size=(n_sims, n_rows))
+        else:
+            errors = rng.normal(0, self.fit.residual_sd, size=(n_sims, n_rows))
+
+        y = self.fit.intercept + effect * x + np.repeat(subject_intercepts, rows_per_subject, axis=1) + errors
+        return y, x, rows_per_subject
+
+
+#---------------------------------------------------------------------------
+def power_curve(df, dependent_var, n_subjects=(None, ), cond_values=None, n_sims=200, alpha=0.05, effect=None,
+                resample_residuals=False, seed=0, batch_size=100, n_jobs=1, executor=None):
+    """
+    Estimate the power to detect the condition effect, for several numbers of subjects
+
+    :param df: The data (one row per trial)
+    :param dependent_var: The dependent variable
+    :param n_subjects: List of subject counts (None = the number of subjects in the data)
+    :param cond_values: The numeric value of each condition - see RandomInterceptModel
+    :param n_sims: Number of simulated datasets per subject count
+    :param alpha: Significance level (two-tailed)
+    :param effect: The condition effect to simulate (None = the effect fitted to the data)
+    :param resample_residuals: Draw the residuals from the fitted model's residuals (instead of a normal distribution)
+    :param seed: Random seed
+    :param batch_size: Number of datasets simulated together
+    :param n_jobs: Number of processes (1 = compute in this process)
+    :param executor: A concurrent.futures executor to use instead of creating a pool
+    :return: DataFrame with one row per subject count, and the columns n_subjects, power, ci_low, ci_high (95%
+             confidence interval of the power), n_sims
+    """
+
+    model = RandomInterceptModel(df, dependent_var, cond_values)
+    n_subjects = [len(model.subjects) if n is None else n for n in n_subjects]
+
+    #-- One batch list for all subject counts, so all counts are simulated concurrently
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(n_subjects))
+    batches = []
+    for i_count, (n, count_seed) in enumerate(zip(n_subjects, seed_seqs)):
+        sizes = [min(batch_size, n_sims - start) for start in range(0, n_sims, batch_size)]
+        batches.extend((i_count, (model, n, size, batch_seed, alpha, effect, resample_residuals))
+                       for size, batch_seed in zip(sizes, count_seed.spawn(len(sizes))))
+
+    if n_jobs == 1 and executor is None:
+        n_significant = [_count_significant(*args) for _, args in batches]
+    else:
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+        try:
+            n_significant = list(executor.map(_count_significant, *zip(*[args for _, args in batches])))
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    significant_per_count = np.bincount([i for i, _ in batches], weights=n_significant, minlength=len(n_subjects))
+
+    rows = []
+    for n, k in zip(n_subjects, significant_per_count.astype(int)):
+        ci = scipy.stats.binomtest(k, n_sims).proportion_ci(method='exact')
+        rows.append(dict(n_subjects=n, power=k / n_sims, ci_low=ci.low, ci_high=ci.high, n_sims=n_sims))
+
+    return pd.DataFrame(rows)
+
+
+#---------------------------------------------------------------------------
+def print_power_curve(model, curve):
+    """
+    Print the fitted model and the power curve
+
+    :param model: RandomInterceptModel
+    :param curve: The result of power_curve()
+    """
+    f = model.fit
+    print('{} ~ Condition + (1|Subject): effect={:.4f}, SE={:.4f}, t({})={:.2f}, p={:.4f}; SD(subject)={:.4f}, SD(residual)={:.4f}'
+          .format(model.dependent_var, f.effect, f.se, f.df, f.t, f.p, f.subject_sd, f.residual_sd))
+    for row in curve.itertuples():
+        print('   {} subjects: power = {:.1f}% (95% CI: {:.1f}% - {:.1f}%), {} simulations'
+              .format(row.n_subjects, row.power * 100, row.ci_low * 100, row.ci_high * 100, row.n_sims))
+
+
+#---------------------------------------------------------------------------
+def _count_significant(model, n_subjects, n_sims, seed, alpha, effect, resample_residuals):
+    rng = np.random.default_rng(seed)
+    y, x, rows_per_subject = model.simulate(n_subjects, n_sims, rng, effect, resample_residuals)
+    return int(np.sum(_fit(y, x, rows_per_subject).p < alpha))
+
+
+def _within_fit(y, x, rows_per_subject):
+    """
+    The within-subject effect estimate and residuals of each dataset (row of y), and the sum of squares of the
+    centered condition values
+    """
+    starts = np.r_[0, np.cumsum(rows_per_subject)[:-1]]
+
+    x_centered = x - np.repeat(np.add.reduceat(x, starts) / rows_per_subject, rows_per_subject)
+    sxx = x_centered @ x_centered
+    if sxx == 0:
+        raise ValueError('The condition does not vary within subjects')
+
+    y_centered = y - np.repeat(np.add.reduceat(y, starts, axis=1) / rows_per_subject, rows_per_subject, axis=1)
+    effect = y_centered @ x_centered / sxx
+    return effect, y_centered - effect[:, np.newaxis] * x_centered, sxx
+
+
+def _fit(y, x, rows_per_subject, with_variances=False):
+    """
+    Fit the model to each dataset (row of y)
+
+    :return: ModelFit - each field is an array with one entry per dataset. If with_variances=True, the fields are
+             for the first dataset only, and also include the intercept and the subject SD.
+    """
+    starts = np.r_[0, np.cumsum(rows_per_subject)[:-1]]
+    n_subjects = len(rows_per_subject)
+
+    effect, residuals, sxx = _within_fit(y, x, rows_per_subject)
+    dof = len(x) - n_subjects - 1
+
+    residual_var = (residuals ** 2).sum(axis=1) / dof
+    se = np.sqrt(residual_var / sxx)
+    t = effect / se
+    p = 2 * scipy.stats.t.sf(np.abs(t), dof)
+
+    if not with_variances:
+        return ModelFit(None, effect, None, np.sqrt(residual_var), se, t, dof, p)
+
+    #-- Subject intercepts: the variance of the subject means beyond what is explained by the residual variance
+    subj_means = (np.add.reduceat(y[0], starts) - effect[0] * np.add.reduceat(x, starts)) / rows_per_subject
+    subject_var = max(0.0, subj_means.var(ddof=1) - residual_var[0] * np.mean(1 / rows_per_subject)) if n_subjects > 1 else 0.0
+
+    return ModelFit(subj_means.mean(), effect[0], np.sqrt(subject_var), np.sqrt(residual_var[0]), se[0], t[0], dof, p[0])
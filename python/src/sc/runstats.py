@@ -0,0 +1,107 @@
+"""
+Instrumentation of coding runs: where the time goes (see ErrorAnalyzer(instrument=True))
+"""
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    #-- Not available on Windows
+    resource = None
+
+
+#------------------------------------------------------
+class RunStats(object):
+    """
+    Statistics of one coding run:
+    - timers: per stage (function), the number of calls and the cumulative time. Stages can be nested (e.g. parse_row
+      includes parse_target), so the times don't add up.
+    - worksheets: the number of coded rows and the coding time of each worksheet
+    - counters: other counts, e.g. parse cache hits/misses
+    - wall_time and peak_memory_mb (the maximal resident set size of this process and of its worker processes)
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.worksheets = []
+        self.counters = {}
+        self.wall_time = None
+        self.peak_memory_mb = None
+        self._t0 = time.perf_counter()
+
+    def timed(self, name, func):
+        """ Wrap a function, so that its calls are counted and timed under the given stage name """
+        timer = self.timers.setdefault(name, [0, 0.0])
+
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timer[0] += 1
+                timer[1] += time.perf_counter() - t0
+
+        return wrapper
+
+    def add_time(self, name, elapsed, n_calls=1):
+        timer = self.timers.setdefault(name, [0, 0.0])
+        timer[0] += n_calls
+        timer[1] += elapsed
+
+    def add_worksheet(self, worksheet, n_rows, elapsed):
+        self.worksheets.append((worksheet, n_rows, elapsed))
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other):
+        """ Add the timers and counters of another RunStats (e.g. of a worker process) """
+        for name, (n_calls, elapsed) in other.timers.items():
+            self.add_time(name, elapsed, n_calls)
+        for name, n in other.counters.items():
+            self.count(name, n)
+
+    def finish(self):
+        """ Set the wall time and the peak memory """
+        self.wall_time = time.perf_counter() - self._t0
+        if resource is not None:
+            #-- ru_maxrss is in KB on Linux and in bytes on macOS
+            scale = 1 / 1024 ** 2 if sys.platform == 'darwin' else 1 / 1024
+            self.peak_memory_mb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+    def hit_rate(self, name):
+        """ The hit rate of a cache whose counters are <name>_hits and <name>_misses (None if it wasn't used) """
+        hits, misses = self.counters.get(name + '_hits', 0), self.counters.get(name + '_misses', 0)
+        return hits / (hits + misses) if hits + misses > 0 else None
+
+    def to_dict(self):
+        return dict(
+            wall_time=self.wall_time,
+            peak_memory_mb=self.peak_memory_mb,
+            timers={name: dict(calls=n_calls, time=elapsed, time_per_call=elapsed / n_calls if n_calls > 0 else None)
+                    for name, (n_calls, elapsed) in sorted(self.timers.items())},
+            worksheets=[dict(worksheet=ws, n_rows=n_rows, time=elapsed, rows_per_sec=n_rows / elapsed if elapsed > 0 else None)
+                        for ws, n_rows, elapsed in self.worksheets],
+            counters=dict(sorted(self.counters.items())),
+            parse_cache_hit_rate=self.hit_rate('parse_cache'),
+            row_cache_hit_rate=self.hit_rate('row_cache'))
+
+    def save(self, filename):
+        """ Save as a JSON report """
+        with open(filename, 'w') as fp:
+            json.dump(self.to_dict(), fp, indent=2, default=str)
+
+    def print(self):
+        print('\n{:<28} {:>10} {:>10} {:>14}'.format('Stage', 'Calls', 'Time (s)', 'Per call (ms)'))
+        for name, (n_calls, elapsed) in sorted(self.timers.items(), key=lambda t: -t[1][1]):
+            print('{:<28} {:>10} {:>10.3f} {:>14.3f}'.format(name, n_calls, elapsed, elapsed / n_calls * 1000 if n_calls > 0 else 0))
+
+        for cache in ('parse_cache', 'row_cache'):
+            hit_rate = self.hit_rate(cache)
+            if hit_rate is not None:
+                print('{} hit rate: {:.1f}%'.format(cache.replace('_', ' ').capitalize(), hit_rate * 100))
+        if self.peak_memory_mb is not None:
+            print('Peak memory: {:.0f} MB'.format(self.peak_memory_mb))
@@ -0,0 +1,333 @@
+"""
+Output sinks for the coded data: one row per trial, written as soon as the trial is coded;
+and the in-memory table of per-word results
+"""
+import csv
+import math
+import pickle
+import tempfile
+from array import array
+
+import numpy as np
+
+
+#---------------------------------------------------------------------------
+def create_writer(out_format, filename_prefix, col_names):
+    """
+    Create a writer for the coded rows
+
+    :param out_format: 'xlsx', 'csv' or 'parquet'
+    :param filename_prefix: Output file name, without the extension
+    :param col_names: Names of the output columns
+    """
+    if out_format == 'xlsx':
+        return XlsxWriter(filename_prefix + '.xlsx', col_names)
+    elif out_format == 'csv':
+        return CsvWriter(filename_prefix + '.csv', col_names)
+    elif out_format == 'parquet':
+        return ParquetWriter(filename_prefix + '.parquet', col_names)
+    else:
+        raise ValueError('Unsupported output format "{}"'.format(out_format))
+
+
+# noinspection PyMethodMayBeStatic
+class CodedRowsWriter(object):
+    """
+    Base class for the output writers. Rows are written with write_row(); the file is complete only after close().
+    """
+
+    def __init__(self, filename, col_names):
+        self.filename = filename
+        self.col_names = tuple(col_names)
+        self.n_rows = 0
+
+    def write_row(self, values):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+#---------------------------------------------------------------------------
+class _RowSpool(object):
+    """
+    Rows pickled to a temporary file in batches, so that they can be re-read after all rows were seen
+    """
+
+    def __init__(self, batch_size=1000):
+        self._file = tempfile.TemporaryFile()
+        self._batch = []
+        self._batch_size = batch_size
+
+    def append(self, row):
+        self._batch.append(row)
+        if len(self._batch) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        if len(self._batch) > 0:
+            pickle.dump(self._batch, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+            self._batch = []
+
+    def iter_batches(self):
+        self._flush()
+        self._file.seek(0)
+        while True:
+            try:
+                yield pickle.load(self._file)
+            except EOFError:
+                return
+
+    def close(self):
+        self._file.close()
+
+
+#---------------------------------------------------------------------------
+class XlsxWriter(CodedRowsWriter):
+    """
+    Excel output. An xlsx file must declare the column widths before its rows, so the rows are spooled to a temporary
+    file while the widths are tracked, and streamed into a write-only workbook on close().
+    """
+
+    def __init__(self, filename, col_names):
+        super().__init__(filename, col_names)
+        self._spool = _RowSpool()
+        self.col_widths = [len(c) for c in self.col_names]
+
+    def write_row(self, values):
+        widths = self.col_widths
+        for i, v in enumerate(values):
+            if isinstance(v, str) and len(v) > widths[i]:
+                widths[i] = len(v)
+
+        self._spool.append(values)
+        self.n_rows += 1
+
+    def close(self):
+        import openpyxl
+        from openpyxl.utils import get_column_letter
+
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.freeze_panes = 'A2'
+        for i, width in enumerate(self.col_widths):
+            ws.column_dimensions[get_column_letter(i+1)].width = width
+
+        ws.append(self.col_names)
+        for batch in self._spool.iter_batches():
+            for row in batch:
+                ws.append(row)
+
+        wb.save(self.filename)
+        self._spool.close()
+
+
+#---------------------------------------------------------------------------
+class CsvWriter(CodedRowsWriter):
+
+    def __init__(self, filename, col_names):
+        super().__init__(filename, col_names)
+        self._file = open(filename, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.col_names)
+
+    def write_row(self, values):
+        self._writer.writerow(['' if v is None else v for v in values])
+        self.n_rows += 1
+
+    def close(self):
+        self._file.close()
+
+
+#---------------------------------------------------------------------------
+class ParquetWriter(CodedRowsWriter):
+    """
+    Parquet output (requires pyarrow). A column is numeric if all its values are numbers, otherwise it is saved as text.
+    The column types are known only after all rows were seen, so the rows are spooled until close().
+    """
+
+    def __init__(self, filename, col_names, row_group_size=10000):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError('Saving the coded data as parquet requires the pyarrow package')
+
+        super().__init__(filename, col_names)
+        self.row_group_size = row_group_size
+        self._spool = _RowSpool()
+        self._col_types = [None] * len(self.col_names)
+
+    def write_row(self, values):
+        types = self._col_types
+        for i, v in enumerate(values):
+            types[i] = _merge_col_type(types[i], v)
+
+        self._spool.append(values)
+        self.n_rows += 1
+
+    def close(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pa_types = {None: pa.string(), 'int': pa.int64(), 'float': pa.float64(), 'str': pa.string()}
+        schema = pa.schema([(c, pa_types[t]) for c, t in zip(self.col_names, self._col_types)])
+        to_str = [t == 'str' for t in self._col_types]
+
+        rows = []
+        with pq.ParquetWriter(self.filename, schema) as writer:
+            for batch in self._spool.iter_batches():
+                rows.extend(batch)
+                if len(rows) >= self.row_group_size:
+                    writer.write_table(self._to_table(rows, schema, to_str))
+                    rows = []
+            if len(rows) > 0 or self.n_rows == 0:
+                writer.write_table(self._to_table(rows, schema, to_str))
+
+        self._spool.close()
+
+    def _to_table(self, rows, schema, to_str):
+        import pyarrow as pa
+        columns = []
+        for i in range(len(self.col_names)):
+            values = [r[i] for r in rows]
+            if to_str[i]:
+                values = [None if v is None else str(v) for v in values]
+            columns.append(pa.array(values, type=schema.field(i).type))
+        return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _merge_col_type(curr_type, value):
+    if value is None or curr_type == 'str':
+        return curr_type
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return 'str'
+    if isinstance(value, float) or curr_type == 'float':
+        return 'float'
+    return 'int'
+
+
+#---------------------------------------------------------------------------
+class WordResults(object):
+    """
+    The per-word results: one record per target word, with the values of "columns".
+
+    The records are kept in column buffers. The numeric columns are typed arrays, and the other columns (subject,
+    condition, target, response etc., which repeat for all words of a trial and for many trials) are dictionary-encoded:
+    each distinct value is stored once, and the column buffer has the index of each record's value.
+    """
+
+    columns = ('subject', 'block', 'condition', 'item_num', 'n_target_words', 'target', 'response', 'word_order',
+               'word_class', 'word_class_order', 'target_word', 'word_ok', 'digit_ok')
+
+    #-- Column kinds: 'int' = int64 array; 'flag' = 0/1/None (int8 array, -1 = None); the default is dictionary-encoded
+    _column_kinds = dict(n_target_words='int', word_order='int', word_ok='int', digit_ok='flag')
+
+    def __init__(self):
+        self._kinds = [self._column_kinds.get(c, 'dict') for c in self.columns]
+        self._buffers = [array('b') if k == 'flag' else array('q') if k == 'int' else array('i') for k in self._kinds]
+        self._value_codes = [{} if k == 'dict' else None for k in self._kinds]
+        self._values = [[] if k == 'dict' else None for k in self._kinds]
+        self._n_records = 0
+
+    def __len__(self):
+        return self._n_records
+
+    def append(self, record):
+        """ Add a record: a tuple with one value per column """
+        for value, kind, buffer, value_codes, values in zip(record, self._kinds, self._buffers, self._value_codes, self._values):
+            if kind == 'dict':
+                #-- The type is part of the key, so 1, 1.0 and True remain different values
+                key = value.__class__, value
+                code = value_codes.get(key)
+                if code is None:
+                    code = len(values)
+                    value_codes[key] = code
+                    values.append(value)
+                buffer.append(code)
+            elif kind == 'flag':
+                buffer.append(-1 if value is None else value)
+            else:
+                buffer.append(value)
+
+        self._n_records += 1
+
+    def extend(self, records):
+        """ Add records: tuples, or the records of another WordResults """
+        for record in records:
+            self.append(record)
+
+    def column(self, name):
+        """ The values of one column (a list) """
+        i = self.columns.index(name)
+        kind, buffer = self._kinds[i], self._buffers[i]
+        if kind == 'dict':
+            values = self._values[i]
+            return [values[c] for c in buffer]
+        elif kind == 'flag':
+            return [None if c < 0 else c for c in buffer]
+        else:
+            return buffer.tolist()
+
+    def __iter__(self):
+        return zip(*[self.column(c) for c in self.columns])
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame({c: self.column(c) for c in self.columns})
+
+    def save(self, filename_prefix, out_format='csv'):
+        """
+        Save the records to a file
+
+        :param filename_prefix: File name, without the extension
+        :param out_format: 'csv' or 'parquet'
+        """
+        if out_format == 'csv':
+            self.to_dataframe().to_csv(filename_prefix + '.csv', index=False)
+        elif out_format == 'parquet':
+            self._save_parquet(filename_prefix + '.parquet')
+        else:
+            raise ValueError('Unsupported output format for the per-word results "{}"'.format(out_format))
+
+    def _save_parquet(self, filename):
+        """
+        Save as parquet (requires pyarrow). Dictionary-encoded columns are saved as parquet dictionary columns;
+        their type is numeric if all values are numbers, otherwise text.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Saving the per-word results as parquet requires the pyarrow package')
+
+        arrays = []
+        for kind, buffer, values in zip(self._kinds, self._buffers, self._values):
+            if kind == 'int':
+                arrays.append(pa.array(np.frombuffer(buffer, dtype=np.int64)))
+
+            elif kind == 'flag':
+                codes = np.frombuffer(buffer, dtype=np.int8)
+                arrays.append(pa.array(codes, mask=codes < 0))
+
+            else:
+                col_type = None
+                for v in values:
+                    col_type = _merge_col_type(col_type, v)
+
+                is_null = np.array([v is None or (isinstance(v, float) and math.isnan(v)) for v in values], dtype=bool)
+                if col_type in ('int', 'float'):
+                    dictionary = pa.array([0 if n else v for v, n in zip(values, is_null)],
+                                          type=pa.int64() if col_type == 'int' else pa.float64())
+                else:
+                    dictionary = pa.array(['' if n else str(v) for v, n in zip(values, is_null)], type=pa.string())
+
+                indices = np.frombuffer(buffer, dtype=np.int32)
+                arrays.append(pa.DictionaryArray.from_arrays(pa.array(indices, mask=is_null[indices]), dictionary))
+
+        pq.write_table(pa.Table.from_arrays(arrays, names=list(self.columns)), filename)
@@ -1,6 +1,11 @@
+import os
+import shutil
+import tempfile
 import unittest
+import unittest.mock
 
 from sc.markerr import *
+import sc.matcher
 
 
 #------------------------------------------------------
@@ -130,6 +135,210 @@ class RealScenarios(unittest.TestCase):
         self.assertEqual((0, 0, 0), get_n_errors('48725', '+'))
 
 
+#============================================================================================
+class ParseCacheTests(unittest.TestCase):
+
+    def test_repeated_text_is_a_hit(self):
+        cache = ParseCache()
+        ea = ErrorAnalyzer(parse_cache=cache)
+        ea.parse_target('3 t 450 / 27', 0)
+        ea.parse_target('3 t 450 / 27', 0)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_same_result_as_uncached(self):
+        cached = ErrorAnalyzer(parse_cache=ParseCache())
+        uncached = ErrorAnalyzer(parse_cache=False)
+        for raw in ('3 t 450 / 27', '21 / 1000 / 2', 48725, 234.0, '1,234'):
+            cached.parse_target_or_response(raw, 0)
+            self.assertEqual(uncached.parse_target_or_response(raw, 0), cached.parse_target_or_response(raw, 0))
+
+    def test_settings_are_part_of_the_key(self):
+        cache = ParseCache()
+        ErrorAnalyzer(parse_cache=cache, consider_thousand_as_digit=True).parse_target('1000', 0)
+        ErrorAnalyzer(parse_cache=cache, consider_thousand_as_digit=False).parse_target('1000', 0)
+        self.assertEqual((0, 2), (cache.hits, cache.misses))
+
+    def test_size_is_bounded(self):
+        cache = ParseCache(maxsize=2)
+        ea = ErrorAnalyzer(parse_cache=cache)
+        for raw in ('1', '2', '3'):
+            ea.parse_target(raw, 0)
+        self.assertEqual(2, len(cache))
+
+
+#---------------------------------------------------------------------------------
+class IncrementalCodingTests(unittest.TestCase):
+
+    header = ('Block', 'Condition', 'ItemNum', 'target', 'response', 'NWordsPerTarget', 'exclude', 'manual')
+    rows = [(1, 'A', 1, '3 t 450 / 27', '+', 5, None, None), (1, 'A', 2, '48725', '48 t 735', 6, None, None),
+            (1, 'B', 3, '234', '-', 3, None, None)]
+
+    def _code(self, ea, rows, prev_row_results):
+        out_rows, words, row_results = [], [], {}
+        col_inds = ea._xls_structure(self.header)
+        ea.code_worksheet('s1', col_inds, rows, out_rows.append, words, prev_row_results, row_results)
+        return out_rows, words, row_results
+
+    def test_unchanged_rows_are_reused(self):
+        ea = ErrorAnalyzer(subj_id_in_xls=False)
+        _, _, row_results = self._code(ea, self.rows, {})
+        changed_rows = [self.rows[0], (1, 'A', 2, '48725', '+', 6, None, None), self.rows[2]]
+        out_rows, words, new_row_results = self._code(ea, changed_rows, row_results)
+
+        expected_rows, expected_words, _ = self._code(ErrorAnalyzer(subj_id_in_xls=False), changed_rows, {})
+        self.assertEqual(expected_rows, out_rows)
+        self.assertEqual(expected_words, words)
+        self.assertEqual(2, sum(r in row_results.values() for r in new_row_results.values()))
+
+    def test_config_hash_depends_on_mtl_version(self):
+        ea = ErrorAnalyzer(subj_id_in_xls=False)
+        with unittest.mock.patch('sc.markerr._mtl_version', return_value='1.0'):
+            hash1 = ea.config_hash()
+        with unittest.mock.patch('sc.markerr._mtl_version', return_value='1.1'):
+            self.assertNotEqual(hash1, ea.config_hash())
+
+
+#---------------------------------------------------------------------------------
+class HookTests(unittest.TestCase):
+
+    header = IncrementalCodingTests.header
+    rows = IncrementalCodingTests.rows
+    _code = IncrementalCodingTests._code
+
+    def _manual_value(self, analyzer):
+        out_rows, _, _ = self._code(analyzer, self.rows[:1], {})
+        return out_rows[0][analyzer.xls_out_cols.index('manual')]
+
+    def test_new_hook_signature(self):
+        class NewAnalyzer(ErrorAnalyzer):
+            def custom_process_row(self, in_row, out_row, in_rownum, col_inds):
+                self._save_value(out_row, 'manual', in_row[col_inds['target']] + 'x')
+
+        self.assertEqual('3 t 450 / 27x', self._manual_value(NewAnalyzer(subj_id_in_xls=False)))
+
+    def test_old_hook_signature(self):
+        with self.assertWarns(DeprecationWarning):
+            class OldAnalyzer(ErrorAnalyzer):
+                def custom_process_row(self, in_ws, out_ws, in_rownum, out_rownum, col_inds):
+                    self._save_value(out_ws, out_rownum, 'manual', in_ws.cell(in_rownum, col_inds['target']).value + 'x')
+
+        self.assertEqual('3 t 450 / 27x', self._manual_value(OldAnalyzer(subj_id_in_xls=False)))
+
+    def test_old_save_value_signature(self):
+        with self.assertWarns(DeprecationWarning):
+            class OldAnalyzer(ErrorAnalyzer):
+                def _save_value(self, out_ws, rownum, colname, value):
+                    out_ws.cell(rownum, 1 + self.xls_out_cols.index(colname)).value = 'y' if colname == 'manual' else value
+
+                def custom_process_row(self, in_ws, out_ws, in_rownum, out_rownum, col_inds):
+                    self._save_value(out_ws, out_rownum, 'manual', 'x')
+
+        self.assertEqual('y', self._manual_value(OldAnalyzer(subj_id_in_xls=False)))
+
+
+#---------------------------------------------------------------------------------
+class IterCodeTests(unittest.TestCase):
+
+    header = IncrementalCodingTests.header
+    rows = IncrementalCodingTests.rows + [(1, 'B', 4, '56', '56', 3, None, None), (1, 'B', 5, '7', '7', 1, 1, None)]
+
+    def test_same_as_code_worksheet(self):
+        ea = ErrorAnalyzer(subj_id_in_xls=False)
+        out_rows, words = [], []
+        ea.code_worksheet('s1', ea._xls_structure(self.header), self.rows, out_rows.append, words)
+
+        results = list(ea.iter_code((dict(zip(self.header, r)) for r in self.rows), worksheet='s1'))
+        self.assertEqual(['ok', 'ok', 'ok', 'error', 'excluded'], [r.status for r in results])
+        self.assertEqual([dict(zip(ea.xls_out_cols, r)) for r in out_rows], [r.row for r in results if r.status == 'ok'])
+        self.assertEqual([dict(zip(WordResults.columns, w)) for w in words], [w for r in results for w in r.words])
+
+    def test_lazy(self):
+        ea = ErrorAnalyzer(subj_id_in_xls=False)
+        trials = iter([dict(zip(self.header, r)) for r in self.rows])
+        next(ea.iter_code(trials))
+        self.assertEqual(len(self.rows) - 1, len(list(trials)))
+
+
+#---------------------------------------------------------------------------------
+class PipelineTests(unittest.TestCase):
+
+    def setUp(self):
+        import openpyxl
+        self.dir = tempfile.mkdtemp()
+        self.in_fn = os.path.join(self.dir, 'raw.xlsx')
+        wb = openpyxl.Workbook()
+        for i_ws, name in enumerate(('s1', 's2')):
+            ws = wb.active if i_ws == 0 else wb.create_sheet()
+            ws.title = name
+            ws.append(IncrementalCodingTests.header)
+            for row in IncrementalCodingTests.rows * 5:
+                ws.append(row)
+        wb.save(self.in_fn)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _run(self, prefix, **kwargs):
+        summary = ErrorAnalyzer(subj_id_in_xls=False).run_for_worksheets(self.in_fn, out_dir=self.dir, out_fn_prefix=prefix,
+                                                                         out_format='csv', **kwargs)
+        with open(os.path.join(self.dir, prefix + '.csv')) as fp:
+            return summary, fp.read()
+
+    def test_same_as_serial(self):
+        serial, expected = self._run('serial')
+        summary, result = self._run('pipeline', pipeline=True, n_jobs=2, chunk_size=4, queue_size=2)
+        self.assertEqual(expected, result)
+        self.assertEqual(serial.n_rows, summary.n_rows)
+        self.assertEqual(['read', 'code', 'write'], [s.stage for s in summary.stages])
+        self.assertEqual([30, 30, 30], [s.n_rows for s in summary.stages])
+
+
+#---------------------------------------------------------------------------------
+class InstrumentTests(unittest.TestCase):
+
+    def test_stages_are_timed(self):
+        ea = ErrorAnalyzer(subj_id_in_xls=False, instrument=True, parse_cache=ParseCache())
+        ea._start_stats()
+        ea.code_worksheet('s1', ea._xls_structure(IncrementalCodingTests.header), IncrementalCodingTests.rows * 2, None, [])
+        ea._count_cache_use()
+
+        self.assertEqual(6, ea.stats.timers['parse_row'][0])
+        self.assertEqual(6, ea.stats.timers['parse_target'][0])
+        self.assertAlmostEqual(0.5, ea.stats.hit_rate('parse_cache'))
+
+    def test_not_instrumented(self):
+        ea = ErrorAnalyzer()
+        ea._start_stats()
+        self.assertIsNone(ea.stats)
+        self.assertNotIn('parse_row', ea.__dict__)
+
+    def test_pickled_analyzer_has_its_own_stats(self):
+        import pickle
+        ea = ErrorAnalyzer(instrument=True)
+        ea._start_stats()
+        ea.parse_target('12', 0)
+        copy = pickle.loads(pickle.dumps(ea))
+        self.assertEqual(0, copy.stats.timers['parse_target'][0])
+
+
+#---------------------------------------------------------------------------------
+class BatchMatcherTests(unittest.TestCase):
+
+    def test_same_as_per_row_matching(self):
+        ea = ErrorAnalyzer()
+        trials = [('3 t 450 / 27', '3 t 540 / 27'), ('48725', '48 t 725'), ('234', '243'), ('2 / 3', '3 / 2'),
+                  ('5 t 12', '12 t 5'), ('12 t 345', '1 t 2'), ('22', '2'), ('222', '22'), ('101', '11'), ('7000 / 45', '45')]
+        targets, responses = [], []
+        for raw_target, raw_response in trials:
+            target, target_segments = ea.parse_target(raw_target, 0)
+            targets.append(list(target))
+            responses.append(ea.collapse_segments(ea.parse_response(raw_response, 0, target_segments)))
+
+        expected = [(list(ea.target_items_said(t, r)[0]), list(ea.target_items_said(t, r)[1]), ea._n_missing_classes(t, r))
+                    for t, r in zip(targets, responses)]
+        self.assertEqual(expected, sc.matcher.match_trials(targets, responses))
+
+
 
 if __name__ == '__main__':
     unittest.main()
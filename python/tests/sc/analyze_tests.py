@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from sc.analyze import *
+
+
+#---------------------------------------------------------------------------------
+class AggregateCubeTests(unittest.TestCase):
+
+    df = pd.DataFrame(dict(Subject=[1, 1, 1, 1, 2, 2, 2], Condition=['A', 'A', 'B', 'B', 'A', 'B', 'B'],
+                           ItemNum=[1, 2, 1, 2, 1, 1, 2], PMissingDigits=[0, 0.5, 1, 0.25, np.nan, 0.75, 0.25]))
+
+    def test_same_as_masks(self):
+        cube = AggregateCube(self.df, 'PMissingDigits')
+        for subj in (1, 2):
+            for cond in ('A', 'B'):
+                values = self.df[(self.df.Subject == subj) & (self.df.Condition == cond)].PMissingDigits
+                if values.count() == 0:
+                    self.assertTrue(np.isnan(cube.mean()[(subj, cond)]))
+                else:
+                    self.assertAlmostEqual(values.mean(), cube.mean()[(subj, cond)])
+                if values.count() > 1:
+                    self.assertAlmostEqual(values.var(), cube.var()[(subj, cond)])
+
+    def test_coarser_grouping(self):
+        cube = AggregateCube(self.df, 'PMissingDigits', by=('Subject', 'Condition', 'ItemNum'))
+        table = cube.mean_table()
+        self.assertAlmostEqual(0.5, table.at[2, 'B'])
+        self.assertTrue(np.isnan(table.at[2, 'A']))
+
+    def test_cached_cube_after_edit(self):
+        df = self.df.copy()
+        self.assertAlmostEqual(0.25, get_cube(df, 'PMissingDigits').mean()[(1, 'A')])
+        df.loc[0, 'PMissingDigits'] = 1
+        self.assertAlmostEqual(0.75, get_cube(df, 'PMissingDigits').mean()[(1, 'A')])
+
+
+#---------------------------------------------------------------------------------
+class DataSummaryTests(unittest.TestCase):
+
+    df = pd.DataFrame(dict(Subject=[1, 1, 1, 2, 2, 2], Condition=['A', 'B', 'B', 'A', 'A', 'B'],
+                           PMissingDigits=[0, 0.5, 1, 0.25, np.nan, 0.75], PMissingClasses=[1, 0, 0, 1, 1, 0]))
+
+    def test_same_as_masks(self):
+        summary = DataSummary(self.df, ['PMissingDigits', 'PMissingClasses'])
+        for dv in ('PMissingDigits', 'PMissingClasses'):
+            means = summary.mean(dv, ['Condition'])
+            for cond in ('A', 'B'):
+                self.assertAlmostEqual(self.df[self.df.Condition == cond][dv].mean(), means[cond])
+
+    def test_where(self):
+        summary = DataSummary(self.df, ['PMissingDigits']).where(Subject=2)
+        self.assertEqual([2], list(summary.levels('Subject')))
+        self.assertAlmostEqual(0.25, summary.mean('PMissingDigits', ['Condition'])['A'])
+
+    def test_missing_dependent_var(self):
+        self.assertRaises(ValueError, lambda: DataSummary(self.df, ['PMissingDigits']).cube('PMissingClasses'))
+
+
+#---------------------------------------------------------------------------------
+class PairedTestsTests(unittest.TestCase):
+
+    def test_same_as_ttest_rel(self):
+        rng = np.random.default_rng(1)
+        df = pd.DataFrame(dict(Subject=np.repeat([1, 2, 3], 20), Condition=np.tile(np.repeat(['A', 'B'], 10), 3),
+                               ItemNum=np.tile(np.arange(10), 6), PMissingDigits=rng.random(60), PMissingClasses=rng.random(60)))
+        results = paired_tests_per_subj(df, [('A', 'B')], ['PMissingDigits', 'PMissingClasses'])
+
+        for r in results[results.predicted_direction].itertuples():
+            sdf = df[df.Subject == r.subject]
+            t, p = scipy.stats.ttest_rel(sdf[sdf.Condition == 'A'][r.measure], sdf[sdf.Condition == 'B'][r.measure])
+            self.assertAlmostEqual(t, r.t)
+            self.assertAlmostEqual(p / 4, r.p)
+
+
+if __name__ == '__main__':
+    unittest.main()
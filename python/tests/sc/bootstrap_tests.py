@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy as np
+import pandas as pd
+
+from sc.bootstrap import *
+
+
+def _create_data():
+    rng = np.random.default_rng(0)
+    rows = [dict(Subject='s{}'.format(subj), Condition=cond, ItemNum=item, block=item // 5,
+                 acc=float(rng.random() < 0.5 + 0.3 * (cond == 'B')))
+            for subj in range(8) for cond in ('A', 'B') for item in range(10)]
+    return pd.DataFrame(rows).iloc[3:]
+
+
+#---------------------------------------------------------------------------------
+class BootstrapMeansTests(unittest.TestCase):
+
+    def setUp(self):
+        clear_cache()
+
+    def test_pooled_mean(self):
+        df = _create_data()
+        result = bootstrap_means(df, 'acc', n_boot=200)
+        expected = df.groupby('Condition').acc.mean()
+        self.assertEqual(list(expected.index), list(result.index))
+        self.assertTrue(np.allclose(expected.values, result['mean'].values))
+        self.assertTrue(all(result.low <= result['mean']) and all(result['mean'] <= result.high))
+
+    def test_subject_mean(self):
+        df = _create_data()
+        result = bootstrap_means(df, 'acc', groups=('Condition', 'block'), statistic='subject_mean', items=True, n_boot=200)
+        expected = df.groupby(['Condition', 'block', 'Subject']).acc.mean().groupby(level=[0, 1]).mean()
+        self.assertTrue(np.allclose(expected.values, result['mean'].reindex(expected.index).values))
+
+    def test_reproducible_with_seed(self):
+        df = _create_data()
+        r1 = bootstrap_means(df, 'acc', n_boot=100, chunk_size=30, seed=5, use_cache=False)
+        r2 = bootstrap_means(df, 'acc', n_boot=100, chunk_size=30, seed=5, use_cache=False)
+        self.assertTrue(r1.equals(r2))
+
+    def test_subject_effects(self):
+        df = _create_data()
+        result = bootstrap_subject_effects(df, 'acc', 'A', 'B', n_boot=200)
+        means = df.groupby(['Subject', 'Condition']).acc.mean().unstack()
+        self.assertTrue(np.allclose((means.B - means.A).values, result.effect.reindex(means.index).values))
+
+    def test_cache_dir(self):
+        df = _create_data()
+        cache_dir = tempfile.mkdtemp()
+        try:
+            r1 = bootstrap_means(df, 'acc', n_boot=100, cache_dir=cache_dir)
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+
+            #-- A new process: the result is loaded from the file, without aggregating the data again
+            clear_cache()
+            with unittest.mock.patch('sc.bootstrap.AggregateCube', side_effect=AssertionError):
+                r2 = bootstrap_means(df, 'acc', n_boot=100, cache_dir=cache_dir)
+            self.assertTrue(r1.equals(r2))
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
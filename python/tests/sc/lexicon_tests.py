@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from sc.lexicon import *
+
+digit_mapping = {str(d): d for d in range(10)}
+
+
+#---------------------------------------------------------------------------------
+class LexiconTests(unittest.TestCase):
+
+    def test_same_as_conversion(self):
+        for consider_thousand_as_digit in (True, False):
+            lexicon = Lexicon(digit_mapping, consider_thousand_as_digit)
+            for segment in ('7', '12', '305', 'x4', '5000', 't'):
+                self.assertEqual(segment_to_words(segment, digit_mapping, consider_thousand_as_digit), list(lexicon.words(segment)))
+
+    def test_segment_not_in_lexicon(self):
+        self.assertIsNone(Lexicon(digit_mapping, True).words('12345'))
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            lexicon = Lexicon(digit_mapping, False)
+            lexicon.save(directory)
+            loaded = Lexicon.load(directory, digit_mapping, False)
+            self.assertEqual(len(lexicon), len(loaded))
+            for segment in segment_space(digit_mapping):
+                self.assertEqual(lexicon.words(segment), loaded.words(segment))
+            self.assertIsInstance(loaded.table, np.memmap)
+            self.assertIsNone(loaded.words('12345'))
+            self.assertIsNone(Lexicon.load(directory, digit_mapping, True))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_concurrent_saves(self):
+        directory = tempfile.mkdtemp()
+        try:
+            lexicon = Lexicon(digit_mapping, True)
+            threads = [threading.Thread(target=lexicon.save, args=(directory, )) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual([os.path.basename(lexicon.filename(directory))], os.listdir(directory))
+            self.assertEqual(len(lexicon), len(Lexicon.load(directory, digit_mapping, True)))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import sc.loader
+from sc.loader import *
+
+
+#---------------------------------------------------------------------------------
+class LoadDataTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'data.csv')
+        self._write(['A', 'B', 'A', 'B'])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, conditions):
+        pd.DataFrame(dict(Subject=[1, 1, 2, 2], Condition=conditions, Target=['12', '3 / 4', '56', '7'],
+                          PMissingMorphemes=[0.0, 0.5, 0.25, 1.0])).to_csv(self.filename, index=False)
+
+    def test_cached_data_is_identical(self):
+        df1 = load_data(self.filename)
+        df2 = load_data(self.filename)
+        self.assertTrue(os.path.isdir(os.path.join(self.dir, cache_dir_name)))
+        pd.testing.assert_frame_equal(df1, df2)
+        self.assertIsInstance(df2.Condition.dtype, pd.CategoricalDtype)
+        self.assertEqual(['12', '3 / 4', '56', '7'], list(df2.Target))
+
+    def test_modified_file_is_reloaded(self):
+        load_data(self.filename)
+        self._write(['A', 'B', 'C', 'C'])
+        os.utime(self.filename, ns=(0, 0))
+        self.assertEqual(['A', 'B', 'C', 'C'], list(load_data(self.filename).Condition))
+
+    def test_touched_file_uses_cache(self):
+        df1 = load_data(self.filename)
+        os.utime(self.filename, ns=(0, 0))
+        pd.testing.assert_frame_equal(df1, load_data(self.filename))
+
+    def test_no_categorical(self):
+        df = load_data(self.filename, categorical=None)
+        self.assertNotIsInstance(df.Condition.dtype, pd.CategoricalDtype)
+
+    def test_object_columns(self):
+        import pyarrow as pa
+
+        df = pd.DataFrame(dict(Target=pd.Series([48725, '3 t 450', np.nan, 2.5, True], dtype=object),
+                               Response=pd.Series(['12', '3 / 4', np.nan, '+', '-'], dtype=object),
+                               Other=pd.Series([(1, 2), 'x', None, 3, 4.0], dtype=object)))
+        table = sc.loader._to_arrow(df, dict(version=sc.loader._version))
+        sidecar_fn = os.path.join(self.dir, 'sidecar.feather')
+        with pa.OSFile(sidecar_fn, 'wb') as fp, pa.ipc.new_file(fp, table.schema) as writer:
+            writer.write_table(table)
+
+        self.assertTrue(pa.types.is_string(table.schema.field('Response').type))
+        self.assertTrue(pa.types.is_string(table.schema.field('Target').type))
+        _, loaded = sc.loader._read_feather(sidecar_fn, True)
+        pd.testing.assert_frame_equal(df, loaded)
+        self.assertEqual([int, str, float, float, bool], [type(v) for v in loaded.Target])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import itertools
+import unittest
+
+import numpy as np
+
+from sc.permutation import *
+
+
+#---------------------------------------------------------------------------------
+class SignFlipTests(unittest.TestCase):
+
+    deltas = np.array([0.3, -0.1, 0.25, 0.05, 0.4, -0.2, 0.15, 0.1])
+
+    def test_exact_when_all_permutations_fit(self):
+        result = sign_flip_test(self.deltas, n_permutations=1000)
+        all_means = [np.mean(np.array(signs) * self.deltas) for signs in itertools.product((1, -1), repeat=len(self.deltas))]
+        self.assertTrue(result.exact)
+        self.assertAlmostEqual(np.mean(np.array(all_means) >= self.deltas.mean() - 1e-12), result.p)
+
+    def test_reproducible_with_seed(self):
+        r1 = sign_flip_test(self.deltas, n_permutations=50, chunk_size=7, seed=3)
+        r2 = sign_flip_test(self.deltas, n_permutations=50, chunk_size=7, seed=3)
+        self.assertFalse(r1.exact)
+        self.assertEqual(r1, r2)
+
+
+#---------------------------------------------------------------------------------
+class LabelShuffleTests(unittest.TestCase):
+
+    def test_identical_groups_are_not_significant(self):
+        result = label_shuffle_test([1, 2, 3, 4], [1, 2, 3, 4], n_permutations=2000, seed=1)
+        self.assertGreater(result.p, 0.4)
+
+
+if __name__ == '__main__':
+    unittest.main()
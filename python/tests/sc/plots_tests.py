@@ -0,0 +1,98 @@
+import inspect
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy as np
+import pandas as pd
+
+import sc.bootstrap
+from sc.plots import *
+
+
+#---------------------------------------------------------------------------------
+class RenderFiguresTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.df = pd.DataFrame(dict(Subject=[1, 1, 2, 2], Condition=['A', 'B', 'A', 'B'], PMissingMorphemes=[0.1, 0.2, 0.3, 0.2]))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _render(self):
+        jobs = [FigureJob(plot_cond_means, os.path.join(self.dir, 'means.png'), self.df, dependent_var='PMissingMorphemes')]
+        return [r.status for r in render_figures(jobs, n_jobs=1)]
+
+    def test_unchanged_figure_is_skipped(self):
+        self.assertEqual(['rendered'], self._render())
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'means.png')))
+        self.assertEqual(['skipped'], self._render())
+
+    def test_changed_data_is_rendered(self):
+        self._render()
+        self.df.loc[0, 'PMissingMorphemes'] = 0.5
+        self.assertEqual(['rendered'], self._render())
+
+    def test_changed_bootstrap_code_is_rendered(self):
+        self._render()
+        changed_fn = os.path.join(self.dir, 'bootstrap.py')
+        with open(inspect.getsourcefile(sc.bootstrap)) as fp, open(changed_fn, 'w') as out:
+            out.write(fp.read() + '\n# changed\n')
+
+        getsourcefile = inspect.getsourcefile
+        with unittest.mock.patch('inspect.getsourcefile', lambda m: changed_fn if m is sc.bootstrap else getsourcefile(m)):
+            self.assertEqual(['rendered'], self._render())
+
+    def test_function_and_array_parameters(self):
+        def render(colors, get_subj_id_func):
+            jobs = [FigureJob(plot_2cond_means_per_subject, os.path.join(self.dir, 'subj.png'), self.df, dependent_var='PMissingMorphemes',
+                              conds=['A', 'B'], colors=colors, get_subj_id_func=get_subj_id_func)]
+            return [r.status for r in render_figures(jobs, n_jobs=1)]
+
+        self.assertEqual(['rendered'], render(np.array([0.3, 0.6, 0.8]), str))
+        self.assertEqual(['skipped'], render(np.array([0.3, 0.6, 0.8]), str))
+        self.assertEqual(['rendered'], render(np.array([0.3, 0.6, 0.9]), str))
+        self.assertEqual(['rendered'], render(np.array([0.3, 0.6, 0.9]), repr))
+
+    def test_unsupported_parameter(self):
+        jobs = [FigureJob(plot_cond_means, os.path.join(self.dir, 'means.png'), self.df, dependent_var='PMissingMorphemes', colors=object())]
+        self.assertRaises(TypeError, lambda: render_figures(jobs, n_jobs=1))
+
+    def test_failure(self):
+        jobs = [FigureJob('plot_cond_means', os.path.join(self.dir, 'bad.png'), self.df, dependent_var='no_such_column')]
+        self.assertEqual(['failed'], [r.status for r in render_figures(jobs, n_jobs=1)])
+
+
+
+#---------------------------------------------------------------------------------
+class DataSummaryPlotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_plot_summary(self):
+        df = pd.DataFrame(dict(Subject=[1, 1, 2, 2], Condition=['A', 'B', 'A', 'B'], PMissingMorphemes=[0.1, 0.2, 0.3, 0.2]))
+        summary = DataSummary(df, ['PMissingMorphemes'])
+        plot_cond_means(summary, 'PMissingMorphemes', os.path.join(self.dir, 'means.png'))
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'means.png')))
+
+    def test_figure_is_returned_without_saving(self):
+        words = pd.DataFrame(dict(condition=['A', 'A', 'B', 'B'], word_order=[1, 2, 1, 2], n_target_words=2, digit_ok=[1, 0, 1, 1]))
+        fig, ax = plot_digit_accuracy_per_position(words)
+        self.assertEqual(2, len(ax.get_lines()))
+        self.assertEqual([], os.listdir(self.dir))
+
+    def test_summary_without_required_column(self):
+        df = pd.DataFrame(dict(Subject=[1, 2], Condition=['A', 'B'], PMissingMorphemes=[0.1, 0.2]))
+        self.assertRaises(ValueError, lambda: plot_cond_means_multiple_measures(DataSummary(df, ['PMissingMorphemes'], ['Subject']),
+                                                                                 ['PMissingMorphemes']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from sc.power import *
+
+
+def _create_data(effect=0.05):
+    rng = np.random.default_rng(0)
+    rows = []
+    for subj in range(10):
+        subj_intercept = rng.normal(0, 0.1)
+        for cond in ('A', 'B'):
+            for item in range(20 + subj % 3):
+                rows.append(dict(Subject=subj, Condition=cond, ItemNum=item,
+                                 y=0.2 + subj_intercept + effect * (cond == 'B') + rng.normal(0, 0.1)))
+    return pd.DataFrame(rows)
+
+
+#---------------------------------------------------------------------------------
+class RandomInterceptModelTests(unittest.TestCase):
+
+    def test_fit_is_the_within_subject_estimate(self):
+        df = _create_data()
+        model = RandomInterceptModel(df, 'y')
+
+        #-- Same as least squares with a dummy variable per subject
+        x = np.column_stack([(df.Condition == 'B').astype(float)] + [(df.Subject == s).astype(float) for s in range(10)])
+        coefs, sse, _, _ = np.linalg.lstsq(x, df.y.values, rcond=None)
+        self.assertAlmostEqual(coefs[0], model.fit.effect)
+        self.assertEqual(len(df) - 11, model.fit.df)
+        self.assertAlmostEqual(np.sqrt(sse[0] / model.fit.df), model.fit.residual_sd)
+
+    def test_design_recycles_subjects(self):
+        model = RandomInterceptModel(_create_data(), 'y')
+        x, rows_per_subject, _ = model.design(13)
+        self.assertEqual(list(model.rows_per_subject) + list(model.rows_per_subject[:3]), list(rows_per_subject))
+        self.assertEqual(rows_per_subject.sum(), len(x))
+
+    def test_condition_must_vary_within_subjects(self):
+        df = _create_data()
+        df = df[(df.Subject < 5) == (df.Condition == 'A')]
+        self.assertRaises(ValueError, lambda: RandomInterceptModel(df, 'y'))
+
+
+#---------------------------------------------------------------------------------
+class PowerCurveTests(unittest.TestCase):
+
+    def test_power_increases_with_subjects(self):
+        curve = power_curve(_create_data(effect=0.02), 'y', n_subjects=(4, 40), n_sims=300, seed=1)
+        self.assertEqual([4, 40], list(curve.n_subjects))
+        self.assertLess(curve.power[0], curve.power[1])
+
+    def test_no_effect(self):
+        curve = power_curve(_create_data(), 'y', n_subjects=(10, ), n_sims=1000, effect=0, seed=1)
+        self.assertLess(curve.power[0], 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()